@@ -1,32 +1,39 @@
 """FastAPI Chat Server — POST /chat endpoint for AI Agent with MCP tools.
 
 Connects to the Order Management MCP server on startup and exposes
-an HTTP API at port 3000 for external clients (frontend, Postman, curl)
-to chat with the Agent.
+an HTTP API at port 3000 (AGENT_API_PORT) for external clients
+(frontend, Postman, curl) to chat with the Agent.
 
 Usage:
     1. Start the MCP server:  cd mcp-server && python server.py
     2. Start this API:        cd agent && python agent_api.py
+                              (DEV=1 python agent_api.py for auto-reload)
 """
 
+import asyncio
+import logging
+import os
 import re
+import secrets
 import sys
-import traceback
-import uuid
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
 
-from dotenv import load_dotenv
 from fastapi import FastAPI
 from openai import BadRequestError
 from pydantic import BaseModel, Field
 
-from agents import Agent, Runner, trace
+from agents import Agent, ModelSettings, RunResult, Runner, trace
 from agents.mcp import MCPServerStreamableHttp
 from session_store import SessionStore
-from agent_config import AGENT_INSTRUCTIONS, AGENT_MODEL, MCP_SERVER_URL
-
-load_dotenv()
+from history_summary import compact_history, init_history_summary
+from agent_config import (
+    AGENT_API_PORT,
+    AGENT_API_WORKERS,
+    AGENT_INSTRUCTIONS,
+    AGENT_MODEL,
+    MCP_SERVER_URL,
+)
 
 # Add project root for shared imports
 _PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
@@ -38,12 +45,17 @@ from shared.constants import (
     ERROR_NO_OUTPUT,
     ERROR_PROCESSING,
 )
+from shared.http_client import mcp_http_client_factory
+from shared.logging_setup import setup_queue_logger
+
+logger = logging.getLogger("agent_api")
 
 # ════════════════════════════════════════════════════════════
 #  IMAGE MARKER PARSING
 # ════════════════════════════════════════════════════════════
 
-IMG_MARKER_PATTERN = re.compile(r"<<IMG:(IMG_[A-Z]+_\d+)>>")
+# Bounded repetition + ASCII classes: IDs look like IMG_MARKETING_001
+IMG_MARKER_PATTERN = re.compile(r"<<IMG:(IMG_[A-Z]{2,20}_\d{1,8})>>", re.ASCII)
 
 
 def parse_image_markers(text: str) -> tuple[str, list[str]]:
@@ -53,11 +65,22 @@ def parse_image_markers(text: str) -> tuple[str, list[str]]:
         Input:  "สินค้าครบ 3 แบบ <<IMG:IMG_PROD_001>> <<IMG:IMG_REVIEW_001>>"
         Output: ("สินค้าครบ 3 แบบ", ["IMG_PROD_001", "IMG_REVIEW_001"])
     """
-    image_ids = IMG_MARKER_PATTERN.findall(text)
-    clean_text = IMG_MARKER_PATTERN.sub("", text).strip()
-    # Deduplicate while preserving order
-    unique_ids = list(dict.fromkeys(image_ids))
-    return clean_text, unique_ids
+    # Single pass: collect text between markers and image IDs together.
+    # Replies carry at most a few markers, so a list membership test is the
+    # cheapest order-preserving dedup (no dict/set allocation).
+    parts = []
+    image_ids = []
+    last = 0
+    for m in IMG_MARKER_PATTERN.finditer(text):
+        parts.append(text[last:m.start()])
+        image_id = m.group(1)
+        if image_id not in image_ids:
+            image_ids.append(image_id)
+        last = m.end()
+    if not image_ids:
+        return text.strip(), image_ids
+    parts.append(text[last:])
+    return "".join(parts).strip(), image_ids
 
 
 # ════════════════════════════════════════════════════════════
@@ -65,28 +88,38 @@ def parse_image_markers(text: str) -> tuple[str, list[str]]:
 # ════════════════════════════════════════════════════════════
 
 
+_TOOL_ITEM_TYPES = frozenset({"function_call", "function_call_output"})
+_KEPT_ROLES = frozenset({"user", "assistant", "system"})
+
+
+def _canonical_item(item: dict) -> dict:
+    """Rebuild a plain-text message with a fixed (role, content) key order.
+
+    Keeps every stored turn byte-identical when it is re-sent, so the
+    instructions + history prefix stays eligible for OpenAI prompt caching.
+    Structured items (e.g. Responses API output messages) are returned as-is.
+    """
+    content = item.get("content")
+    if isinstance(content, str) and item.get("role") in _KEPT_ROLES:
+        return {"role": item["role"], "content": content}
+    return item
+
+
 def _filter_history_for_storage(items: list) -> list:
     """Filter conversation history to keep only user/assistant text messages.
 
     Removes tool call items (function_call, function_call_output) to prevent
     orphaned references when history is truncated by SessionStore.
+    Assistant outputs in Responses API format (type="message") are kept, as
+    is the "Previously: ..." system note written by history compaction.
     """
-    filtered = []
-    for item in items:
-        if not isinstance(item, dict):
-            continue
-        item_type = item.get("type")
-        # Skip tool-related items
-        if item_type in ("function_call", "function_call_output"):
-            continue
-        role = item.get("role")
-        # Keep user messages
-        if role == "user":
-            filtered.append(item)
-        # Keep assistant message outputs (Responses API format)
-        elif item_type == "message" or role == "assistant":
-            filtered.append(item)
-    return filtered
+    return [
+        _canonical_item(item)
+        for item in items
+        if isinstance(item, dict)
+        and item.get("type") not in _TOOL_ITEM_TYPES
+        and (item.get("role") in _KEPT_ROLES or item.get("type") == "message")
+    ]
 
 
 # ════════════════════════════════════════════════════════════
@@ -95,6 +128,62 @@ def _filter_history_for_storage(items: list) -> list:
 
 session_store = SessionStore()
 
+# ════════════════════════════════════════════════════════════
+#  SESSION WRITE-BEHIND
+# ════════════════════════════════════════════════════════════
+
+# Latest history per session that the writer task has not committed yet
+# (None = pending delete). Reads check this first, so the next turn of a
+# session always sees its own last write even before it reaches SQLite.
+_pending_writes: dict[str, list | None] = {}
+_write_queue: asyncio.Queue | None = None
+
+
+async def _load_history(session_id: str) -> list:
+    """Return session history, preferring a not-yet-committed write."""
+    if session_id in _pending_writes:
+        return list(_pending_writes[session_id] or [])
+    return await asyncio.to_thread(session_store.get, session_id)
+
+
+async def _store_history(session_id: str, history: list | None) -> None:
+    """Queue a save (or a delete when history is None) for the writer task.
+
+    Falls back to a direct write when the writer is not running.
+    """
+    if history is not None:
+        history = session_store.truncate(history)
+    if _write_queue is None:
+        await asyncio.to_thread(session_store.write_batch, [(session_id, history)])
+        return
+    _pending_writes[session_id] = history
+    _write_queue.put_nowait(session_id)
+
+
+async def _drain_writes(queue: asyncio.Queue) -> None:
+    """Writer task: commit everything queued so far in one transaction."""
+    while True:
+        session_ids = [await queue.get()]
+        while not queue.empty():
+            session_ids.append(queue.get_nowait())
+        batch = [
+            (sid, _pending_writes[sid])
+            for sid in dict.fromkeys(session_ids)
+            if sid in _pending_writes
+        ]
+        try:
+            await asyncio.to_thread(session_store.write_batch, batch)
+        except Exception:
+            logger.exception("Failed to write %d session(s)", len(batch))
+        finally:
+            for sid, history in batch:
+                # Keep the shadow entry if a newer write arrived meanwhile
+                if sid in _pending_writes and _pending_writes[sid] is history:
+                    del _pending_writes[sid]
+            for _ in session_ids:
+                queue.task_done()
+
+
 # ════════════════════════════════════════════════════════════
 #  LIFESPAN — connect/disconnect MCP
 # ════════════════════════════════════════════════════════════
@@ -105,13 +194,18 @@ agent: Agent | None = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global order_mcp, agent
+    global order_mcp, agent, _write_queue
 
     # ── Startup ──
+    log_listener = setup_queue_logger("agent_api")
     print(f"Connecting to MCP server: {MCP_SERVER_URL}")
     order_mcp = MCPServerStreamableHttp(
         name="Order MCP",
-        params={"url": MCP_SERVER_URL, "timeout": 30},
+        params={
+            "url": MCP_SERVER_URL,
+            "timeout": 30,
+            "httpx_client_factory": mcp_http_client_factory,
+        },
         client_session_timeout_seconds=30,
         cache_tools_list=True,
     )
@@ -127,14 +221,29 @@ async def lifespan(app: FastAPI):
         instructions=AGENT_INSTRUCTIONS,
         mcp_servers=[order_mcp],
         model=AGENT_MODEL,
+        # Let the model batch independent tool calls into one turn; the SDK
+        # runs the calls of a turn concurrently
+        model_settings=ModelSettings(parallel_tool_calls=True),
     )
     print(f"Agent ready — model: {AGENT_MODEL}")
+    init_history_summary()
+
+    _write_queue = asyncio.Queue()
+    writer_task = asyncio.create_task(_drain_writes(_write_queue))
 
     yield
 
     # ── Shutdown ──
     print("Shutting down MCP connections...")
     await order_mcp.__aexit__(None, None, None)
+    await _write_queue.join()
+    writer_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await writer_task
+    _write_queue = None
+    await asyncio.to_thread(session_store.vacuum_expired)
+    session_store.close()
+    log_listener.stop()
 
 
 # ════════════════════════════════════════════════════════════
@@ -160,74 +269,79 @@ class ChatResponse(BaseModel):
 
 # ── POST /chat ───────────────────────────────────────────
 
+# OpenAI rejects input whose function_call_output has no matching call
+_CORRUPTED_HISTORY_ERROR = "No tool call found"
+
+
+async def _run_with_recovery(
+    session_id: str, message: str, history: list
+) -> tuple[RunResult, list]:
+    """Run the agent on history + message, returning (result, history_used).
+
+    If the stored history is corrupted (orphaned tool call), the session is
+    cleared and the run retried once with only the new message; history_used
+    is then []. Any other failure propagates to the caller.
+    """
+    try:
+        with trace("Chat API"):
+            result = await Runner.run(
+                agent, input=history + [{"role": "user", "content": message}]
+            )
+        return result, history
+    except BadRequestError as e:
+        # Read the API error message directly; str(e) may format the body
+        if _CORRUPTED_HISTORY_ERROR not in (e.message or ""):
+            raise
+
+    logger.warning("Corrupted session %s, clearing and retrying...", session_id)
+    await _store_history(session_id, None)
+    with trace("Chat API (retry)"):
+        result = await Runner.run(agent, input=[{"role": "user", "content": message}])
+    return result, []
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest):
+async def chat(req: ChatRequest) -> ChatResponse:
     # Resolve session_id
-    session_id = req.session_id or uuid.uuid4().hex[:8]
+    session_id = req.session_id or secrets.token_hex(4)
 
-    # Get conversation history from persistent store
-    history = session_store.get(session_id)
+    # Get conversation history (pending write or SQLite, read off the loop)
+    history = await _load_history(session_id)
 
-    # Build input: history + new user message
-    input_messages = history + [{"role": "user", "content": req.message}]
+    # Fold older turns into a summary note once the session grows too long
+    history = await compact_history(history)
 
     # Run the agent
     try:
-        with trace("Chat API"):
-            result = await Runner.run(agent, input=input_messages)
-    except BadRequestError as e:
-        if "No tool call found" in str(e):
-            # Session history corrupted — clear and retry with fresh input
-            print(f"Corrupted session {session_id}, clearing and retrying...")
-            session_store.delete(session_id)
-            try:
-                with trace("Chat API (retry)"):
-                    result = await Runner.run(
-                        agent,
-                        input=[{"role": "user", "content": req.message}],
-                    )
-            except Exception:
-                traceback.print_exc()
-                return ChatResponse(
-                    session_id=session_id,
-                    response=ERROR_SYSTEM_UNAVAILABLE,
-                    image_ids=[],
-                    memory_count=0,
-                )
-        else:
-            traceback.print_exc()
-            return ChatResponse(
-                session_id=session_id,
-                response=ERROR_SYSTEM_UNAVAILABLE,
-                image_ids=[],
-                memory_count=len(history),
-            )
+        result, history = await _run_with_recovery(session_id, req.message, history)
     except Exception:
-        traceback.print_exc()
+        logger.exception("Agent run failed for session %s", session_id)
         return ChatResponse(
             session_id=session_id,
             response=ERROR_SYSTEM_UNAVAILABLE,
             image_ids=[],
-            memory_count=len(history),
+            memory_count=len(await _load_history(session_id)),
         )
 
     # Extract response and update session
     try:
         new_history = _filter_history_for_storage(result.to_input_list())
-        session_store.save(session_id, new_history)
+        await _store_history(session_id, new_history)
         raw_reply = result.final_output or ERROR_NO_OUTPUT
     except Exception:
-        traceback.print_exc()
+        logger.exception("Failed to store history for session %s", session_id)
         raw_reply = ERROR_PROCESSING
 
     # Parse image markers from agent response
     clean_reply, image_ids = parse_image_markers(raw_reply)
 
+    memory_count = len(await _load_history(session_id))
+
     return ChatResponse(
         session_id=session_id,
         response=clean_reply,
         image_ids=image_ids,
-        memory_count=session_store.count(session_id),
+        memory_count=memory_count,
     )
 
 
@@ -238,4 +352,16 @@ async def chat(req: ChatRequest):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("agent_api:app", host="0.0.0.0", port=3000, reload=True)
+    if os.getenv("DEV"):
+        uvicorn.run("agent_api:app", host="0.0.0.0", port=AGENT_API_PORT, reload=True)
+    else:
+        # loop/http "auto" pick uvloop + httptools when installed (uvicorn[standard])
+        uvicorn.run(
+            "agent_api:app",
+            host="0.0.0.0",
+            port=AGENT_API_PORT,
+            workers=AGENT_API_WORKERS,
+            loop="auto",
+            http="auto",
+            log_level="warning",
+        )
@@ -5,6 +5,7 @@ Both agent_api.py (HTTP API) and run_agents.py (CLI/TUI) import from here.
 """
 
 import os
+import sys
 
 from dotenv import load_dotenv
 
@@ -12,8 +13,25 @@ load_dotenv()
 
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8000/mcp")
 AGENT_MODEL = os.getenv("AGENT_MODEL", "gpt-4o-mini")
+AGENT_API_PORT = int(os.getenv("AGENT_API_PORT", "3000"))
+# Session write-behind state is per process — only raise this if every
+# session is pinned to one worker (e.g. sticky routing in front of the API)
+AGENT_API_WORKERS = int(os.getenv("AGENT_API_WORKERS", "1"))
 
-AGENT_INSTRUCTIONS = """\
+# Short-term memory (SessionStore) — read here, after load_dotenv(), so
+# values from .env apply to the API, CLI and TUI alike
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "50"))
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+
+# History compaction — summarize older turns once a session grows past the
+# threshold (0 disables it), keeping the most recent turns verbatim.
+# Keep the threshold below MAX_HISTORY_MESSAGES so the summary is never evicted.
+HISTORY_SUMMARY_THRESHOLD = int(os.getenv("HISTORY_SUMMARY_THRESHOLD", "0"))
+HISTORY_SUMMARY_KEEP = int(os.getenv("HISTORY_SUMMARY_KEEP", "10"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Interned so every Agent built from it (API, CLI, TUI) shares one object
+AGENT_INSTRUCTIONS = sys.intern("""\
 คุณคือ ผู้ช่วยขาย ผงเครื่องเทศหอมรักกัน
 
 คุณช่วยผู้ใช้เรื่อง:
@@ -67,4 +85,4 @@ AGENT_INSTRUCTIONS = """\
 - ใช้รายการแบบเลขลำดับ (1. 2. 3.) หรือขีดหัวข้อ (•) แทน
 - ข้อความกระชับ อ่านง่ายบนมือถือ
 - marker <<IMG:...>> ให้ใส่ท้ายข้อความเท่านั้น ห้ามใส่กลางประโยค
-"""
+""")
@@ -0,0 +1,89 @@
+"""History compaction — summarize older turns with a small model.
+
+When a session grows past HISTORY_SUMMARY_THRESHOLD messages, everything
+except the most recent HISTORY_SUMMARY_KEEP messages is replaced by one
+"Previously: ..." system note. The note is stored with the session, so it
+is only regenerated the next time the threshold is crossed (folding the
+previous note into the new one).
+"""
+
+import logging
+
+from openai import AsyncOpenAI
+
+from agent_config import (
+    HISTORY_SUMMARY_KEEP,
+    HISTORY_SUMMARY_MODEL,
+    HISTORY_SUMMARY_THRESHOLD,
+)
+from session_store import trim_to_user_turn
+
+# Child of the API logger, so records reach its queue handler (setup_queue_logger)
+logger = logging.getLogger("agent_api.history_summary")
+
+_async_client: AsyncOpenAI | None = None
+
+SUMMARY_PREFIX = "Previously: "
+
+SUMMARY_SYSTEM_PROMPT = """\
+Summarize the earlier part of a sales chat between a customer and a spice shop assistant.
+Keep facts needed to continue the conversation: customer details, products and sizes
+discussed, quantities, prices quoted, order status and open questions.
+Write in the same language as the conversation, at most 200 tokens, no preamble.
+"""
+
+
+def init_history_summary() -> None:
+    """Initialize the async OpenAI client (no-op when compaction is disabled)."""
+    global _async_client
+    if HISTORY_SUMMARY_THRESHOLD <= 0:
+        return
+    _async_client = AsyncOpenAI()
+    logger.info(
+        "History summary enabled: threshold=%d keep=%d model=%s",
+        HISTORY_SUMMARY_THRESHOLD,
+        HISTORY_SUMMARY_KEEP,
+        HISTORY_SUMMARY_MODEL,
+    )
+
+
+def _render_turn(item: dict) -> str:
+    """Render one history item as a 'role: text' line."""
+    content = item.get("content", "")
+    if isinstance(content, list):
+        content = "".join(
+            block.get("text", "") for block in content if isinstance(block, dict)
+        )
+    return f"{item.get('role', '?')}: {content}"
+
+
+async def compact_history(history: list) -> list:
+    """Return history with older turns folded into a summary note.
+
+    Returns the input unchanged when compaction is disabled, the history is
+    under the threshold, or the summary call fails (fail-open).
+    """
+    if _async_client is None or len(history) <= HISTORY_SUMMARY_THRESHOLD:
+        return history
+
+    recent = trim_to_user_turn(history[-HISTORY_SUMMARY_KEEP:])
+    older = history[: len(history) - len(recent)]
+    if not older:
+        return history
+
+    try:
+        response = await _async_client.chat.completions.create(
+            model=HISTORY_SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": "\n".join(_render_turn(i) for i in older)},
+            ],
+            max_tokens=300,
+            temperature=0,
+        )
+        summary = response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.warning("History summary failed, sending full history: %s", e)
+        return history
+
+    return [{"role": "system", "content": SUMMARY_PREFIX + summary}] + recent
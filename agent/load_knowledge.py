@@ -4,12 +4,15 @@ Usage:
     python agent/load_knowledge.py
 
 This will:
-1. Delete the old vector_store.db (phone product data)
-2. Create a fresh DB with the new knowledge base schema
-3. Load storage/ผงเครื่องเทศหอมรักกัน.txt (13 JSONL product knowledge records)
-4. Load storage/image_mapping.txt (16 image descriptions as searchable documents)
+1. Open (or create) vector_store.db with the knowledge base schema
+2. Load storage/ผงเครื่องเทศหอมรักกัน.txt (13 JSONL product knowledge records)
+3. Load storage/image_mapping.txt (16 image descriptions as searchable documents)
+
+Re-running is incremental: documents whose content hash is already stored
+are not re-embedded, and documents no longer in storage/ are removed.
 """
 
+import asyncio
 import sys
 from pathlib import Path
 
@@ -18,24 +21,19 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(PROJECT_ROOT / "agent"))
 
 from vector_search import (
-    setup,
+    setup_async,
     init_db,
-    cmd_load,
+    cmd_load_batch_async,
     get_document_count,
     DB_PATH,
 )
 
 
 def main() -> None:
-    client = setup()
-
-    # Delete old DB for clean start
-    if DB_PATH.exists():
-        DB_PATH.unlink()
-        print(f"Deleted old database: {DB_PATH}")
+    client = setup_async()
 
     conn = init_db()
-    print(f"Created new database: {DB_PATH}\n")
+    print(f"Opened database: {DB_PATH}\n")
 
     # Load all .txt files from storage/
     storage_dir = PROJECT_ROOT / "storage"
@@ -45,11 +43,13 @@ def main() -> None:
         print(f"No .txt files found in {storage_dir}")
         return
 
-    for txt_file in txt_files:
-        print(f"{'─' * 50}")
-        print(f"Loading: {txt_file.name}")
-        cmd_load(client, conn, str(txt_file))
-        print()
+    # One pooled embedding pass over every file, requests sent concurrently
+    print(f"{'─' * 50}")
+    print(f"Loading {len(txt_files)} file(s):")
+    asyncio.run(
+        cmd_load_batch_async(client, conn, [str(f) for f in txt_files], prune=True)
+    )
+    print()
 
     print(f"{'═' * 50}")
     print(f"Total documents in store: {get_document_count(conn)}")
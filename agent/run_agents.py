@@ -11,29 +11,19 @@ Usage:
 
 import asyncio
 import os
+import queue
 import sys
+import threading
 import time
+from typing import TYPE_CHECKING
 
-from dotenv import load_dotenv
-
-from agents import (
-    Agent,
-    Runner,
-    trace,
-    set_trace_processors,
-    AgentSpanData,
-    FunctionSpanData,
-    GenerationSpanData,
-    MCPListToolsSpanData,
-    HandoffSpanData,
-    GuardrailSpanData,
-)
-from agents.mcp import MCPServerStreamableHttp
-from openai.types.responses import ResponseTextDeltaEvent
 from session_store import SessionStore
 from agent_config import AGENT_INSTRUCTIONS, AGENT_MODEL, MCP_SERVER_URL
 
-load_dotenv()
+# The Agents SDK (and openai with it) takes over a second to import, so it
+# is imported where it is used rather than at module load
+if TYPE_CHECKING:
+    from agents import Agent
 
 
 # ════════════════════════════════════════════════════════════
@@ -59,129 +49,205 @@ class ConsoleTraceProcessor:
         "dim":        "\033[2m",
     }
 
+    # Line templates with the colour codes baked in (filled with %)
+    _RULE = "━" * 60
+    _TRACE_START = (
+        f"\n{COLORS['trace']}{_RULE}\n  TRACE START ▸ %s\n  ID: %s\n"
+        f"{_RULE}{COLORS['reset']}"
+    )
+    _TRACE_END = (
+        f"{COLORS['trace']}{_RULE}\n  TRACE END   ▸ %s\n{_RULE}{COLORS['reset']}\n"
+    )
+    _AGENT_START = f"{COLORS['agent']}  ▶ AGENT: %s  [tools: %s]{COLORS['reset']}"
+    _AGENT_END = f"{COLORS['agent']}  ◀ AGENT DONE: %s  [%s]{COLORS['reset']}"
+    _TOOL_START = f"{COLORS['tool']}  ▶ TOOL CALL: %s"
+    _TOOL_END = f"{COLORS['tool']}  ◀ TOOL DONE: %s  [%s]"
+    _TOOL_INPUT = "    input: %s"
+    _TOOL_OUTPUT = "    output: %s"
+    _LLM_START = f"{COLORS['llm']}  ▶ LLM GENERATION  [model: %s]{COLORS['reset']}"
+    _LLM_END = f"{COLORS['llm']}  ◀ LLM DONE  [model: %s, %s%s]{COLORS['reset']}"
+    _LLM_USAGE = "  tokens: %s in / %s out"
+    _MCP_START = f"{COLORS['mcp']}  ▶ MCP LIST TOOLS  [server: %s]{COLORS['reset']}"
+    _MCP_END = f"{COLORS['mcp']}  ◀ MCP TOOLS LOADED: %d tools  [%s]{COLORS['reset']}"
+    _HANDOFF_START = f"{COLORS['handoff']}  ▶ HANDOFF: %s → %s{COLORS['reset']}"
+    _HANDOFF_END = f"{COLORS['handoff']}  ◀ HANDOFF DONE: %s → %s  [%s]{COLORS['reset']}"
+    _GUARDRAIL_START = f"{COLORS['guardrail']}  ▶ GUARDRAIL: %s{COLORS['reset']}"
+    _GUARDRAIL_END = f"{COLORS['guardrail']}  ◀ GUARDRAIL: %s — %s  [%s]{COLORS['reset']}"
+    _OTHER_START = f"{COLORS['dim']}  ▶ %s{COLORS['reset']}"
+    _OTHER_END = f"{COLORS['dim']}  ◀ %s  [%s]{COLORS['reset']}"
+
+    # Max queued lines written between two stderr flushes
+    _DRAIN_BATCH = 32
+
     def __init__(self):
+        from agents import (
+            AgentSpanData,
+            FunctionSpanData,
+            GenerationSpanData,
+            GuardrailSpanData,
+            HandoffSpanData,
+            MCPListToolsSpanData,
+        )
+
         self._times: dict[str, float] = {}
+        # Span hooks only enqueue; a daemon thread does the stderr writes
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        threading.Thread(target=self._drain, daemon=True).start()
+        # span_data class -> bound handler; subclasses are resolved once
+        # through their MRO and then memoized here
+        self._start_handlers = {
+            AgentSpanData: self._start_agent,
+            FunctionSpanData: self._start_function,
+            GenerationSpanData: self._start_generation,
+            MCPListToolsSpanData: self._start_mcp_list_tools,
+            HandoffSpanData: self._start_handoff,
+            GuardrailSpanData: self._start_guardrail,
+        }
+        self._end_handlers = {
+            AgentSpanData: self._end_agent,
+            FunctionSpanData: self._end_function,
+            GenerationSpanData: self._end_generation,
+            MCPListToolsSpanData: self._end_mcp_list_tools,
+            HandoffSpanData: self._end_handoff,
+            GuardrailSpanData: self._end_guardrail,
+        }
 
     # ── Trace lifecycle ──────────────────────────
 
     def on_trace_start(self, trace_obj) -> None:
-        c = self.COLORS
-        self._log(f"\n{c['trace']}{'━'*60}")
-        self._log(f"  TRACE START ▸ {trace_obj.name}")
-        self._log(f"  ID: {trace_obj.trace_id}")
-        self._log(f"{'━'*60}{c['reset']}")
+        self._log(self._TRACE_START % (trace_obj.name, trace_obj.trace_id))
 
     def on_trace_end(self, trace_obj) -> None:
-        c = self.COLORS
-        self._log(f"{c['trace']}{'━'*60}")
-        self._log(f"  TRACE END   ▸ {trace_obj.name}")
-        self._log(f"{'━'*60}{c['reset']}\n")
+        self._log(self._TRACE_END % (trace_obj.name,))
 
     # ── Span lifecycle ───────────────────────────
 
     def on_span_start(self, span) -> None:
         self._times[span.span_id] = time.time()
         data = span.span_data
-        c = self.COLORS
+        self._resolve(self._start_handlers, data, self._start_other)(data)
+
+    def on_span_end(self, span) -> None:
+        dt = time.time() - self._times.pop(span.span_id, time.time())
+        data = span.span_data
+        self._resolve(self._end_handlers, data, self._end_other)(data, f"{dt:.2f}s")
+
+    @staticmethod
+    def _resolve(handlers: dict, data, default):
+        """Look up the handler for data's class (``__class__`` so mocks with a
+        spec'd class dispatch too), falling back to its base classes."""
+        cls = data.__class__
+        handler = handlers.get(cls)
+        if handler is None:
+            handler = next(
+                (handlers[base] for base in cls.__mro__ if base in handlers),
+                default,
+            )
+            handlers[cls] = handler
+        return handler
+
+    # ── Span start handlers ──────────────────────
 
-        if isinstance(data, AgentSpanData):
-            tools = ", ".join(data.tools) if data.tools else "none"
-            self._log(f"{c['agent']}  ▶ AGENT: {data.name}  [tools: {tools}]{c['reset']}")
+    def _start_agent(self, data) -> None:
+        tools = ", ".join(data.tools) if data.tools else "none"
+        self._log(self._AGENT_START % (data.name, tools))
 
-        elif isinstance(data, FunctionSpanData):
-            input_preview = self._truncate(data.input, 120) if data.input else ""
-            self._log(f"{c['tool']}  ▶ TOOL CALL: {data.name}")
+    def _start_function(self, data) -> None:
+        self._log(self._TOOL_START % (data.name,))
+        if data.input:
+            input_preview = self._truncate(data.input, 120)
             if input_preview:
-                self._log(f"    input: {input_preview}")
-            self._log(c['reset'], end="")
+                self._log(self._TOOL_INPUT % (input_preview,))
+        self._log(self.COLORS["reset"], end="")
 
-        elif isinstance(data, GenerationSpanData):
-            model = data.model or "unknown"
-            self._log(f"{c['llm']}  ▶ LLM GENERATION  [model: {model}]{c['reset']}")
+    def _start_generation(self, data) -> None:
+        self._log(self._LLM_START % (data.model or "unknown",))
 
-        elif isinstance(data, MCPListToolsSpanData):
-            self._log(f"{c['mcp']}  ▶ MCP LIST TOOLS  [server: {data.server}]{c['reset']}")
+    def _start_mcp_list_tools(self, data) -> None:
+        self._log(self._MCP_START % (data.server,))
 
-        elif isinstance(data, HandoffSpanData):
-            self._log(
-                f"{c['handoff']}  ▶ HANDOFF: "
-                f"{data.from_agent} → {data.to_agent}{c['reset']}"
-            )
+    def _start_handoff(self, data) -> None:
+        self._log(self._HANDOFF_START % (data.from_agent, data.to_agent))
 
-        elif isinstance(data, GuardrailSpanData):
-            self._log(f"{c['guardrail']}  ▶ GUARDRAIL: {data.name}{c['reset']}")
+    def _start_guardrail(self, data) -> None:
+        self._log(self._GUARDRAIL_START % (data.name,))
 
-        else:
-            self._log(f"{c['dim']}  ▶ {type(data).__name__}{c['reset']}")
+    def _start_other(self, data) -> None:
+        self._log(self._OTHER_START % (type(data).__name__,))
 
-    def on_span_end(self, span) -> None:
-        dt = time.time() - self._times.pop(span.span_id, time.time())
-        data = span.span_data
-        c = self.COLORS
-        elapsed = f"{dt:.2f}s"
+    # ── Span end handlers ────────────────────────
 
-        if isinstance(data, AgentSpanData):
-            self._log(f"{c['agent']}  ◀ AGENT DONE: {data.name}  [{elapsed}]{c['reset']}")
+    def _end_agent(self, data, elapsed: str) -> None:
+        self._log(self._AGENT_END % (data.name, elapsed))
 
-        elif isinstance(data, FunctionSpanData):
-            output_preview = self._truncate(str(data.output), 200) if data.output else ""
-            self._log(f"{c['tool']}  ◀ TOOL DONE: {data.name}  [{elapsed}]")
+    def _end_function(self, data, elapsed: str) -> None:
+        self._log(self._TOOL_END % (data.name, elapsed))
+        if data.output:
+            output_preview = self._truncate(str(data.output), 200)
             if output_preview:
-                self._log(f"    output: {output_preview}")
-            self._log(c['reset'], end="")
-
-        elif isinstance(data, GenerationSpanData):
-            usage = ""
-            if data.usage:
-                inp = data.usage.get("input_tokens", "?")
-                out = data.usage.get("output_tokens", "?")
-                usage = f"  tokens: {inp} in / {out} out"
-            self._log(
-                f"{c['llm']}  ◀ LLM DONE  "
-                f"[model: {data.model or '?'}, {elapsed}{usage}]{c['reset']}"
+                self._log(self._TOOL_OUTPUT % (output_preview,))
+        self._log(self.COLORS["reset"], end="")
+
+    def _end_generation(self, data, elapsed: str) -> None:
+        usage = ""
+        if data.usage:
+            usage = self._LLM_USAGE % (
+                data.usage.get("input_tokens", "?"),
+                data.usage.get("output_tokens", "?"),
             )
+        self._log(self._LLM_END % (data.model or "?", elapsed, usage))
 
-        elif isinstance(data, MCPListToolsSpanData):
-            count = len(data.result) if data.result else 0
-            self._log(
-                f"{c['mcp']}  ◀ MCP TOOLS LOADED: "
-                f"{count} tools  [{elapsed}]{c['reset']}"
-            )
+    def _end_mcp_list_tools(self, data, elapsed: str) -> None:
+        count = len(data.result) if data.result else 0
+        self._log(self._MCP_END % (count, elapsed))
 
-        elif isinstance(data, HandoffSpanData):
-            self._log(
-                f"{c['handoff']}  ◀ HANDOFF DONE: "
-                f"{data.from_agent} → {data.to_agent}  [{elapsed}]{c['reset']}"
-            )
+    def _end_handoff(self, data, elapsed: str) -> None:
+        self._log(self._HANDOFF_END % (data.from_agent, data.to_agent, elapsed))
 
-        elif isinstance(data, GuardrailSpanData):
-            status = "TRIGGERED" if data.triggered else "passed"
-            self._log(
-                f"{c['guardrail']}  ◀ GUARDRAIL: "
-                f"{data.name} — {status}  [{elapsed}]{c['reset']}"
-            )
+    def _end_guardrail(self, data, elapsed: str) -> None:
+        status = "TRIGGERED" if data.triggered else "passed"
+        self._log(self._GUARDRAIL_END % (data.name, status, elapsed))
 
-        else:
-            self._log(f"{c['dim']}  ◀ {type(data).__name__}  [{elapsed}]{c['reset']}")
+    def _end_other(self, data, elapsed: str) -> None:
+        self._log(self._OTHER_END % (type(data).__name__, elapsed))
 
     def shutdown(self) -> None:
-        pass
+        self.force_flush()
 
     def force_flush(self) -> None:
-        pass
+        """Block until everything logged so far has been written."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout=5)
 
     # ── Helpers ──────────────────────────────────
 
-    @staticmethod
-    def _log(msg: str, **kwargs) -> None:
-        print(msg, file=sys.stderr, flush=True, **kwargs)
+    def _log(self, msg: str, end: str = "\n") -> None:
+        self._queue.put(msg + end)
+
+    def _drain(self) -> None:
+        """Writer thread: write queued lines, one flush per batch."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._DRAIN_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            sys.stderr.write("".join(m for m in batch if isinstance(m, str)))
+            sys.stderr.flush()
+            for m in batch:
+                if isinstance(m, threading.Event):
+                    m.set()
 
     @staticmethod
     def _truncate(text: str, max_len: int = 120) -> str:
-        text = text.replace("\n", " ").strip()
+        # Strip first, then flatten newlines only in the part that is kept:
+        # tool outputs can be many KB and only max_len chars are shown
+        text = text.strip()
         if len(text) > max_len:
-            return text[:max_len] + "…"
-        return text
+            return text[:max_len].replace("\n", " ") + "…"
+        return text.replace("\n", " ")
 
 
 # ════════════════════════════════════════════════════════════
@@ -190,6 +256,10 @@ class ConsoleTraceProcessor:
 
 CLI_SESSION_ID = os.getenv("CLI_SESSION_ID", "cli")
 
+# Streamed text is written out once this much is buffered or this long passed
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_SECONDS = 0.05
+
 session_store = SessionStore()
 
 
@@ -197,8 +267,80 @@ session_store = SessionStore()
 #  INTERACTIVE CLI
 # ════════════════════════════════════════════════════════════
 
-async def chat_loop(agent: Agent) -> None:
-    """Interactive conversation loop with streaming and persistent history."""
+async def _ainput(prompt: str) -> str:
+    """input() that keeps the event loop running while waiting for the user.
+
+    Reads on a daemon thread rather than asyncio.to_thread(), so a prompt
+    still blocked on stdin never holds up interpreter exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def _deliver(setter, value) -> None:
+        if not future.done():
+            setter(value)
+
+    def _read() -> None:
+        try:
+            line = input(prompt)
+        except BaseException as e:  # EOFError / KeyboardInterrupt
+            loop.call_soon_threadsafe(_deliver, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(_deliver, future.set_result, line)
+
+    threading.Thread(target=_read, daemon=True).start()
+    return await future
+
+
+class _StreamWriter:
+    """Buffers streamed deltas and writes them to stdout in small batches."""
+
+    def __init__(self, out=None):
+        self._out = out or sys.stdout
+        self._buf: list[str] = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, delta: str) -> None:
+        self._buf.append(delta)
+        self._size += len(delta)
+        if (
+            self._size >= STREAM_FLUSH_CHARS
+            or time.monotonic() - self._last_flush >= STREAM_FLUSH_SECONDS
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buf:
+            self._out.write("".join(self._buf))
+            self._buf.clear()
+            self._size = 0
+        self._out.flush()
+        self._last_flush = time.monotonic()
+
+
+def _print_tools(task: asyncio.Task) -> None:
+    """Done-callback for the startup list_tools() task: show the tool banner."""
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"\n  [Could not list MCP tools: {task.exception()}]")
+        return
+    tools = task.result()
+    print(f"\n  Connected — {len(tools)} tools available:")
+    for t in tools:
+        print(f"    - {t.name}: {t.description[:60] if t.description else ''}")
+
+
+async def chat_loop(agent: "Agent", warmup: asyncio.Task | None = None) -> None:
+    """Interactive conversation loop with streaming and persistent history.
+
+    warmup, if given, is awaited (errors ignored) before the first run so
+    the agent reuses its result instead of fetching the tool list again.
+    """
+    from agents import Runner, trace
+    from openai.types.responses import ResponseTextDeltaEvent
+
     history = session_store.get(CLI_SESSION_ID)
 
     if history:
@@ -213,10 +355,15 @@ async def chat_loop(agent: Agent) -> None:
 
     while True:
         try:
-            user_input = input("You: ").strip()
+            user_input = (await _ainput("You: ")).strip()
         except (EOFError, KeyboardInterrupt):
             print("\nGoodbye!")
             return
+        except asyncio.CancelledError:
+            # Ctrl+C while waiting cancels this task instead of raising here;
+            # let the cancellation reach asyncio.run
+            print("\nGoodbye!")
+            raise
 
         if not user_input:
             continue
@@ -229,11 +376,16 @@ async def chat_loop(agent: Agent) -> None:
             print("[Conversation history cleared]\n")
             continue
 
+        if warmup is not None:
+            await asyncio.wait([warmup])
+            warmup = None
+
         # Build messages with conversation history
         messages = history + [{"role": "user", "content": user_input}]
 
         print("\nAssistant: ", end="", flush=True)
 
+        stream = _StreamWriter()
         try:
             with trace("Conversation Turn"):
                 result = Runner.run_streamed(agent, input=messages)
@@ -242,19 +394,26 @@ async def chat_loop(agent: Agent) -> None:
                         event.type == "raw_response_event"
                         and isinstance(event.data, ResponseTextDeltaEvent)
                     ):
-                        print(event.data.delta, end="", flush=True)
+                        stream.write(event.data.delta)
+            stream.flush()
 
             print("\n")
 
-            # Preserve full conversation history for next turn
-            history = result.to_input_list()
-            session_store.save(CLI_SESSION_ID, history)
+            # Keep the full conversation for the next turn; persist only
+            # this turn's items (user message + outputs)
+            new_items = result.to_input_list()[len(history):]
+            session_store.append(CLI_SESSION_ID, new_items)
+            history = history + new_items
 
         except Exception as e:
+            stream.flush()
             print(f"\n\n[Error: {e}]\n")
 
 
 async def main():
+    from agents import Agent, ModelSettings, set_trace_processors
+    from agents.mcp import MCPServerStreamableHttp
+
     # Install console trace processor (replaces default OpenAI exporter)
     set_trace_processors([ConsoleTraceProcessor()])
 
@@ -271,20 +430,23 @@ async def main():
             params={"url": MCP_SERVER_URL},
             cache_tools_list=True,
         ) as server:
-            # Show available tools on startup
-            tools = await server.list_tools()
-            print(f"\n  Connected — {len(tools)} tools available:")
-            for t in tools:
-                print(f"    - {t.name}: {t.description[:60] if t.description else ''}")
+            # Fetch the tool list while the user types the first message;
+            # the banner is printed whenever it arrives
+            tools_task = asyncio.create_task(server.list_tools())
+            tools_task.add_done_callback(_print_tools)
 
             agent = Agent(
                 name="Raggan Sales Assistant",
                 instructions=AGENT_INSTRUCTIONS,
                 mcp_servers=[server],
                 model=AGENT_MODEL,
+                model_settings=ModelSettings(parallel_tool_calls=True),
             )
 
-            await chat_loop(agent)
+            try:
+                await chat_loop(agent, warmup=tools_task)
+            finally:
+                tools_task.cancel()
 
     except ConnectionError:
         print(f"\nCould not connect to MCP server at {MCP_SERVER_URL}")
@@ -299,11 +461,13 @@ async def main():
 
 async def main_tui():
     """Launch the TUI version of the agent."""
+    from agents import ModelSettings
     from tui.app import AgentTuiApp
 
     app = AgentTuiApp(
         mcp_url=MCP_SERVER_URL,
         model=AGENT_MODEL,
+        model_settings=ModelSettings(parallel_tool_calls=True),
         session_id=CLI_SESSION_ID,
         session_store=session_store,
         agent_instructions=AGENT_INSTRUCTIONS,
@@ -321,4 +485,7 @@ if __name__ == "__main__":
     if args.tui:
         asyncio.run(main_tui())
     else:
-        asyncio.run(main())
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass  # Ctrl+C at the prompt; chat_loop already said goodbye
@@ -1,26 +1,69 @@
 """SQLite-backed session store for short-term conversation memory.
 
 Provides persistent conversation history with:
-- Max message limit (truncates old messages)
+- Max message limit (rolling window aligned to a user turn)
 - Session TTL (auto-expires inactive sessions)
-- Lazy cleanup (no background thread needed)
+- Expired rows purged on every Nth write or via vacuum_expired()
+  (reads only filter them out, never delete)
+- One persistent WAL-mode connection per store (no open/close per call)
+- Append-only message rows: a turn writes only its new items
+- LRU cache of decoded histories, invalidated by other connections' commits
 
-Config via environment variables:
+Config via environment variables (read in agent_config):
     MAX_HISTORY_MESSAGES  — max messages per session (default: 50)
     SESSION_TTL_HOURS     — session expiry in hours (default: 24)
 """
 
 import json
-import os
 import sqlite3
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 
-MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "50"))
-SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+from agent_config import MAX_HISTORY_MESSAGES, SESSION_TTL_HOURS
+
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+
+    def _dumps(obj) -> str:
+        # Same compact form as orjson so stored rows compare equal either way
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    _loads = json.loads
 
 DB_PATH = Path(__file__).parent / "sessions.db"
 
+# Applied once when the connection is opened
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Most recently used sessions kept decoded in memory
+_CACHE_SIZE = 1024
+
+# Expired rows are purged on one write transaction out of this many
+_CLEANUP_EVERY = 100
+
+
+def trim_to_user_turn(history: list) -> list:
+    """Drop leading items until the first user message (if there is one)."""
+    for i, item in enumerate(history):
+        if isinstance(item, dict) and item.get("role") == "user":
+            return history[i:]
+    return history
+
 
 class SessionStore:
     """Persistent session store with max history limit and TTL."""
@@ -34,69 +77,330 @@ class SessionStore:
         self.db_path = str(db_path)
         self.max_messages = max_messages
         self.ttl_seconds = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._writes_since_cleanup = 0
+        # session_id -> (history, updated_at); see get()
+        self._cache: OrderedDict[str, tuple[list, float]] = OrderedDict()
+        self._conn = self._connect()
         self._init_db()
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the long-lived connection and apply PRAGMAs."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def close(self) -> None:
+        """Close the underlying connection."""
+        with self._lock:
+            self._conn.close()
 
     def _init_db(self) -> None:
-        """Create sessions table if not exists."""
-        with sqlite3.connect(self.db_path) as conn:
+        """Create sessions/messages tables if not exists.
+
+        A database from the old single-table layout (one JSON blob per
+        session) is migrated in place.
+        """
+        with self._lock, self._conn as conn:
+            columns = [r[1] for r in conn.execute("PRAGMA table_info(sessions)")]
+            legacy = "history" in columns
+            if legacy:
+                conn.execute("ALTER TABLE sessions RENAME TO sessions_legacy")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS sessions (
-                    session_id TEXT PRIMARY KEY,
-                    history    TEXT NOT NULL DEFAULT '[]',
-                    created_at REAL NOT NULL,
-                    updated_at REAL NOT NULL
+                    session_id    TEXT PRIMARY KEY,
+                    created_at    REAL NOT NULL,
+                    updated_at    REAL NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            if columns and not legacy and "message_count" not in columns:
+                conn.execute(
+                    "ALTER TABLE sessions ADD COLUMN message_count "
+                    "INTEGER NOT NULL DEFAULT 0"
                 )
+                conn.execute(
+                    "UPDATE sessions SET message_count = (SELECT COUNT(*) "
+                    "FROM messages m WHERE m.session_id = sessions.session_id)"
+                )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT NOT NULL,
+                    seq        INTEGER NOT NULL,
+                    item       TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID
             """)
-            conn.commit()
+            # Every read filters on the TTL cutoff and the purge deletes by it
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_updated "
+                "ON sessions(updated_at)"
+            )
+            if legacy:
+                self._migrate_legacy(conn)
+
+    @staticmethod
+    def _migrate_legacy(conn: sqlite3.Connection) -> None:
+        """Copy sessions_legacy (history JSON blobs) into the message log."""
+        rows = conn.execute(
+            "SELECT session_id, history, created_at, updated_at FROM sessions_legacy"
+        ).fetchall()
+        for session_id, history_json, created_at, updated_at in rows:
+            try:
+                history = _loads(history_json)
+            except (ValueError, TypeError):
+                history = []
+            conn.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?)",
+                (session_id, created_at, updated_at, len(history)),
+            )
+            conn.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?)",
+                [
+                    (session_id, seq, _dumps(item))
+                    for seq, item in enumerate(history)
+                ],
+            )
+        conn.execute("DROP TABLE sessions_legacy")
 
     def get(self, session_id: str) -> list:
-        """Get conversation history. Returns [] if not found or expired."""
-        self._cleanup_expired()
-        with sqlite3.connect(self.db_path) as conn:
-            row = conn.execute(
-                "SELECT history, updated_at FROM sessions WHERE session_id = ?",
-                (session_id,),
+        """Get conversation history. Returns [] if not found or expired.
+
+        Served from the in-memory LRU cache unless another connection (e.g.
+        the CLI or a second API process) has committed since it was filled,
+        which SQLite reports through PRAGMA data_version.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._cache.clear()
+                self._data_version = version
+            cached = self._cache.get(session_id)
+            if cached is not None and cached[1] > cutoff:
+                self._cache.move_to_end(session_id)
+                return list(cached[0])
+
+            row = self._conn.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, cutoff),
             ).fetchone()
-        if not row:
-            return []
-        if time.time() - row[1] > self.ttl_seconds:
-            self.delete(session_id)
-            return []
-        return json.loads(row[0])
+            if not row:
+                return []
+            rows = self._conn.execute(
+                "SELECT item FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+            history = [_loads(item) for (item,) in rows]
+            self._cache_put(session_id, history, row[0])
+        return list(history)
+
+    def _cache_put(self, session_id: str, history: list, updated_at: float) -> None:
+        """Insert/refresh a cache entry, evicting the least recently used."""
+        self._cache[session_id] = (history, updated_at)
+        self._cache.move_to_end(session_id)
+        if len(self._cache) > _CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def truncate(self, history: list) -> list:
+        """Apply the max_messages window (keep most recent).
+
+        When truncation happens the window is advanced to the first user
+        message, so a session never starts with an orphaned assistant reply
+        or tool output whose originating turn was evicted.
+        """
+        if len(history) > self.max_messages:
+            return trim_to_user_turn(history[-self.max_messages :])
+        return history
 
     def save(self, session_id: str, history: list) -> None:
         """Save history, truncating to max_messages (keep most recent)."""
-        if len(history) > self.max_messages:
-            history = history[-self.max_messages :]
+        self.write_batch([(session_id, history)])
+
+    def append(self, session_id: str, new_items: list) -> None:
+        """Append items to a session without rewriting what is stored.
+
+        Inserts only the new rows, then applies the max_messages window in
+        SQL (advancing it to the first user message, as truncate() does).
+        An expired session is started afresh.
+        """
         now = time.time()
-        history_json = json.dumps(history, ensure_ascii=False)
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                """
-                INSERT INTO sessions (session_id, history, created_at, updated_at)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(session_id) DO UPDATE SET
-                    history = excluded.history,
-                    updated_at = excluded.updated_at
-                """,
-                (session_id, history_json, now, now),
-            )
-            conn.commit()
+        with self._lock:
+            with self._conn as conn:
+                row = conn.execute(
+                    "SELECT updated_at FROM sessions WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                if row and row[0] <= now - self.ttl_seconds:
+                    conn.execute(
+                        "DELETE FROM messages WHERE session_id = ?", (session_id,)
+                    )
+                (hi,) = conn.execute(
+                    "SELECT MAX(seq) FROM messages WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                start = -1 if hi is None else hi
+                conn.executemany(
+                    "INSERT INTO messages VALUES (?, ?, ?)",
+                    [
+                        (session_id, start + i, _dumps(item))
+                        for i, item in enumerate(new_items, start=1)
+                    ],
+                )
+                last = start + len(new_items)
+                window_start = last - self.max_messages + 1
+                (first,) = conn.execute(
+                    "SELECT MIN(seq) FROM messages WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                if first is not None and first < window_start:
+                    (user_seq,) = conn.execute(
+                        """
+                        SELECT MIN(seq) FROM messages
+                        WHERE session_id = ? AND seq >= ?
+                          AND json_extract(item, '$.role') = 'user'
+                        """,
+                        (session_id, window_start),
+                    ).fetchone()
+                    first = window_start if user_seq is None else user_seq
+                    conn.execute(
+                        "DELETE FROM messages WHERE session_id = ? AND seq < ?",
+                        (session_id, first),
+                    )
+                count = 0 if first is None else last - first + 1
+                conn.execute(
+                    """
+                    INSERT INTO sessions
+                        (session_id, created_at, updated_at, message_count)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        updated_at = excluded.updated_at,
+                        message_count = excluded.message_count
+                    """,
+                    (session_id, now, now, count),
+                )
+            # Cheaper to re-read on the next get() than to rebuild here
+            self._cache.pop(session_id, None)
+
+    def write_batch(self, entries: list[tuple[str, list | None]]) -> None:
+        """Apply several saves/deletes in a single transaction.
+
+        Each entry is (session_id, history); a history of None deletes the
+        session. Entries are applied in order with one commit at the end;
+        every _CLEANUP_EVERY-th call also purges expired sessions.
+        """
+        now = time.time()
+        written = []
+        with self._lock:
+            with self._conn as conn:
+                self._writes_since_cleanup += 1
+                if self._writes_since_cleanup >= _CLEANUP_EVERY:
+                    self._writes_since_cleanup = 0
+                    self._purge_expired(conn, now - self.ttl_seconds)
+                for session_id, history in entries:
+                    if history is None:
+                        conn.execute(
+                            "DELETE FROM messages WHERE session_id = ?", (session_id,)
+                        )
+                        conn.execute(
+                            "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+                        )
+                        written.append((session_id, None))
+                        continue
+                    history = list(self.truncate(history))
+                    self._write_messages(conn, session_id, history)
+                    conn.execute(
+                        """
+                        INSERT INTO sessions
+                            (session_id, created_at, updated_at, message_count)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(session_id) DO UPDATE SET
+                            updated_at = excluded.updated_at,
+                            message_count = excluded.message_count
+                        """,
+                        (session_id, now, now, len(history)),
+                    )
+                    written.append((session_id, history))
+            # Committed: our own writes don't bump data_version, so keep the
+            # cache in step with them here
+            for session_id, history in written:
+                if history is None:
+                    self._cache.pop(session_id, None)
+                else:
+                    self._cache_put(session_id, history, now)
+
+    @staticmethod
+    def _write_messages(
+        conn: sqlite3.Connection, session_id: str, history: list
+    ) -> None:
+        """Bring a session's message rows in line with history.
+
+        When history is the stored window with items appended (and possibly
+        some evicted from the front) only the difference is written: evicted
+        rows are deleted and new items inserted. Anything else (e.g. a
+        compacted history) replaces the session's rows.
+        """
+        stored = conn.execute(
+            "SELECT seq, item FROM messages WHERE session_id = ? ORDER BY seq",
+            (session_id,),
+        ).fetchall()
+        encoded = [_dumps(item) for item in history]
+        if stored:
+            lo, hi = stored[0][0], stored[-1][0]
+            items = [item for _, item in stored]
+            # Every kept row must match: repeated messages ("ok", greetings)
+            # make a match on the boundary rows alone ambiguous
+            for evicted in range(len(items)):
+                kept = len(items) - evicted
+                if kept <= len(encoded) and items[evicted:] == encoded[:kept]:
+                    conn.execute(
+                        "DELETE FROM messages WHERE session_id = ? AND seq < ?",
+                        (session_id, lo + evicted),
+                    )
+                    conn.executemany(
+                        "INSERT INTO messages VALUES (?, ?, ?)",
+                        [
+                            (session_id, hi + i, item)
+                            for i, item in enumerate(encoded[kept:], start=1)
+                        ],
+                    )
+                    return
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.executemany(
+            "INSERT INTO messages VALUES (?, ?, ?)",
+            [(session_id, seq, item) for seq, item in enumerate(encoded)],
+        )
 
     def delete(self, session_id: str) -> None:
         """Delete a session."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
-            )
-            conn.commit()
+        self.write_batch([(session_id, None)])
+
+    @staticmethod
+    def _purge_expired(conn: sqlite3.Connection, cutoff: float) -> int:
+        """Delete sessions (and their messages) last updated before cutoff.
 
-    def _cleanup_expired(self) -> None:
-        """Delete sessions older than TTL."""
+        Returns the number of sessions deleted.
+        """
+        conn.execute(
+            "DELETE FROM messages WHERE session_id IN "
+            "(SELECT session_id FROM sessions WHERE updated_at < ?)",
+            (cutoff,),
+        )
+        return conn.execute(
+            "DELETE FROM sessions WHERE updated_at < ?", (cutoff,)
+        ).rowcount
+
+    def vacuum_expired(self) -> int:
+        """Delete sessions older than TTL now. Returns how many were deleted.
+
+        Reads never delete (they only filter expired rows out), so call this
+        from maintenance points such as process shutdown.
+        """
         cutoff = time.time() - self.ttl_seconds
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
-            conn.commit()
+        with self._lock, self._conn as conn:
+            return self._purge_expired(conn, cutoff)
 
     def count(self, session_id: str) -> int:
         """Return message count for a session."""
@@ -105,22 +409,22 @@ class SessionStore:
 
     def list_all(self) -> list[dict]:
         """Return all non-expired sessions with metadata."""
-        self._cleanup_expired()
-        with sqlite3.connect(self.db_path) as conn:
-            rows = conn.execute(
-                "SELECT session_id, history, created_at, updated_at "
-                "FROM sessions ORDER BY updated_at DESC"
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT session_id, message_count, created_at, updated_at
+                FROM sessions WHERE updated_at > ?
+                ORDER BY updated_at DESC
+                """,
+                (cutoff,),
             ).fetchall()
-        result = []
-        for session_id, history_json, created_at, updated_at in rows:
-            try:
-                msg_count = len(json.loads(history_json))
-            except (json.JSONDecodeError, TypeError):
-                msg_count = 0
-            result.append({
+        return [
+            {
                 "session_id": session_id,
                 "message_count": msg_count,
                 "created_at": created_at,
                 "updated_at": updated_at,
-            })
-        return result
+            }
+            for session_id, msg_count, created_at, updated_at in rows
+        ]
@@ -4,8 +4,11 @@ Provides a rich terminal interface with chat panel, trace viewer,
 short/long-term memory tabs, and session management.
 """
 
+import asyncio
 import json
 import sys
+import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
@@ -15,6 +18,7 @@ from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Vertical
 from textual.message import Message
+from textual.timer import Timer
 from textual.widgets import (
     Header,
     Footer,
@@ -29,10 +33,15 @@ from textual.widgets import (
     Label,
 )
 
-from agents import Agent, Runner, trace, set_trace_processors
+from agents import Agent, ModelSettings, Runner, trace, set_trace_processors
 from agents.mcp import MCPServerStreamableHttp
 from openai.types.responses import ResponseTextDeltaEvent
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
 
 def _extract_text(content) -> str:
     """Extract plain text from message content.
@@ -57,11 +66,34 @@ def _extract_text(content) -> str:
     return str(content) if content else ""
 
 
-# Ensure parent dir is on path for session_store import
+# Ensure parent dir is on path for session_store import, and the project
+# root for shared imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
+_PROJECT_ROOT = str(Path(__file__).resolve().parent.parent.parent)
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
 from session_store import SessionStore
+from shared.http_client import mcp_http_client_factory
 from tui.trace_processor import TuiTraceProcessor, TraceEvent, MemoryChanged
 
+# Streamed deltas are coalesced into one StreamDelta per this many characters
+# or this many seconds (~one frame), whichever comes first
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_SECONDS = 0.016
+
+# memory_get_all results are reused for this long (per user_id), so
+# repeated Refresh clicks don't each cost an MCP round-trip
+LTM_CACHE_SECONDS = 2.0
+# A burst of memory tool calls triggers one LTM refresh this long after the last
+LTM_REFRESH_DEBOUNCE_SECONDS = 0.2
+
+# The STM tab shows at most this many of the most recent messages
+STM_WINDOW = 50
+# Trace lines kept while the Traces tab is hidden (oldest dropped first)
+TRACE_BUFFER_LINES = 1000
+# Session switches repaint the chat panel with at most this many messages
+CHAT_WINDOW = 100
+
 
 # ═══════════════════════════════════════════════════════
 #  Custom Messages
@@ -71,6 +103,8 @@ from tui.trace_processor import TuiTraceProcessor, TraceEvent, MemoryChanged
 class StreamDelta(Message):
     """A single text delta from the agent's streaming response."""
 
+    __slots__ = ("delta",)
+
     def __init__(self, delta: str) -> None:
         super().__init__()
         self.delta = delta
@@ -79,6 +113,8 @@ class StreamDelta(Message):
 class StreamComplete(Message):
     """Agent response finished streaming."""
 
+    __slots__ = ("full_reply",)
+
     def __init__(self, full_reply: str) -> None:
         super().__init__()
         self.full_reply = full_reply
@@ -87,6 +123,8 @@ class StreamComplete(Message):
 class ConnectionReady(Message):
     """MCP connection established, agent ready."""
 
+    __slots__ = ("tool_count", "tool_names")
+
     def __init__(self, tool_count: int, tool_names: list[str]) -> None:
         super().__init__()
         self.tool_count = tool_count
@@ -96,6 +134,8 @@ class ConnectionReady(Message):
 class ConnectionFailed(Message):
     """MCP connection failed."""
 
+    __slots__ = ("error",)
+
     def __init__(self, error: str) -> None:
         super().__init__()
         self.error = error
@@ -118,6 +158,9 @@ class AgentTuiApp(App):
         Binding("ctrl+p", "command_palette", "Palette"),
     ]
 
+    _STM_STYLES = {"user": "cyan", "assistant": "green"}
+    _CHAT_STYLES = {"user": "bold cyan", "assistant": "green"}
+
     def __init__(
         self,
         mcp_url: str,
@@ -136,8 +179,25 @@ class AgentTuiApp(App):
         self._mcp_server: MCPServerStreamableHttp | None = None
         self._history: list = []
         self._current_reply = ""
+        # Length of _current_reply already written to the reply log
+        self._reply_written = 0
         self._is_streaming = False
         self._reply_counter = 0
+        # STM tab rows already written, and the last message they end with
+        self._stm_rendered_count = 0
+        self._stm_last: dict | None = None
+        # id(msg) -> (msg, rendered row); holding msg keeps the id unique
+        self._stm_rows: dict[int, tuple[dict, Text | None]] = {}
+        # user_id -> (monotonic fetch time, memory items)
+        self._ltm_cache: dict[str, tuple[float, list]] = {}
+        self._ltm_refresh_timer: Timer | None = None
+        # Trace lines received while the Traces tab was hidden
+        self._trace_buffer: deque[Text | str] = deque(maxlen=TRACE_BUFFER_LINES)
+        # session_id -> ((message_count, updated_at, is_current), ListItem)
+        # as last shown in the Session tab
+        self._session_items: dict[str, tuple[tuple, ListItem]] = {}
+        # Tab panes whose content is stale; refreshed when next activated
+        self._dirty_tabs = {"tab-stm", "tab-session"}
 
     # ── Layout ───────────────────────────────────────
 
@@ -173,17 +233,36 @@ class AgentTuiApp(App):
     # ── Lifecycle ────────────────────────────────────
 
     async def on_mount(self) -> None:
+        # Resolve widgets once; handlers below run per token/span
+        self._chat_log = self.query_one("#chat-log", RichLog)
+        self._reply_log = self.query_one("#reply-log", RichLog)
+        self._trace_log = self.query_one("#trace-log", RichLog)
+        self._stm_log = self.query_one("#stm-log", RichLog)
+        self._ltm_log = self.query_one("#ltm-log", RichLog)
+        self._ltm_user_id = self.query_one("#ltm-user-id", Input)
+        self._session_list = self.query_one("#session-list", ListView)
+        self._session_info = self.query_one("#session-info", Static)
+        self._user_input = self.query_one("#user-input", Input)
+        self._send_btn = self.query_one("#send-btn", Button)
+        self._tabs = self.query_one("#tabs", TabbedContent)
+        self._tab_refreshers = {
+            "tab-replies": self._write_pending_reply,
+            "tab-traces": self._flush_trace_buffer,
+            "tab-stm": self._refresh_stm,
+            "tab-ltm": self._refresh_ltm,
+            "tab-session": self._refresh_sessions,
+        }
+
         # Disable input until connected
-        self.query_one("#user-input", Input).disabled = True
-        self.query_one("#send-btn", Button).disabled = True
+        self._user_input.disabled = True
+        self._send_btn.disabled = True
 
         # Load existing history
         self._history = self._session_store.get(self._session_id)
         if self._history:
             self._reload_chat_from_history()
 
-        chat_log = self.query_one("#chat-log", RichLog)
-        chat_log.write(Text("Connecting to MCP server...", style="dim"))
+        self._chat_log.write(Text("Connecting to MCP server...", style="dim"))
 
         self.connect_mcp()
 
@@ -193,7 +272,12 @@ class AgentTuiApp(App):
         try:
             self._mcp_server = MCPServerStreamableHttp(
                 name="GoSaaS MCP",
-                params={"url": self._mcp_url},
+                # LTM refreshes and tool calls are separate POSTs on this
+                # connection; the shared factory keeps them on a keep-alive pool
+                params={
+                    "url": self._mcp_url,
+                    "httpx_client_factory": mcp_http_client_factory,
+                },
                 cache_tools_list=True,
             )
             await self._mcp_server.__aenter__()
@@ -208,6 +292,7 @@ class AgentTuiApp(App):
                 instructions=self._agent_instructions,
                 mcp_servers=[self._mcp_server],
                 model=self._model,
+                model_settings=ModelSettings(parallel_tool_calls=True),
             )
 
             self.post_message(
@@ -220,7 +305,7 @@ class AgentTuiApp(App):
             self.post_message(ConnectionFailed(str(e)))
 
     def on_connection_ready(self, event: ConnectionReady) -> None:
-        chat_log = self.query_one("#chat-log", RichLog)
+        chat_log = self._chat_log
         chat_log.write(
             Text(
                 f"Connected — {event.tool_count} tools available",
@@ -237,12 +322,12 @@ class AgentTuiApp(App):
         chat_log.write("")
 
         # Enable input
-        self.query_one("#user-input", Input).disabled = False
-        self.query_one("#send-btn", Button).disabled = False
-        self.query_one("#user-input", Input).focus()
+        self._user_input.disabled = False
+        self._send_btn.disabled = False
+        self._user_input.focus()
 
     def on_connection_failed(self, event: ConnectionFailed) -> None:
-        chat_log = self.query_one("#chat-log", RichLog)
+        chat_log = self._chat_log
         chat_log.write(Text(f"Connection failed: {event.error}", style="bold red"))
         chat_log.write(
             Text("Start MCP server first:  python server.py", style="yellow")
@@ -260,7 +345,7 @@ class AgentTuiApp(App):
 
     @on(Button.Pressed, "#send-btn")
     def on_send_pressed(self, event: Button.Pressed) -> None:
-        inp = self.query_one("#user-input", Input)
+        inp = self._user_input
         if not inp.value.strip() or self._is_streaming:
             return
         user_text = inp.value.strip()
@@ -273,21 +358,22 @@ class AgentTuiApp(App):
             return
 
         # Show user message in chat
-        chat_log = self.query_one("#chat-log", RichLog)
+        chat_log = self._chat_log
         chat_log.write(Text(f"You: {user_text}", style="bold cyan"))
 
         # Prepare reply log
         self._reply_counter += 1
-        reply_log = self.query_one("#reply-log", RichLog)
+        reply_log = self._reply_log
         reply_log.clear()
         reply_log.write(Text(f"Reply #{self._reply_counter}", style="bold"))
         reply_log.write("")
 
         # Start streaming
         self._current_reply = ""
+        self._reply_written = 0
         self._is_streaming = True
-        self.query_one("#user-input", Input).disabled = True
-        self.query_one("#send-btn", Button).disabled = True
+        self._user_input.disabled = True
+        self._send_btn.disabled = True
 
         self.send_message(user_text)
 
@@ -296,6 +382,9 @@ class AgentTuiApp(App):
         """Run the agent with streaming and post results to the UI."""
         messages = self._history + [{"role": "user", "content": user_text}]
         full_reply = ""
+        buf: list[str] = []
+        buf_len = 0
+        last_flush = time.monotonic()
 
         try:
             with trace("Conversation Turn"):
@@ -307,12 +396,30 @@ class AgentTuiApp(App):
                     ):
                         delta = event.data.delta
                         full_reply += delta
-                        self.post_message(StreamDelta(delta=delta))
-
-            self._history = result.to_input_list()
+                        buf.append(delta)
+                        buf_len += len(delta)
+                        now = time.monotonic()
+                        if (
+                            buf_len >= STREAM_FLUSH_CHARS
+                            or now - last_flush >= STREAM_FLUSH_SECONDS
+                        ):
+                            self.post_message(StreamDelta(delta="".join(buf)))
+                            buf.clear()
+                            buf_len = 0
+                            last_flush = now
+            if buf:
+                self.post_message(StreamDelta(delta="".join(buf)))
+
+            # Keep the same window the store persists, so the STM tab can
+            # render straight from memory
+            self._history = self._session_store.truncate(result.to_input_list())
             self._session_store.save(self._session_id, self._history)
             self.post_message(StreamComplete(full_reply=full_reply))
 
+        except asyncio.CancelledError:
+            # Still unlock the input; the partial reply is not saved
+            self.post_message(StreamComplete(full_reply=full_reply or "[Cancelled]"))
+            raise
         except Exception as e:
             self.post_message(StreamComplete(full_reply=f"[Error: {e}]"))
 
@@ -320,73 +427,164 @@ class AgentTuiApp(App):
 
     def on_stream_delta(self, event: StreamDelta) -> None:
         self._current_reply += event.delta
-        # Append delta to reply log
-        reply_log = self.query_one("#reply-log", RichLog)
-        reply_log.write(Text(event.delta, style="green"))
+        if self._tabs.active != "tab-replies":
+            # Caught up when the tab is shown (on_stream_complete redraws
+            # the whole reply anyway)
+            self._dirty_tabs.add("tab-replies")
+            return
+        # Append to the reply log in STREAM_FLUSH_CHARS chunks; each write
+        # is a new line plus a re-layout
+        if len(self._current_reply) - self._reply_written >= STREAM_FLUSH_CHARS:
+            self._write_pending_reply()
+
+    def _write_pending_reply(self) -> None:
+        """Write the part of the streaming reply not yet in the reply log."""
+        if len(self._current_reply) > self._reply_written:
+            self._reply_log.write(
+                Text(self._current_reply[self._reply_written:], style="green")
+            )
+            self._reply_written = len(self._current_reply)
 
     def on_stream_complete(self, event: StreamComplete) -> None:
         self._is_streaming = False
 
         # Write final reply to chat
-        chat_log = self.query_one("#chat-log", RichLog)
+        chat_log = self._chat_log
         chat_log.write(Text(f"Assistant: {event.full_reply}", style="green"))
         chat_log.write("")
 
         # Clean reply log — show final clean version
-        reply_log = self.query_one("#reply-log", RichLog)
+        reply_log = self._reply_log
         reply_log.clear()
         reply_log.write(Text(f"Reply #{self._reply_counter}", style="bold"))
         reply_log.write("")
         reply_log.write(Text(event.full_reply, style="green"))
 
-        # Refresh STM
-        self._refresh_stm()
+        self._invalidate_tabs("tab-stm", "tab-session")
 
         # Re-enable input
         self._current_reply = ""
-        self.query_one("#user-input", Input).disabled = False
-        self.query_one("#send-btn", Button).disabled = False
-        self.query_one("#user-input", Input).focus()
+        self._reply_written = 0
+        self._user_input.disabled = False
+        self._send_btn.disabled = False
+        self._user_input.focus()
 
     # ── Trace event handler ──────────────────────────
 
     def on_trace_event(self, event: TraceEvent) -> None:
-        trace_log = self.query_one("#trace-log", RichLog)
-        trace_log.write(event.text)
+        if self._tabs.active != "tab-traces":
+            self._trace_buffer.append(event.text)
+            self._dirty_tabs.add("tab-traces")
+            return
+        self._trace_log.write(event.text)
+
+    def _flush_trace_buffer(self) -> None:
+        """Write trace lines buffered while the Traces tab was hidden."""
+        trace_log = self._trace_log
+        for text in self._trace_buffer:
+            trace_log.write(text)
+        self._trace_buffer.clear()
 
     # ── Memory changed handler ───────────────────────
 
     def on_memory_changed(self, event: MemoryChanged) -> None:
-        self._refresh_ltm()
+        # The tool call may have targeted any user_id
+        self._ltm_cache.clear()
+        if self._ltm_refresh_timer is not None:
+            self._ltm_refresh_timer.stop()
+        self._ltm_refresh_timer = self.set_timer(
+            LTM_REFRESH_DEBOUNCE_SECONDS, self._on_ltm_settled
+        )
+
+    def _on_ltm_settled(self) -> None:
+        self._ltm_refresh_timer = None
+        self._invalidate_tabs("tab-ltm")
+
+    # ── Lazy tab rendering ───────────────────────────
+
+    def _invalidate_tabs(self, *pane_ids: str) -> None:
+        """Refresh the visible pane now; the others on their next activation."""
+        for pane_id in pane_ids:
+            if self._tabs.active == pane_id:
+                self._dirty_tabs.discard(pane_id)
+                self._tab_refreshers[pane_id]()
+            else:
+                self._dirty_tabs.add(pane_id)
+
+    @on(TabbedContent.TabActivated, "#tabs")
+    def on_tab_activated(self, event: TabbedContent.TabActivated) -> None:
+        pane_id = event.pane.id
+        if pane_id in self._dirty_tabs:
+            self._dirty_tabs.discard(pane_id)
+            self._tab_refreshers[pane_id]()
 
     # ── Tab refresh methods ──────────────────────────
 
     def _refresh_stm(self) -> None:
-        """Refresh the STM tab with current session history."""
-        stm_log = self.query_one("#stm-log", RichLog)
-        stm_log.clear()
-        history = self._session_store.get(self._session_id)
-        stm_log.write(
-            Text(
-                f"Session: {self._session_id} — {len(history)} messages\n",
-                style="bold",
-            )
+        """Append messages added since the last refresh to the STM tab.
+
+        Rebuilds from scratch when the history no longer extends what was
+        rendered (cleared, switched, or trimmed by the session window).
+        Only the last STM_WINDOW messages are ever rendered.
+        """
+        stm_log = self._stm_log
+        history = self._history
+        count = self._stm_rendered_count
+        start = max(len(history) - STM_WINDOW, 0)
+        if (
+            count == 0
+            or count > len(history)
+            or history[count - 1] != self._stm_last
+        ):
+            count = 0
+            rows, self._stm_rows = self._stm_rows, {}
+            stm_log.clear()
+            stm_log.write(Text(f"Session: {self._session_id}\n", style="bold"))
+            if start:
+                stm_log.write(
+                    Text(
+                        f"... (showing last {STM_WINDOW} of {len(history)})",
+                        style="dim",
+                    )
+                )
+        else:
+            rows = self._stm_rows
+        for msg in history[max(count, start):]:
+            key = id(msg)
+            entry = rows.get(key)
+            if entry is None or entry[0] is not msg:
+                entry = (msg, self._render_stm_row(msg))
+            self._stm_rows[key] = entry
+            if entry[1] is not None:
+                stm_log.write(entry[1])
+        self._stm_rendered_count = len(history)
+        self._stm_last = history[-1] if history else None
+        self._session_info.update(
+            f"Current: {self._session_id} | Messages: {len(history)}"
         )
-        for msg in history:
-            role = msg.get("role", "?")
-            content = _extract_text(msg.get("content", ""))
-            if not content:
-                continue
-            if len(content) > 300:
-                content = content[:300] + "..."
-            style = {"user": "cyan", "assistant": "green"}.get(role, "dim")
-            stm_log.write(Text(f"[{role}] {content}", style=style))
 
-    @work(exclusive=False)
+    @classmethod
+    def _render_stm_row(cls, msg: dict) -> Text | None:
+        """Build the STM line for one message (None when it has no text)."""
+        role = msg.get("role", "?")
+        content = _extract_text(msg.get("content", ""))
+        if not content:
+            return None
+        if len(content) > 300:
+            content = content[:300] + "..."
+        return Text(f"[{role}] {content}", style=cls._STM_STYLES.get(role, "dim"))
+
+    @work(exclusive=True, group="ltm")
     async def _refresh_ltm(self) -> None:
         """Fetch long-term memories via the connected MCP server."""
-        user_id = self.query_one("#ltm-user-id", Input).value or "cli"
-        ltm_log = self.query_one("#ltm-log", RichLog)
+        user_id = self._ltm_user_id.value or "cli"
+        ltm_log = self._ltm_log
+
+        cached = self._ltm_cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < LTM_CACHE_SECONDS:
+            self._render_ltm(user_id, cached[1])
+            return
+
         ltm_log.clear()
         ltm_log.write(Text("Loading memories...", style="dim"))
 
@@ -405,7 +603,7 @@ class AgentTuiApp(App):
             for block in result.content:
                 if hasattr(block, "text") and block.text:
                     try:
-                        parsed = json.loads(block.text)
+                        parsed = _loads(block.text)
                         memories = parsed.get("memories", parsed)
                         if isinstance(memories, dict):
                             items = memories.get("results", [])
@@ -414,52 +612,92 @@ class AgentTuiApp(App):
                     except json.JSONDecodeError:
                         pass
 
-            ltm_log.clear()
-            if not items:
-                ltm_log.write(
-                    Text(f"No memories found for user: {user_id}", style="dim")
-                )
-            else:
-                ltm_log.write(
-                    Text(
-                        f"Memories for user: {user_id} ({len(items)} total)",
-                        style="bold",
-                    )
-                )
-                ltm_log.write("")
-                for i, mem in enumerate(items, 1):
-                    mem_text = mem.get("memory", str(mem))
-                    mem_id = str(mem.get("id", "?"))[:12]
-                    ltm_log.write(Text(f"  {i}. {mem_text}", style="white"))
-                    ltm_log.write(Text(f"     id: {mem_id}...", style="dim"))
+            self._ltm_cache[user_id] = (time.monotonic(), items)
+            self._render_ltm(user_id, items)
 
         except Exception as e:
             ltm_log.clear()
             ltm_log.write(Text(f"Error fetching LTM: {e}", style="red"))
 
-    async def _refresh_sessions(self) -> None:
-        """Refresh the Session tab with all sessions."""
-        session_list = self.query_one("#session-list", ListView)
-        await session_list.clear()
-        sessions = self._session_store.list_all()
-
-        for s in sessions:
-            sid = s["session_id"]
-            count = s["message_count"]
-            updated = datetime.fromtimestamp(s["updated_at"]).strftime(
-                "%Y-%m-%d %H:%M"
+    def _render_ltm(self, user_id: str, items: list) -> None:
+        """Show the memories of one user in the LTM tab."""
+        ltm_log = self._ltm_log
+        ltm_log.clear()
+        if not items:
+            ltm_log.write(
+                Text(f"No memories found for user: {user_id}", style="dim")
             )
-            marker = " *" if sid == self._session_id else ""
-            item = ListItem(
-                Label(f"{sid} — {count} msgs — {updated}{marker}"),
-                id=f"sess-{sid}",
+            return
+        ltm_log.write(
+            Text(
+                f"Memories for user: {user_id} ({len(items)} total)",
+                style="bold",
             )
-            session_list.append(item)
+        )
+        ltm_log.write("")
+        for i, mem in enumerate(items, 1):
+            mem_text = mem.get("memory", str(mem))
+            mem_id = str(mem.get("id", "?"))[:12]
+            ltm_log.write(Text(f"  {i}. {mem_text}", style="white"))
+            ltm_log.write(Text(f"     id: {mem_id}...", style="dim"))
+
+    @work(exclusive=True, group="sessions")
+    async def _refresh_sessions(self) -> None:
+        """Refresh the Session tab with all sessions.
 
-        self.query_one("#session-info", Static).update(
+        Rows are diffed against the previous refresh: unchanged rows are
+        left alone, changed ones get a new label, and only new sessions
+        get a ListItem.
+        """
+        session_list = self._session_list
+        sessions = self._session_store.list_all()
+        items = self._session_items
+
+        # A cancelled refresh may have stopped around an insert: forget rows
+        # that never mounted, and drop mounted rows no longer tracked below
+        children = list(session_list.children)
+        mounted = set(children)
+        listed = {s["session_id"] for s in sessions}
+        for sid in [sid for sid, (_, item) in items.items() if item not in mounted]:
+            del items[sid]
+        for sid in [sid for sid in items if sid not in listed]:
+            del items[sid]
+        tracked = {item for _, item in items.values()}
+        stale = [i for i, child in enumerate(children) if child not in tracked]
+        if stale:
+            await session_list.remove_items(stale)
+
+        for index, s in enumerate(sessions):
+            sid = s["session_id"]
+            key = (s["message_count"], s["updated_at"], sid == self._session_id)
+            entry = items.get(sid)
+            if entry is None:
+                item = ListItem(
+                    Label(self._session_label(sid, *key)), id=f"sess-{sid}"
+                )
+                await session_list.insert(index, [item])
+                items[sid] = (key, item)
+                continue
+            old_key, item = entry
+            if old_key != key:
+                item.query_one(Label).update(self._session_label(sid, *key))
+                items[sid] = (key, item)
+            # Rows before index are already in place, so item sits at or after it
+            if session_list.children[index] is not item:
+                session_list.move_child(item, before=index)
+
+        self._session_info.update(
             f"Current: {self._session_id} | Messages: {len(self._history)}"
         )
 
+    @staticmethod
+    def _session_label(
+        session_id: str, count: int, updated_at: float, current: bool
+    ) -> str:
+        updated = datetime.fromtimestamp(updated_at).strftime("%Y-%m-%d %H:%M")
+        marker = " *" if current else ""
+        return f"{session_id} — {count} msgs — {updated}{marker}"
+
     # ── Button handlers ──────────────────────────────
 
     @on(Button.Pressed, "#ltm-refresh")
@@ -482,29 +720,35 @@ class AgentTuiApp(App):
         self._session_id = session_id
         self._history = self._session_store.get(session_id)
         self._reply_counter = 0
+        self._stm_rendered_count = 0
+        self._stm_rows = {}
         self._reload_chat_from_history()
-        self._refresh_stm()
-        self.query_one("#session-info", Static).update(
-            f"Current: {session_id} | Messages: {len(self._history)}"
-        )
-        chat_log = self.query_one("#chat-log", RichLog)
+        self._invalidate_tabs("tab-stm", "tab-session")
+        chat_log = self._chat_log
         chat_log.write(
             Text(f"[Switched to session: {session_id}]", style="yellow")
         )
         chat_log.write("")
 
     def _reload_chat_from_history(self) -> None:
-        """Reload the chat panel from stored history."""
-        chat_log = self.query_one("#chat-log", RichLog)
+        """Reload the chat panel with the last CHAT_WINDOW stored messages."""
+        chat_log = self._chat_log
         chat_log.clear()
-        for msg in self._history:
+        if len(self._history) > CHAT_WINDOW:
+            chat_log.write(
+                Text(
+                    f"... ({len(self._history) - CHAT_WINDOW} earlier messages)",
+                    style="dim",
+                )
+            )
+        for msg in self._history[-CHAT_WINDOW:]:
             role = msg.get("role", "?")
-            if role not in ("user", "assistant"):
+            style = self._CHAT_STYLES.get(role)
+            if style is None:
                 continue
             content = _extract_text(msg.get("content", ""))
             if not content:
                 continue
-            style = {"user": "bold cyan", "assistant": "green"}.get(role, "dim")
             prefix = "You" if role == "user" else "Assistant"
             chat_log.write(Text(f"{prefix}: {content}", style=style))
         chat_log.write("")
@@ -516,14 +760,17 @@ class AgentTuiApp(App):
         self._session_store.delete(self._session_id)
         self._history = []
         self._reply_counter = 0
-        chat_log = self.query_one("#chat-log", RichLog)
+        chat_log = self._chat_log
         chat_log.clear()
         chat_log.write(Text("[Conversation history cleared]", style="yellow"))
         chat_log.write("")
-        self._refresh_stm()
+        self._stm_rendered_count = 0
+        self._stm_rows = {}
+        self._invalidate_tabs("tab-stm", "tab-session")
         # Clear traces and replies
-        self.query_one("#trace-log", RichLog).clear()
-        self.query_one("#reply-log", RichLog).clear()
+        self._trace_log.clear()
+        self._trace_buffer.clear()
+        self._reply_log.clear()
 
     async def on_unmount(self) -> None:
         """Clean up MCP connection on exit."""
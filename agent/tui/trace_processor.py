@@ -4,7 +4,9 @@ Posts trace events as Textual messages instead of printing to stderr.
 """
 
 import time
+from itertools import islice
 
+from rich.style import Style
 from rich.text import Text
 from textual.message import Message
 
@@ -21,6 +23,8 @@ from agents import (
 class TraceEvent(Message):
     """Carries a Rich Text trace line to the TUI."""
 
+    __slots__ = ("text",)
+
     def __init__(self, text: Text | str) -> None:
         super().__init__()
         self.text = text
@@ -28,26 +32,67 @@ class TraceEvent(Message):
 
 class MemoryChanged(Message):
     """Posted when the agent uses a memory tool, to trigger LTM refresh."""
-    pass
+
+    __slots__ = ()
 
 
 class TuiTraceProcessor:
     """Bridges OpenAI Agents SDK tracing into the Textual event loop."""
 
+    __slots__ = (
+        "_app",
+        "_times",
+        "_reply_counter",
+        "_llm_counter",
+        "_start_handlers",
+        "_end_handlers",
+    )
+
     MEMORY_TOOLS = {"memory_add", "memory_delete", "memory_search"}
+    # Parsed once and shared by every line, instead of Rich re-resolving a
+    # style string for each Text
+    _TRACE_STYLE = Style.parse("bold cyan")
+    _AGENT_STYLE = Style.parse("bold yellow")
+    _LLM_STYLE = Style.parse("magenta")
+    _TOOL_STYLE = Style.parse("green")
+    _MCP_STYLE = Style.parse("blue")
+    _HANDOFF_STYLE = Style.parse("red")
+    _GUARDRAIL_STYLE = Style.parse("dark_orange")
+    _OTHER_STYLE = Style.parse("dim")
+
+    # Spans whose end never arrives would otherwise stay in _times forever
+    MAX_OPEN_SPANS = 256
 
     def __init__(self, app) -> None:
         self._app = app
         self._times: dict[str, float] = {}
         self._reply_counter = 0
         self._llm_counter = 0
+        # span_data class -> bound handler; subclasses are resolved once
+        # through their MRO and then memoized here
+        self._start_handlers = {
+            AgentSpanData: self._start_agent,
+            GenerationSpanData: self._start_generation,
+            FunctionSpanData: self._start_function,
+            MCPListToolsSpanData: self._start_mcp_list_tools,
+            HandoffSpanData: self._start_handoff,
+            GuardrailSpanData: self._start_guardrail,
+        }
+        self._end_handlers = {
+            AgentSpanData: self._end_agent,
+            GenerationSpanData: self._end_generation,
+            FunctionSpanData: self._end_function,
+            MCPListToolsSpanData: self._end_mcp_list_tools,
+            HandoffSpanData: self._end_handoff,
+            GuardrailSpanData: self._end_guardrail,
+        }
 
     # ── Trace lifecycle ──────────────────────────────
 
     def on_trace_start(self, trace_obj) -> None:
         self._reply_counter += 1
         self._llm_counter = 0
-        self._post(Text(f"\nTraces for Reply #{self._reply_counter}", style="bold cyan"))
+        self._post(Text(f"\nTraces for Reply #{self._reply_counter}", style=self._TRACE_STYLE))
 
     def on_trace_end(self, trace_obj) -> None:
         pass
@@ -55,82 +100,119 @@ class TuiTraceProcessor:
     # ── Span lifecycle ───────────────────────────────
 
     def on_span_start(self, span) -> None:
-        self._times[span.span_id] = time.time()
+        times = self._times
+        if len(times) >= self.MAX_OPEN_SPANS:
+            # Dicts keep insertion order: drop the oldest quarter
+            for span_id in list(islice(times, self.MAX_OPEN_SPANS // 4)):
+                del times[span_id]
+        times[span.span_id] = time.monotonic()
         data = span.span_data
-
-        if isinstance(data, AgentSpanData):
-            self._post(Text(f">>> Agent started: {data.name}", style="bold yellow"))
-
-        elif isinstance(data, GenerationSpanData):
-            self._llm_counter += 1
-            self._post(Text(f"LLM #{self._llm_counter} ...", style="magenta"))
-
-        elif isinstance(data, FunctionSpanData):
-            preview = self._truncate(data.input, 80) if data.input else ""
-            line = f"TOOL CALL: {data.name}"
-            if preview:
-                line += f"  ({preview})"
-            self._post(Text(line, style="green"))
-
-        elif isinstance(data, MCPListToolsSpanData):
-            self._post(Text(f"MCP LIST TOOLS: {data.server}", style="blue"))
-
-        elif isinstance(data, HandoffSpanData):
-            self._post(Text(f"HANDOFF: {data.from_agent} → {data.to_agent}", style="red"))
-
-        elif isinstance(data, GuardrailSpanData):
-            self._post(Text(f"GUARDRAIL: {data.name}", style="dark_orange"))
-
-        else:
-            self._post(Text(f"  {type(data).__name__}", style="dim"))
+        self._resolve(self._start_handlers, data, self._start_other)(data)
 
     def on_span_end(self, span) -> None:
-        dt = time.time() - self._times.pop(span.span_id, time.time())
+        now = time.monotonic()
+        dt = now - self._times.pop(span.span_id, now)
         data = span.span_data
-        elapsed = f"{dt:.1f}s"
-
-        if isinstance(data, AgentSpanData):
-            self._post(Text(f"<<< Agent finished: {data.name}  [{elapsed}]", style="bold yellow"))
-
-        elif isinstance(data, GenerationSpanData):
-            usage_str = ""
-            if data.usage:
-                inp = data.usage.get("input_tokens", "?")
-                out = data.usage.get("output_tokens", "?")
-                cached = data.usage.get("cached_tokens", None)
-                usage_str = f"  [in:{inp}"
-                if cached:
-                    usage_str += f" cached:{cached}"
-                usage_str += f" out:{out}]"
-            self._post(Text(
-                f"LLM #{self._llm_counter} done {elapsed}{usage_str}",
-                style="magenta",
-            ))
-
-        elif isinstance(data, FunctionSpanData):
-            output_preview = ""
-            if data.output:
-                output_preview = f"  → {self._truncate(str(data.output), 100)}"
-            self._post(Text(f"TOOL DONE: {data.name}  [{elapsed}]{output_preview}", style="green"))
-            if data.name in self.MEMORY_TOOLS:
-                self._app.post_message(MemoryChanged())
-
-        elif isinstance(data, MCPListToolsSpanData):
-            count = len(data.result) if data.result else 0
-            self._post(Text(f"MCP TOOLS LOADED: {count} tools  [{elapsed}]", style="blue"))
-
-        elif isinstance(data, HandoffSpanData):
-            self._post(Text(
-                f"HANDOFF DONE: {data.from_agent} → {data.to_agent}  [{elapsed}]",
-                style="red",
-            ))
-
-        elif isinstance(data, GuardrailSpanData):
-            status = "TRIGGERED" if data.triggered else "passed"
-            self._post(Text(f"GUARDRAIL: {data.name} — {status}  [{elapsed}]", style="dark_orange"))
-
-        else:
-            self._post(Text(f"  {type(data).__name__}  [{elapsed}]", style="dim"))
+        self._resolve(self._end_handlers, data, self._end_other)(data, f"{dt:.1f}s")
+
+    @staticmethod
+    def _resolve(handlers: dict, data, default):
+        """Look up the handler for data's class (``__class__`` so mocks with a
+        spec'd class dispatch too), falling back to its base classes."""
+        cls = data.__class__
+        handler = handlers.get(cls)
+        if handler is None:
+            handler = next(
+                (handlers[base] for base in cls.__mro__ if base in handlers),
+                default,
+            )
+            handlers[cls] = handler
+        return handler
+
+    # ── Span start handlers ──────────────────────────
+
+    def _start_agent(self, data) -> None:
+        self._post(Text(f">>> Agent started: {data.name}", style=self._AGENT_STYLE))
+
+    def _start_generation(self, data) -> None:
+        self._llm_counter += 1
+        self._post(Text(f"LLM #{self._llm_counter} ...", style=self._LLM_STYLE))
+
+    def _start_function(self, data) -> None:
+        preview = self._truncate(data.input, 80) if data.input else ""
+        line = f"TOOL CALL: {data.name}"
+        if preview:
+            line += f"  ({preview})"
+        self._post(Text(line, style=self._TOOL_STYLE))
+
+    def _start_mcp_list_tools(self, data) -> None:
+        self._post(Text(f"MCP LIST TOOLS: {data.server}", style=self._MCP_STYLE))
+
+    def _start_handoff(self, data) -> None:
+        self._post(Text(
+            f"HANDOFF: {data.from_agent} → {data.to_agent}",
+            style=self._HANDOFF_STYLE,
+        ))
+
+    def _start_guardrail(self, data) -> None:
+        self._post(Text(f"GUARDRAIL: {data.name}", style=self._GUARDRAIL_STYLE))
+
+    def _start_other(self, data) -> None:
+        self._post(Text(f"  {type(data).__name__}", style=self._OTHER_STYLE))
+
+    # ── Span end handlers ────────────────────────────
+
+    def _end_agent(self, data, elapsed: str) -> None:
+        self._post(Text(
+            f"<<< Agent finished: {data.name}  [{elapsed}]",
+            style=self._AGENT_STYLE,
+        ))
+
+    def _end_generation(self, data, elapsed: str) -> None:
+        usage_str = ""
+        if data.usage:
+            inp = data.usage.get("input_tokens", "?")
+            out = data.usage.get("output_tokens", "?")
+            cached = data.usage.get("cached_tokens", None)
+            usage_str = f"  [in:{inp}"
+            if cached:
+                usage_str += f" cached:{cached}"
+            usage_str += f" out:{out}]"
+        self._post(Text(
+            f"LLM #{self._llm_counter} done {elapsed}{usage_str}",
+            style=self._LLM_STYLE,
+        ))
+
+    def _end_function(self, data, elapsed: str) -> None:
+        output_preview = ""
+        if data.output:
+            output_preview = f"  → {self._truncate(str(data.output), 100)}"
+        self._post(Text(
+            f"TOOL DONE: {data.name}  [{elapsed}]{output_preview}",
+            style=self._TOOL_STYLE,
+        ))
+        if data.name in self.MEMORY_TOOLS:
+            self._app.post_message(MemoryChanged())
+
+    def _end_mcp_list_tools(self, data, elapsed: str) -> None:
+        count = len(data.result) if data.result else 0
+        self._post(Text(f"MCP TOOLS LOADED: {count} tools  [{elapsed}]", style=self._MCP_STYLE))
+
+    def _end_handoff(self, data, elapsed: str) -> None:
+        self._post(Text(
+            f"HANDOFF DONE: {data.from_agent} → {data.to_agent}  [{elapsed}]",
+            style=self._HANDOFF_STYLE,
+        ))
+
+    def _end_guardrail(self, data, elapsed: str) -> None:
+        status = "TRIGGERED" if data.triggered else "passed"
+        self._post(Text(
+            f"GUARDRAIL: {data.name} — {status}  [{elapsed}]",
+            style=self._GUARDRAIL_STYLE,
+        ))
+
+    def _end_other(self, data, elapsed: str) -> None:
+        self._post(Text(f"  {type(data).__name__}  [{elapsed}]", style=self._OTHER_STYLE))
 
     def shutdown(self) -> None:
         pass
@@ -145,7 +227,12 @@ class TuiTraceProcessor:
 
     @staticmethod
     def _truncate(text: str, max_len: int = 80) -> str:
-        text = text.replace("\n", " ").strip()
+        # Short single-line args are the common case: strip() returns the
+        # same object when there is nothing to strip, so no copy is made
+        if len(text) <= max_len and "\n" not in text:
+            return text.strip()
+        # Otherwise flatten newlines only in the part that is kept
+        text = text.strip()
         if len(text) > max_len:
-            return text[:max_len] + "…"
-        return text
+            return text[:max_len].replace("\n", " ") + "…"
+        return text.replace("\n", " ")
@@ -7,22 +7,41 @@ Usage:
     python agent/vector_search.py
 """
 
+import asyncio
+import atexit
+import hashlib
 import json
+import logging
 import os
 import re
 import sqlite3
 import sys
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 
 import faiss
 import numpy as np
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.formatted_text import HTML
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger("vector_search")
+
 
 # ════════════════════════════════════════════════════════════
 #  CONSTANTS
@@ -31,6 +50,35 @@ from prompt_toolkit.formatted_text import HTML
 EMBEDDING_MODEL = "text-embedding-3-small"
 EMBEDDING_DIM = 1536
 DB_PATH = Path(__file__).parent / "vector_store.db"
+EMBED_BATCH_SIZE = 2048  # max inputs per OpenAI embeddings request
+EMBED_BATCH_TOKENS = 250_000  # token budget per embeddings request (API cap: 300k)
+EMBED_CONCURRENCY = 8    # embeddings requests in flight at once (async loader)
+NUMPY_SEARCH_MAX_ROWS = 2_000   # filtered sets this small on a quantized index are scored exactly
+SQ8_MIN_ROWS = 1_000            # from this size on, the store index is 8-bit quantized
+SQ8_RANGE_MARGIN = 0.2          # widen trained SQ8 ranges so later additions don't clip
+IVFPQ_MIN_ROWS = 10_000         # from this size on, the store index is IVF+PQ instead
+IVFPQ_FACTORY = "IVF256,PQ48x8"  # 256 lists, 48 bytes per vector
+IVFPQ_TRAIN_SAMPLE = 50_000     # max vectors used to train IVF+PQ
+IVF_NPROBE = 16                 # inverted lists scanned per query
+QUERY_EMBED_CACHE_SIZE = 1024   # recent search queries kept embedded in memory
+INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "auto")  # "hnsw" replaces SQ8 / IVF+PQ tiers
+HNSW_M = 32                     # graph neighbours per node
+HNSW_EF_CONSTRUCTION = 200      # candidate list size while building the graph
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))  # recall/latency knob
+
+# Query syntax, compiled once at import
+_FILTER_RE = re.compile(r"--(category)\s+(\S+)")  # search filter flags
+_TOPK_RE = re.compile(r"\s+/(\d+)\s*$")           # trailing "/N" top-k in the REPL
+_IMG_ID_RE = re.compile(r"IMG_[A-Z]+_\d+")         # image IDs mentioned in a query
+
+# Applied by init_db; tuned for bulk loads (WAL + NORMAL sync = no fsync per commit)
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-100000",
+    "PRAGMA mmap_size=268435456",
+)
 
 
 # ════════════════════════════════════════════════════════════
@@ -40,6 +88,8 @@ DB_PATH = Path(__file__).parent / "vector_store.db"
 def init_db(db_path: Path = DB_PATH) -> sqlite3.Connection:
     """Open (or create) the database and ensure the schema exists."""
     conn = sqlite3.connect(str(db_path))
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS documents (
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -49,7 +99,8 @@ def init_db(db_path: Path = DB_PATH) -> sqlite3.Connection:
             doc_id      TEXT,
             category    TEXT,
             title       TEXT,
-            image_ids   TEXT
+            image_ids   TEXT,
+            doc_hash    TEXT
         )
     """)
     conn.commit()
@@ -61,75 +112,217 @@ def init_db(db_path: Path = DB_PATH) -> sqlite3.Connection:
         ("category", "TEXT"),
         ("title", "TEXT"),
         ("image_ids", "TEXT"),
+        ("doc_hash", "TEXT"),
     ]
     for col, typ in migrations:
         if col not in existing:
             conn.execute(f"ALTER TABLE documents ADD COLUMN {col} {typ}")
+    # Content hash of batch-loaded documents (NULL for ad-hoc adds)
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_hash ON documents(doc_hash)"
+    )
+    # Search filters (category = ?) are answered from this instead of a scan
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_documents_category ON documents(category)"
+    )
     conn.commit()
+
+    # Migrate: embeddings are stored unit-length since schema version 1
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+        _normalize_stored_embeddings(conn)
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
     return conn
 
 
-def store_document(
-    conn: sqlite3.Connection,
+def unit_vector(embedding: np.ndarray) -> np.ndarray:
+    """Return embedding as an L2-normalized float32 vector (a new array)."""
+    vec = np.asarray(embedding, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+def _normalize_stored_embeddings(conn: sqlite3.Connection) -> None:
+    """Rewrite stored embeddings that are not unit-length."""
+    updates = []
+    for doc_id, blob in conn.execute("SELECT id, embedding FROM documents"):
+        vec = np.frombuffer(blob, dtype=np.float32)
+        if abs(float(vec @ vec) - 1.0) > 1e-3:
+            updates.append((unit_vector(vec).tobytes(), doc_id))
+    conn.executemany("UPDATE documents SET embedding = ? WHERE id = ?", updates)
+
+
+def document_hash(text: str, metadata: dict | None = None) -> str:
+    """SHA-256 over a document's text and metadata (detects any edit)."""
+    payload = json.dumps([text, metadata], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _document_row(
     text: str,
     embedding: np.ndarray,
-    metadata: dict | None = None,
-) -> int:
-    """Insert a document + embedding + optional metadata. Returns the new row ID."""
+    metadata: dict | None,
+    doc_hash: str | None = None,
+    created_at: str | None = None,
+) -> tuple:
+    """Build the INSERT parameters for one document (created_at defaults to now)."""
     meta = metadata or {}
     image_ids_val = meta.get("image_ids")
     if isinstance(image_ids_val, list):
         image_ids_str = json.dumps(image_ids_val, ensure_ascii=False)
     else:
         image_ids_str = image_ids_val
-    cur = conn.execute(
-        """INSERT INTO documents (text, embedding, created_at, doc_id, category, title, image_ids)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (
-            text,
-            embedding.tobytes(),
-            datetime.now(timezone.utc).isoformat(),
-            meta.get("doc_id"),
-            meta.get("category"),
-            meta.get("title"),
-            image_ids_str,
-        ),
+    return (
+        text,
+        embedding.tobytes(),
+        created_at or datetime.now(timezone.utc).isoformat(),
+        meta.get("doc_id"),
+        meta.get("category"),
+        meta.get("title"),
+        image_ids_str,
+        doc_hash,
     )
-    conn.commit()
+
+
+_INSERT_DOCUMENT = """INSERT INTO documents
+           (text, embedding, created_at, doc_id, category, title, image_ids, doc_hash)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+def store_document(
+    conn: sqlite3.Connection,
+    text: str,
+    embedding: np.ndarray,
+    metadata: dict | None = None,
+) -> int:
+    """Insert a document + embedding + optional metadata. Returns the new row ID.
+
+    Does not commit: the caller commits at its own batch boundary.
+    """
+    embedding = unit_vector(embedding)
+    row = _document_row(text, embedding, metadata)
+    cur = conn.execute(_INSERT_DOCUMENT, row)
+    _index_add(conn, cur.lastrowid, embedding)
+    _docs_add(conn, cur.lastrowid, row)
     return cur.lastrowid
 
 
-def load_all_embeddings(conn: sqlite3.Connection) -> tuple[list[int], np.ndarray | None]:
-    """Load all (id, embedding) pairs. Returns ([], None) if empty."""
+def insert_documents(
+    conn: sqlite3.Connection,
+    docs: list[tuple[str, np.ndarray, dict | None]],
+) -> None:
+    """Insert many (text, embedding, metadata) documents; the caller commits.
+
+    One executemany over a single prepared INSERT; all rows share one
+    created_at timestamp.
+    """
+    now_iso = datetime.now(timezone.utc).isoformat()
+    conn.executemany(
+        _INSERT_DOCUMENT,
+        [
+            _document_row(text, unit_vector(emb), meta, created_at=now_iso)
+            for text, emb, meta in docs
+        ],
+    )
+
+
+def store_documents(
+    conn: sqlite3.Connection,
+    docs: list[tuple[str, np.ndarray, dict | None]],
+) -> None:
+    """Insert many (text, embedding, metadata) documents in one transaction.
+
+    Each row is stored with its document_hash(); a document whose hash is
+    already present is skipped.
+    """
+    now_iso = datetime.now(timezone.utc).isoformat()
+    conn.executemany(
+        _INSERT_DOCUMENT.replace("INSERT", "INSERT OR IGNORE", 1),
+        [
+            _document_row(
+                text, unit_vector(emb), meta, document_hash(text, meta), now_iso
+            )
+            for text, emb, meta in docs
+        ],
+    )
+    conn.commit()
+
+
+def get_document_hashes(conn: sqlite3.Connection) -> set[str]:
+    """Return the content hashes of all hashed documents."""
+    return {
+        h for (h,) in conn.execute(
+            "SELECT doc_hash FROM documents WHERE doc_hash IS NOT NULL"
+        )
+    }
+
+
+def delete_documents_except(conn: sqlite3.Connection, keep_hashes: set[str]) -> int:
+    """Delete every document whose hash is not in keep_hashes. Returns count."""
+    stale = [
+        (doc_id,)
+        for doc_id, h in conn.execute("SELECT id, doc_hash FROM documents")
+        if h not in keep_hashes
+    ]
+    conn.executemany("DELETE FROM documents WHERE id = ?", stale)
+    conn.commit()
+    return len(stale)
+
+
+def _read_embeddings(conn: sqlite3.Connection) -> tuple[np.ndarray, np.ndarray | None]:
+    """Read (ids, embeddings) straight from the BLOB column, ordered by id.
+
+    The BLOBs are joined and decoded in one frombuffer call; the matrix is
+    read-only. Raises ValueError if any BLOB is not EMBEDDING_DIM float32s.
+    """
     rows = conn.execute("SELECT id, embedding FROM documents ORDER BY id").fetchall()
     if not rows:
+        return np.empty(0, dtype=np.int64), None
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    blob = b"".join(r[1] for r in rows)
+    if len(blob) != len(rows) * EMBEDDING_DIM * 4:
+        raise ValueError(
+            f"Corrupt embeddings: {len(blob)} bytes for {len(rows)} rows of dim {EMBEDDING_DIM}"
+        )
+    return ids, np.frombuffer(blob, dtype=np.float32).reshape(len(rows), EMBEDDING_DIM)
+
+
+def load_all_embeddings(conn: sqlite3.Connection) -> tuple[list[int], np.ndarray | None]:
+    """Load all (id, embedding) pairs. Returns ([], None) if empty.
+
+    The matrix is a read-only memmap of the .npy sidecar (see
+    load_embedding_matrix), not a copy.
+    """
+    loaded = load_embedding_matrix(conn)
+    if loaded is None:
         return [], None
-    ids = [r[0] for r in rows]
-    vectors = np.array(
-        [np.frombuffer(r[1], dtype=np.float32) for r in rows],
-        dtype=np.float32,
-    )
-    return ids, vectors
+    ids, matrix = loaded
+    return ids.tolist(), matrix
 
 
 def load_filtered_embeddings(
     conn: sqlite3.Connection, filters: dict
 ) -> tuple[list[int], np.ndarray | None]:
-    """Load embeddings matching metadata filters. Returns ([], None) if empty."""
+    """Load embeddings matching metadata filters. Returns ([], None) if empty.
+
+    SQLite only resolves the matching ids; their rows are gathered from
+    the embedding matrix.
+    """
+    ids = filtered_ids(conn, filters)
+    if not ids:
+        return [], None
+    all_ids, matrix = load_embedding_matrix(conn)
+    return ids, matrix[np.searchsorted(all_ids, ids)]
+
+
+def filtered_ids(conn: sqlite3.Connection, filters: dict) -> list[int]:
+    """Ids of the documents matching metadata filters, ascending."""
     where_clauses, params = _build_filter_clauses(filters)
     where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-    rows = conn.execute(
-        f"SELECT id, embedding FROM documents WHERE {where_sql} ORDER BY id",
-        params,
-    ).fetchall()
-    if not rows:
-        return [], None
-    ids = [r[0] for r in rows]
-    vectors = np.array(
-        [np.frombuffer(r[1], dtype=np.float32) for r in rows],
-        dtype=np.float32,
-    )
-    return ids, vectors
+    return [
+        doc_id for (doc_id,) in conn.execute(
+            f"SELECT id FROM documents WHERE {where_sql} ORDER BY id", params
+        )
+    ]
 
 
 def _build_filter_clauses(filters: dict) -> tuple[list[str], list]:
@@ -150,9 +343,16 @@ def _build_filter_clauses(filters: dict) -> tuple[list[str], list]:
 
 
 def _parse_image_ids(raw: str | None) -> list[str]:
-    """Parse image_ids from JSON string or return empty list."""
-    if not raw:
+    """Parse image_ids from JSON string or return empty list.
+
+    Empty lists and the common single-id value skip the JSON parser.
+    """
+    if not raw or raw == "[]":
         return []
+    if raw.startswith('["') and raw.endswith('"]'):
+        inner = raw[2:-2]
+        if '"' not in inner and "\\" not in inner:
+            return [inner]
     try:
         result = json.loads(raw)
         return result if isinstance(result, list) else []
@@ -205,17 +405,51 @@ def substring_search(
     return [_row_to_dict(r) for r in rows]
 
 
+# Every document of a database as a dict, for id lookups after a vector
+# search: db key -> (fingerprint, {id: document}). Rebuilt whenever the
+# store's fingerprint changes (documents are only inserted or deleted).
+_DOCS: dict[str, tuple[tuple, dict[int, dict]]] = {}
+
+
+def _documents_by_id(conn: sqlite3.Connection) -> dict[int, dict]:
+    """The cached {id: document} map of conn's database, refreshed if stale."""
+    fingerprint = _store_fingerprint(conn)
+    key = _db_key(conn)
+    cached = _DOCS.get(key)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    docs = {doc["id"]: doc for doc in get_all_documents(conn)}
+    _DOCS[key] = (fingerprint, docs)
+    return docs
+
+
+def _docs_add(conn: sqlite3.Connection, doc_id: int, row: tuple) -> None:
+    """Add a just-stored document (its _document_row) to the cached map, if loaded."""
+    key = _db_key(conn)
+    cached = _DOCS.get(key)
+    if cached is None:
+        return
+    fingerprint, docs = cached
+    text, _, created_at, meta_doc_id, category, title, image_ids, _ = row
+    docs[doc_id] = _row_to_dict(
+        (doc_id, text, created_at, meta_doc_id, category, title, image_ids)
+    )
+    _DOCS[key] = (_added_fingerprint(fingerprint, doc_id), docs)
+
+
 def get_documents_by_ids(conn: sqlite3.Connection, doc_ids: list[int]) -> list[dict]:
-    """Fetch documents by ID, returned in the order of doc_ids."""
+    """Fetch documents by ID, returned in the order of doc_ids.
+
+    Served from the in-memory document map; each call gets fresh dicts
+    the caller may modify.
+    """
     if not doc_ids:
         return []
-    placeholders = ",".join("?" for _ in doc_ids)
-    rows = conn.execute(
-        f"SELECT {_SELECT_COLS} FROM documents WHERE id IN ({placeholders})",
-        doc_ids,
-    ).fetchall()
-    by_id = {r[0]: _row_to_dict(r) for r in rows}
-    return [by_id[did] for did in doc_ids if did in by_id]
+    docs = _documents_by_id(conn)
+    return [
+        {**docs[did], "image_ids": list(docs[did]["image_ids"])}
+        for did in doc_ids if did in docs
+    ]
 
 
 def get_document_count(conn: sqlite3.Connection) -> int:
@@ -266,6 +500,23 @@ def get_embedding(client: OpenAI, text: str) -> np.ndarray:
     return np.array(response.data[0].embedding, dtype=np.float32)
 
 
+@lru_cache(maxsize=QUERY_EMBED_CACHE_SIZE)
+def _embed_query_cached(client: OpenAI, model: str, text: str) -> bytes:
+    """Unit-length embedding bytes of a query (model is part of the key)."""
+    return unit_vector(get_embedding(client, text)).tobytes()
+
+
+def get_query_embedding(client: OpenAI, text: str) -> np.ndarray:
+    """Embed a search query as a normalized (1, 1536) float32 row.
+
+    Repeated queries are served from an in-process LRU cache instead of
+    another OpenAI round trip. The row is a read-only view of the cached
+    bytes, so no per-search buffer is allocated.
+    """
+    cached = _embed_query_cached(client, EMBEDDING_MODEL, text)
+    return np.frombuffer(cached, dtype=np.float32).reshape(1, -1)
+
+
 def get_embeddings_batch(client: OpenAI, texts: list[str]) -> list[np.ndarray]:
     """Embed multiple texts in one API call. Returns list of float32 arrays."""
     response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
@@ -275,18 +526,380 @@ def get_embeddings_batch(client: OpenAI, texts: list[str]) -> list[np.ndarray]:
     ]
 
 
+async def get_embeddings_batch_async(
+    client: AsyncOpenAI, texts: list[str]
+) -> list[np.ndarray]:
+    """Async get_embeddings_batch() for use with AsyncOpenAI."""
+    response = await client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [
+        np.array(item.embedding, dtype=np.float32)
+        for item in sorted(response.data, key=lambda x: x.index)
+    ]
+
+
+@lru_cache(maxsize=1)
+def _token_encoding():
+    """tiktoken encoding of EMBEDDING_MODEL, or None if unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    except Exception:  # unknown model, or the BPE file can't be fetched
+        return None
+
+
+def count_tokens(texts: list[str]) -> list[int]:
+    """Token count of each text.
+
+    Without tiktoken, the UTF-8 byte length is used: every token covers at
+    least one byte, so it never undercounts.
+    """
+    enc = _token_encoding()
+    if enc is None:
+        return [len(t.encode("utf-8")) for t in texts]
+    return [len(tokens) for tokens in enc.encode_ordinary_batch(texts)]
+
+
+def token_batches(texts: list[str]) -> list[tuple[int, int]]:
+    """Split texts into consecutive [start, end) ranges for embeddings requests.
+
+    Each range stays within EMBED_BATCH_TOKENS tokens and EMBED_BATCH_SIZE
+    inputs (a single oversized text still gets a range of its own).
+    """
+    ranges = []
+    start = used = 0
+    for i, n in enumerate(count_tokens(texts)):
+        if i > start and (used + n > EMBED_BATCH_TOKENS or i - start >= EMBED_BATCH_SIZE):
+            ranges.append((start, i))
+            start, used = i, 0
+        used += n
+    if start < len(texts):
+        ranges.append((start, len(texts)))
+    return ranges
+
+
+def embed_batches_threaded(
+    client: OpenAI, batches: list[list[str]]
+) -> Iterator[list[np.ndarray] | Exception]:
+    """Yield get_embeddings_batch() of each batch in order, EMBED_CONCURRENCY at a time.
+
+    A failed batch yields its exception instead of raising. Batches not
+    yet started are cancelled once the caller stops iterating.
+    """
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        futures = [pool.submit(get_embeddings_batch, client, b) for b in batches]
+        try:
+            for future in futures:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield e
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# ════════════════════════════════════════════════════════════
+#  EMBEDDING MATRIX (.npy sidecar)
+# ════════════════════════════════════════════════════════════
+
+# All embeddings of a database as one contiguous (n, 1536) float32 matrix,
+# rows ordered by document id, saved next to the DB as <db>.emb.npy (ids in
+# <db>.ids.npy) and memory-mapped: db key -> (fingerprint, ids, matrix).
+# SQLite's BLOB column stays the source of truth; the sidecar is rewritten
+# whenever the fingerprint no longer matches the documents table.
+_MATRICES: dict[str, tuple[tuple, np.ndarray, np.ndarray]] = {}
+
+
+def _db_key(conn: sqlite3.Connection) -> str:
+    """The database file behind conn (a per-connection key for :memory:)."""
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    return db_file or f":memory:{id(conn)}"
+
+
+def _store_fingerprint(conn: sqlite3.Connection) -> tuple:
+    """(count, max id, sum of ids) of stored documents; changes on any insert/delete."""
+    return tuple(conn.execute(
+        "SELECT COUNT(*), MAX(id), TOTAL(id) FROM documents"
+    ).fetchone())
+
+
+def _added_fingerprint(fingerprint: tuple, doc_id: int) -> tuple:
+    """The fingerprint after inserting doc_id.
+
+    If the cached fingerprint was already stale, the result won't match the
+    store either and the cache is rebuilt on next use.
+    """
+    count, max_id, total = fingerprint
+    return count + 1, max(max_id or 0, doc_id), total + doc_id
+
+
+def _ids_fingerprint(ids: np.ndarray) -> tuple:
+    """_store_fingerprint() of the documents with these ids."""
+    if not len(ids):
+        return 0, None, 0.0
+    return len(ids), int(ids.max()), float(ids.sum())
+
+
+def matrix_paths(db_key: str) -> tuple[Path, Path] | None:
+    """(matrix, ids) sidecar files of a database file (None for :memory:)."""
+    if db_key.startswith(":memory:"):
+        return None
+    db = Path(db_key)
+    return db.with_suffix(".emb.npy"), db.with_suffix(".ids.npy")
+
+
+def _save_npy(array: np.ndarray, path: Path) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def load_embedding_matrix(
+    conn: sqlite3.Connection,
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """Return (ids, matrix) of every stored embedding, or None if empty."""
+    fingerprint = _store_fingerprint(conn)
+    if not fingerprint[0]:
+        return None
+    key = _db_key(conn)
+    cached = _MATRICES.get(key)
+    if cached and cached[0] == fingerprint:
+        return cached[1], cached[2]
+    _MATRICES.pop(key, None)
+
+    paths = matrix_paths(key)
+    loaded = None
+    if paths is not None and paths[0].exists() and paths[1].exists():
+        try:
+            ids = np.load(paths[1])
+            if _ids_fingerprint(ids) == fingerprint:
+                loaded = ids, np.load(paths[0], mmap_mode="r")
+        except (OSError, ValueError):
+            loaded = None
+    if loaded is None:
+        ids, matrix = _read_embeddings(conn)
+        loaded = ids, matrix
+        if paths is not None:
+            try:
+                _save_npy(matrix, paths[0])
+                _save_npy(ids, paths[1])
+                loaded = ids, np.load(paths[0], mmap_mode="r")
+            except OSError:
+                pass  # e.g. old file still mapped elsewhere; keep the in-memory copy
+    _MATRICES[key] = (fingerprint, *loaded)
+    return loaded
+
+
 # ════════════════════════════════════════════════════════════
 #  FAISS LAYER
 # ════════════════════════════════════════════════════════════
 
+def _trained_index(embeddings: np.ndarray) -> faiss.Index:
+    """Empty inner-product index for the persistent store index, trained if needed.
+
+    Flat (exact) below SQ8_MIN_ROWS; 8-bit scalar quantized (1 byte per
+    dimension) up to IVFPQ_MIN_ROWS; IVF+PQ above, trained on a random
+    sample of up to IVFPQ_TRAIN_SAMPLE rows. Training is paid once per
+    rebuild; build_faiss_index (small ad-hoc sets) stays flat. With
+    INDEX_TYPE "hnsw", an HNSW graph replaces both quantized tiers.
+    """
+    if len(embeddings) < SQ8_MIN_ROWS:
+        return faiss.IndexFlatIP(EMBEDDING_DIM)
+    if INDEX_TYPE == "hnsw":
+        index = faiss.IndexHNSWFlat(EMBEDDING_DIM, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if len(embeddings) < IVFPQ_MIN_ROWS:
+        index = faiss.IndexScalarQuantizer(
+            EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        index.sq.rangestat_arg = SQ8_RANGE_MARGIN
+        index.train(embeddings)
+        return index
+    index = faiss.index_factory(EMBEDDING_DIM, IVFPQ_FACTORY, faiss.METRIC_INNER_PRODUCT)
+    sample = np.random.default_rng().choice(
+        len(embeddings), min(len(embeddings), IVFPQ_TRAIN_SAMPLE), replace=False
+    )
+    index.train(np.ascontiguousarray(embeddings[np.sort(sample)]))
+    faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    return index
+
+
 def build_faiss_index(embeddings: np.ndarray) -> faiss.IndexFlatIP:
-    """Build a flat inner-product FAISS index from an (n, 1536) matrix."""
-    faiss.normalize_L2(embeddings)
+    """Build a flat inner-product FAISS index from an (n, 1536) matrix.
+
+    Rows must already be unit-length (stored embeddings are normalized on
+    insert), so inner product is cosine similarity.
+    """
     index = faiss.IndexFlatIP(EMBEDDING_DIM)
     index.add(embeddings)
     return index
 
 
+# Search index per database, reused across queries and connections:
+# db key -> (fingerprint of the documents it holds, index). Labels are
+# document ids. Persisted next to the DB as <db>.faiss.
+_INDEXES: dict[str, tuple[tuple, faiss.Index]] = {}
+# Keys whose in-memory index has changes not yet written to disk
+_UNSAVED_INDEXES: set[str] = set()
+
+
+def index_path(db_key: str) -> Path | None:
+    """Where the search index of a database file is saved (None for :memory:)."""
+    if db_key.startswith(":memory:"):
+        return None
+    if INDEX_TYPE == "hnsw":
+        return Path(db_key).with_suffix(".hnsw.faiss")
+    return Path(db_key).with_suffix(".faiss")
+
+
+def _write_index(index: faiss.Index, path: Path) -> None:
+    # Per-process temp name: concurrent rebuilds must not share one file
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        faiss.write_index(index, str(tmp))
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def load_index(conn: sqlite3.Connection) -> faiss.Index | None:
+    """Return the search index over all documents, or None if the store is empty.
+
+    Served from memory while the documents are unchanged; otherwise read
+    from the saved .faiss file if it still matches, else rebuilt from the
+    stored embeddings and saved. HNSW indexes are saved to their own file,
+    so switching INDEX_TYPE never reuses the other kind.
+    """
+    fingerprint = _store_fingerprint(conn)
+    if not fingerprint[0]:
+        return None
+    key = _db_key(conn)
+    cached = _INDEXES.get(key)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    path = index_path(key)
+    index = None
+    if path is not None and path.exists():
+        try:
+            index = faiss.read_index(str(path))
+        except RuntimeError:
+            index = None
+        if index is not None and _ids_fingerprint(faiss.vector_to_array(index.id_map)) != fingerprint:
+            index = None
+        if index is not None:
+            hnsw = faiss.downcast_index(index.index)
+            if isinstance(hnsw, faiss.IndexHNSW):
+                hnsw.hnsw.efSearch = HNSW_EF_SEARCH  # the knob may differ from the saved one
+    if index is None:
+        ids, embeddings = load_all_embeddings(conn)
+        index = faiss.IndexIDMap2(_trained_index(embeddings))
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+        if path is not None:
+            try:
+                _write_index(index, path)
+            except (OSError, RuntimeError) as e:
+                # e.g. read-only directory: serve the in-memory index
+                logger.warning("Could not save search index to %s: %s", path, e)
+    _INDEXES[key] = (fingerprint, index)
+    _UNSAVED_INDEXES.discard(key)
+    return index
+
+
+def _index_add(conn: sqlite3.Connection, doc_id: int, embedding: np.ndarray) -> None:
+    """Add a just-stored (unit-length) document to the in-memory index, if loaded."""
+    key = _db_key(conn)
+    cached = _INDEXES.get(key)
+    if cached is None:
+        return
+    fingerprint, index = cached
+    index.add_with_ids(embedding.reshape(1, -1), np.array([doc_id], dtype=np.int64))
+    _INDEXES[key] = (_added_fingerprint(fingerprint, doc_id), index)
+    _UNSAVED_INDEXES.add(key)
+
+
+@atexit.register
+def save_indexes() -> None:
+    """Write in-memory indexes with unsaved additions to their .faiss files."""
+    for key in list(_UNSAVED_INDEXES):
+        path = index_path(key)
+        if path is not None:
+            try:
+                _write_index(_INDEXES[key][1], path)
+            except (OSError, RuntimeError) as e:
+                logger.warning("Could not save search index to %s: %s", path, e)
+        _UNSAVED_INDEXES.discard(key)
+
+
+def topk_numpy(
+    matrix: np.ndarray, q: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Exact top-k inner products of q against the rows of matrix.
+
+    Returns (scores, row indices), best first. One BLAS GEMV plus a
+    partial sort; no index object is built.
+    """
+    s = matrix @ q
+    k = min(k, len(s))
+    idx = np.argpartition(-s, k - 1)[:k]
+    idx = idx[np.argsort(-s[idx])]
+    return s[idx], idx
+
+
+def _candidate_index(
+    conn: sqlite3.Connection, filters: dict | None
+) -> tuple[faiss.Index | np.ndarray | None, list[int] | None, faiss.SearchParameters | None]:
+    """What to search for the given filters: (index, position -> id map, params).
+
+    Everything goes through the persistent store index, whose labels are
+    document ids (map is None); filters become an IDSelectorBatch over the
+    matching ids. The exception is a small filtered set on an approximate
+    (SQ8 / IVF+PQ / HNSW) index, where quantized scores are cheap to avoid
+    and a probed or graph search could miss most candidates: those rows
+    are gathered and scored exactly (index is then their matrix).
+    """
+    index = load_index(conn)
+    if index is None or not filters:
+        return index, None, None
+    ids = filtered_ids(conn, filters)
+    if not ids:
+        return None, None, None
+    exact = isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+    if not exact and len(ids) < NUMPY_SEARCH_MAX_ROWS:
+        all_ids, matrix = load_embedding_matrix(conn)
+        return matrix[np.searchsorted(all_ids, ids)], ids, None
+    sel = faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return index, None, faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+    return index, None, faiss.SearchParameters(sel=sel)
+
+
+def _search_index(
+    index: faiss.Index | np.ndarray,
+    ids: list[int] | None,
+    query_vec: np.ndarray,
+    top_k: int,
+    params: faiss.SearchParameters | None = None,
+) -> tuple[list[int], list[float]]:
+    """Top-k (document ids, scores) for a normalized (1, d) query vector."""
+    if isinstance(index, np.ndarray):
+        scores, rows = topk_numpy(index, query_vec[0], top_k)
+        return [ids[i] for i in rows], scores.tolist()
+    scores, labels = index.search(query_vec, min(top_k, index.ntotal), params=params)
+    matched_ids = []
+    matched_scores = []
+    for score, label in zip(scores[0], labels[0]):
+        if label >= 0:
+            matched_ids.append(int(label) if ids is None else ids[label])
+            matched_scores.append(float(score))
+    return matched_ids, matched_scores
+
+
 # ════════════════════════════════════════════════════════════
 #  PROGRAMMATIC API  (used by MCP tool and other callers)
 # ════════════════════════════════════════════════════════════
@@ -322,21 +935,11 @@ def hybrid_search(
     merged: dict[int, dict] = {}
 
     # ── Vector search ────────────────────────────────────
-    if filters:
-        ids, embeddings = load_filtered_embeddings(conn, filters)
-    else:
-        ids, embeddings = load_all_embeddings(conn)
+    index, ids, params = _candidate_index(conn, filters)
+    if index is not None:
+        query_vec = get_query_embedding(client, query)
 
-    if embeddings is not None and len(ids) > 0:
-        index = build_faiss_index(embeddings)
-        query_vec = get_embedding(client, query).reshape(1, -1)
-        faiss.normalize_L2(query_vec)
-
-        k = min(top_k, len(ids))
-        scores, indices = index.search(query_vec, k)
-
-        matched_ids = [ids[i] for i in indices[0] if i >= 0]
-        matched_scores = [float(scores[0][j]) for j, i in enumerate(indices[0]) if i >= 0]
+        matched_ids, matched_scores = _search_index(index, ids, query_vec, top_k, params)
         vector_docs = get_documents_by_ids(conn, matched_ids)
 
         for doc, score in zip(vector_docs, matched_scores):
@@ -355,7 +958,7 @@ def hybrid_search(
             merged[doc["id"]] = doc
 
     # ── IMG_* pattern search — extract image IDs from query and search for each ──
-    img_ids_in_query = re.findall(r"IMG_[A-Z]+_\d+", query)
+    img_ids_in_query = _IMG_ID_RE.findall(query)
     for img_id in img_ids_in_query:
         if img_id == query:
             continue  # Already covered by the main substring search
@@ -380,14 +983,24 @@ def hybrid_search(
 #  SETUP
 # ════════════════════════════════════════════════════════════
 
-def setup() -> OpenAI:
-    """Load env, validate API key, return OpenAI client."""
+def _require_api_key() -> str:
+    """Load env and return OPENAI_API_KEY, exiting if it is not set."""
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("Error: OPENAI_API_KEY not set. Add it to .env or environment.", file=sys.stderr)
         sys.exit(1)
-    return OpenAI(api_key=api_key)
+    return api_key
+
+
+def setup() -> OpenAI:
+    """Load env, validate API key, return OpenAI client."""
+    return OpenAI(api_key=_require_api_key())
+
+
+def setup_async() -> AsyncOpenAI:
+    """Load env, validate API key, return AsyncOpenAI client."""
+    return AsyncOpenAI(api_key=_require_api_key())
 
 
 # ════════════════════════════════════════════════════════════
@@ -406,7 +1019,7 @@ def parse_knowledge_file(filepath: Path) -> list[dict] | None:
     # Try as single JSON object first (e.g. image_mapping.txt)
     if stripped.startswith("{") and not stripped.startswith('{"id"'):
         try:
-            data = json.loads(stripped)
+            data = _loads(stripped)
             if isinstance(data, dict) and not data.get("id"):
                 # It's a mapping dict (like image_mapping) — convert entries to records
                 records = []
@@ -430,7 +1043,7 @@ def parse_knowledge_file(filepath: Path) -> list[dict] | None:
         if not line:
             continue
         try:
-            record = json.loads(line)
+            record = _loads(line)
             if isinstance(record, dict) and "id" in record and "content" in record:
                 records.append(record)
         except json.JSONDecodeError:
@@ -456,6 +1069,7 @@ def cmd_add(client: OpenAI, conn: sqlite3.Connection, text: str) -> None:
         return
 
     doc_id = store_document(conn, text, embedding)
+    conn.commit()
     print(f"  Stored document {doc_id} ({len(text)} chars)")
 
 
@@ -471,18 +1085,8 @@ def parse_filters(rest: str) -> tuple[str, dict]:
     Supported filters:
       --category recipe
     """
-    filters = {}
-    filter_pattern = re.compile(
-        r"--(category)\s+(\S+)"
-    )
-
-    query = rest
-    for match in filter_pattern.finditer(rest):
-        key = match.group(1)
-        filters[key] = match.group(2)
-        query = query.replace(match.group(0), "")
-
-    return query.strip(), filters
+    filters = dict(_FILTER_RE.findall(rest))
+    return _FILTER_RE.sub("", rest).strip(), filters
 
 
 def _print_doc(doc: dict, rank: int, score: float | None = None, overlap: bool = False) -> None:
@@ -531,27 +1135,16 @@ def cmd_search(client: OpenAI, conn: sqlite3.Connection, query: str, top_k: int
 
     # ── Vector (Semantic) Search ──────────────────────────
     vector_ids: list[int] = []
-    if filters:
-        ids, embeddings = load_filtered_embeddings(conn, filters)
-    else:
-        ids, embeddings = load_all_embeddings(conn)
+    index, ids, params = _candidate_index(conn, filters)
 
-    if embeddings is not None:
-        index = build_faiss_index(embeddings)
+    if index is not None:
         try:
-            query_vec = get_embedding(client, clean_query)
+            query_vec = get_query_embedding(client, clean_query)
         except Exception as e:
             print(f"  Error: Failed to generate embedding: {e}")
             return
 
-        query_vec = query_vec.reshape(1, -1)
-        faiss.normalize_L2(query_vec)
-
-        k = min(top_k, len(ids))
-        scores, indices = index.search(query_vec, k)
-
-        matched_ids = [ids[i] for i in indices[0] if i >= 0]
-        matched_scores = [float(scores[0][j]) for j, i in enumerate(indices[0]) if i >= 0]
+        matched_ids, matched_scores = _search_index(index, ids, query_vec, top_k, params)
         vector_docs = get_documents_by_ids(conn, matched_ids)
         vector_ids = [d["id"] for d in vector_docs]
 
@@ -638,6 +1231,160 @@ def cmd_load(client: OpenAI, conn: sqlite3.Connection, filepath: str) -> None:
         _load_plain_text(client, conn, content, path.name)
 
 
+def _record_metadata(record: dict) -> dict:
+    """Metadata stored alongside a knowledge record's embedding."""
+    return {
+        "doc_id": record.get("id"),
+        "category": record.get("category"),
+        "title": record.get("title"),
+        "image_ids": record.get("image_ids", []),
+    }
+
+
+def _plain_text_lines(content: str) -> list[str]:
+    """Non-empty lines of a plain text file, minus separator/box-drawing lines."""
+    lines = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if all(c in "=-+|# \t─━═╔╗╚╝║╠╣╦╩" for c in stripped):
+            continue
+        lines.append(stripped)
+    return lines
+
+
+def _collect_new_documents(
+    conn: sqlite3.Connection, filepaths: list[str], prune: bool
+) -> list[tuple[str, dict | None]]:
+    """Parse filepaths into (text, metadata) documents not yet stored.
+
+    Documents whose content hash is already in the store (or repeated
+    within filepaths) are dropped; with prune=True, stored documents that
+    no longer appear in filepaths are deleted first, unless a file could
+    not be read (its documents would look stale).
+    """
+    docs: list[tuple[str, dict | None]] = []
+    failed = 0
+    for filepath in filepaths:
+        path = Path(filepath)
+        try:
+            content = path.read_text(encoding="utf-8")
+            records = parse_knowledge_file(path)
+        except Exception as e:
+            print(f"  Error: Cannot read file {filepath}: {e}")
+            failed += 1
+            continue
+
+        if records:
+            docs.extend((row_to_natural_language(r), _record_metadata(r)) for r in records)
+            print(f"  {path.name}: {len(records)} knowledge records")
+        else:
+            lines = _plain_text_lines(content)
+            docs.extend((line, None) for line in lines)
+            print(f"  {path.name}: {len(lines)} lines")
+
+    hashes = [document_hash(text, meta) for text, meta in docs]
+    if prune and failed:
+        print(f"  Not pruning: {failed} file(s) could not be read")
+    elif prune:
+        removed = delete_documents_except(conn, set(hashes))
+        if removed:
+            print(f"  Removed {removed} document(s) no longer in the source files")
+
+    seen = get_document_hashes(conn)
+    pending = []
+    for doc, h in zip(docs, hashes):
+        if h not in seen:
+            seen.add(h)
+            pending.append(doc)
+    unchanged = len(docs) - len(pending)
+    if unchanged:
+        print(f"  Skipped {unchanged} unchanged document(s)")
+    if not pending:
+        print("  No new content found." if docs else "  No content found.")
+    return pending
+
+
+def cmd_load_batch(
+    client: OpenAI,
+    conn: sqlite3.Connection,
+    filepaths: list[str],
+    prune: bool = False,
+) -> None:
+    """Load several files, embedding their documents together.
+
+    Documents from all files are pooled so each embeddings request carries
+    up to EMBED_BATCH_SIZE inputs / EMBED_BATCH_TOKENS tokens regardless of
+    file boundaries (see token_batches); each embedded batch is inserted in one transaction. Documents whose content
+    hash is already stored are not re-embedded. With prune=True the store
+    is made to mirror filepaths: every other document is deleted.
+    """
+    pending = _collect_new_documents(conn, filepaths, prune)
+    if not pending:
+        return
+
+    stored = 0
+    ranges = token_batches([text for text, _ in pending])
+    for n, (start, end) in enumerate(ranges, start=1):
+        batch = pending[start:end]
+        try:
+            embeddings = get_embeddings_batch(client, [text for text, _ in batch])
+        except Exception as e:
+            print(f"  Error at batch {n}: {e}")
+            break
+
+        store_documents(conn, [
+            (text, emb, meta) for (text, meta), emb in zip(batch, embeddings)
+        ])
+        stored += len(batch)
+        print(f"  Imported {stored}/{len(pending)}...")
+
+    print(f"  Done! {stored} documents imported from {len(filepaths)} file(s)")
+
+
+async def cmd_load_batch_async(
+    client: AsyncOpenAI,
+    conn: sqlite3.Connection,
+    filepaths: list[str],
+    prune: bool = False,
+) -> None:
+    """cmd_load_batch() with the embeddings requests issued concurrently.
+
+    Up to EMBED_CONCURRENCY requests are in flight at once. Every batch
+    that succeeds is stored (in source order); failed batches are reported
+    and can be picked up by re-running, since stored hashes are skipped.
+    """
+    pending = _collect_new_documents(conn, filepaths, prune)
+    if not pending:
+        return
+
+    batches = [
+        pending[start:end]
+        for start, end in token_batches([text for text, _ in pending])
+    ]
+    limit = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed(batch: list[tuple[str, dict | None]]) -> list[np.ndarray]:
+        async with limit:
+            return await get_embeddings_batch_async(client, [text for text, _ in batch])
+
+    results = await asyncio.gather(*(embed(b) for b in batches), return_exceptions=True)
+
+    stored = 0
+    for n, (batch, embeddings) in enumerate(zip(batches, results), start=1):
+        if isinstance(embeddings, BaseException):
+            print(f"  Error at batch {n}: {embeddings}")
+            continue
+        store_documents(conn, [
+            (text, emb, meta) for (text, meta), emb in zip(batch, embeddings)
+        ])
+        stored += len(batch)
+        print(f"  Imported {stored}/{len(pending)}...")
+
+    print(f"  Done! {stored} documents imported from {len(filepaths)} file(s)")
+
+
 def _load_knowledge(
     client: OpenAI, conn: sqlite3.Connection, records: list[dict], filename: str
 ) -> None:
@@ -651,26 +1398,23 @@ def _load_knowledge(
     print(f"\n  Sample (record 1):")
     print(f"    \"{nl_texts[0][:150]}...\"\n")
 
-    # Batch embed
-    BATCH_SIZE = 100
+    # Batch embed by token budget (several requests in flight), store in order
+    ranges = token_batches(nl_texts)
+    text_batches = [nl_texts[start:end] for start, end in ranges]
     stored = 0
-    for i in range(0, len(nl_texts), BATCH_SIZE):
-        batch_texts = nl_texts[i:i + BATCH_SIZE]
-        batch_records = records[i:i + BATCH_SIZE]
-        try:
-            embeddings = get_embeddings_batch(client, batch_texts)
-        except Exception as e:
-            print(f"  Error at batch {i // BATCH_SIZE + 1}: {e}")
+    for n, embeddings in enumerate(embed_batches_threaded(client, text_batches)):
+        if isinstance(embeddings, Exception):
+            print(f"  Error at batch {n + 1}: {embeddings}")
             break
 
-        for text, emb, record in zip(batch_texts, embeddings, batch_records):
-            store_document(conn, text, emb, metadata={
-                "doc_id": record.get("id"),
-                "category": record.get("category"),
-                "title": record.get("title"),
-                "image_ids": record.get("image_ids", []),
-            })
-            stored += 1
+        batch_texts = text_batches[n]
+        batch_records = records[ranges[n][0]:ranges[n][1]]
+        with conn:  # one commit per batch
+            insert_documents(conn, [
+                (text, emb, _record_metadata(record))
+                for text, emb, record in zip(batch_texts, embeddings, batch_records)
+            ])
+        stored += len(batch_texts)
 
         print(f"  Imported {stored}/{len(records)}...")
 
@@ -683,14 +1427,7 @@ def _load_plain_text(
     client: OpenAI, conn: sqlite3.Connection, content: str, filename: str
 ) -> None:
     """Load a plain text file (one line = one document)."""
-    lines = []
-    for line in content.splitlines():
-        stripped = line.strip()
-        if not stripped:
-            continue
-        if all(c in "=-+|# \t─━═╔╗╚╝║╠╣╦╩" for c in stripped):
-            continue
-        lines.append(stripped)
+    lines = _plain_text_lines(content)
 
     if not lines:
         print("  No content lines found in file.")
@@ -698,19 +1435,17 @@ def _load_plain_text(
 
     print(f"  Found {len(lines)} lines to import from {filename}")
 
-    BATCH_SIZE = 100
+    batches = [lines[start:end] for start, end in token_batches(lines)]
     stored = 0
-    for i in range(0, len(lines), BATCH_SIZE):
-        batch = lines[i:i + BATCH_SIZE]
-        try:
-            embeddings = get_embeddings_batch(client, batch)
-        except Exception as e:
-            print(f"  Error at batch {i // BATCH_SIZE + 1}: {e}")
+    for n, embeddings in enumerate(embed_batches_threaded(client, batches)):
+        if isinstance(embeddings, Exception):
+            print(f"  Error at batch {n + 1}: {embeddings}")
             break
 
-        for text, emb in zip(batch, embeddings):
-            store_document(conn, text, emb)
-            stored += 1
+        batch = batches[n]
+        with conn:  # one commit per batch
+            insert_documents(conn, [(text, emb, None) for text, emb in zip(batch, embeddings)])
+        stored += len(batch)
 
         print(f"  Imported {stored}/{len(lines)}...")
 
@@ -822,7 +1557,7 @@ def repl(client: OpenAI, conn: sqlite3.Connection) -> None:
         elif command == "search":
             # Parse optional /N at the end for top-k
             top_k = 5
-            match = re.search(r"\s+/(\d+)\s*$", rest)
+            match = _TOPK_RE.search(rest)
             if match:
                 top_k = int(match.group(1))
                 rest = rest[:match.start()]
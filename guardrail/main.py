@@ -16,7 +16,6 @@ import sys
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from dotenv import load_dotenv
 from fastapi import FastAPI
 
 # Add project root for shared imports
@@ -33,8 +32,6 @@ from llm_guard import check_llm_policy, init_llm_guard
 from models import GuardCheckResult, GuardRequest, GuardResponse
 from vector_guard import check_vector_similarity, init_vector_guard
 
-load_dotenv()
-
 # ---------------------------------------------------------------------------
 # Logging
 # ---------------------------------------------------------------------------
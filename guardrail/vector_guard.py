@@ -52,6 +52,7 @@ def init_vector_guard() -> None:
     # Use shared batch embedding + FAISS index builder
     embeddings_list = get_embeddings_batch(sync_client, _topic_texts)
     embeddings = np.array(embeddings_list, dtype=np.float32)
+    faiss.normalize_L2(embeddings)
     _topic_index = build_faiss_index(embeddings)
 
     logger.info(
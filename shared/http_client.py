@@ -2,6 +2,33 @@
 
 import httpx
 
+# Keep-alive pool for MCP clients: the streamable-HTTP transport sends every
+# tool call as its own POST, so reuse connections instead of reconnecting.
+MCP_HTTP_LIMITS = httpx.Limits(
+    max_connections=50,
+    max_keepalive_connections=20,
+    keepalive_expiry=60,
+)
+MCP_HTTP_TIMEOUT = httpx.Timeout(30, read=300)
+
+
+def mcp_http_client_factory(
+    headers: dict[str, str] | None = None,
+    timeout: httpx.Timeout | None = None,
+    auth: httpx.Auth | None = None,
+) -> httpx.AsyncClient:
+    """Build the AsyncClient used by an MCP streamable-HTTP connection.
+
+    Pass as ``params={"httpx_client_factory": mcp_http_client_factory}``.
+    Same defaults as the MCP SDK's factory plus an explicit keep-alive pool.
+    """
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout or MCP_HTTP_TIMEOUT,
+        auth=auth,
+        limits=MCP_HTTP_LIMITS,
+    )
+
 
 async def forward_to_agent(
     agent_url: str,
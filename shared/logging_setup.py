@@ -1,9 +1,12 @@
 """Standardized logging setup for AI-Workshop services."""
 
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
+LOG_FORMAT = "%(asctime)s | %(levelname)-8s | %(message)s"
+
 
 def setup_logger(
     name: str,
@@ -32,7 +35,7 @@ def setup_logger(
     logger.setLevel(level)
 
     if not logger.handlers:
-        formatter = logging.Formatter("%(asctime)s | %(levelname)-8s | %(message)s")
+        formatter = logging.Formatter(LOG_FORMAT)
 
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
@@ -48,3 +51,43 @@ def setup_logger(
         logger.addHandler(file_handler)
 
     return logger
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting (incl. tracebacks) to the listener.
+
+    The stock prepare() formats the record in the emitting thread so it can
+    be pickled; records here never leave the process, so skip that work.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_queue_logger(name: str, level: int = logging.INFO) -> QueueListener:
+    """Route a logger through a queue drained by a background thread.
+
+    Formatting and the console write happen on the listener thread, so
+    logging (e.g. logger.exception in a request handler) never blocks the
+    caller's event loop.
+
+    Args:
+        name: Logger name (e.g. "agent_api")
+        level: Logging level
+
+    Returns:
+        The started QueueListener — call .stop() on shutdown to flush it
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.handlers = [_DeferredQueueHandler(log_queue)]
+    logger.propagate = False
+
+    listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,5 +1,6 @@
 """Tests for agent/agent_api.py — FastAPI chat endpoint and helpers."""
 
+import asyncio
 import sys
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -72,6 +73,13 @@ def test_parse_image_markers_strips_whitespace():
     assert ids == ["IMG_PROD_001"]
 
 
+def test_parse_image_markers_keeps_text_between_markers():
+    text = "ก <<IMG:IMG_PROD_001>>ข<<IMG:IMG_PROD_002>> ค"
+    clean, ids = parse_image_markers(text)
+    assert clean == "ก ข ค"
+    assert ids == ["IMG_PROD_001", "IMG_PROD_002"]
+
+
 def test_img_marker_pattern_regex():
     matches = IMG_MARKER_PATTERN.findall("<<IMG:IMG_PROD_001>> <<IMG:IMG_REVIEW_002>>")
     assert matches == ["IMG_PROD_001", "IMG_REVIEW_002"]
@@ -82,6 +90,15 @@ def test_img_marker_pattern_no_match_lowercase():
     assert matches == []
 
 
+def test_img_marker_pattern_rejects_non_ascii_digits():
+    assert IMG_MARKER_PATTERN.findall("<<IMG:IMG_PROD_๐๐๑>>") == []
+
+
+def test_img_marker_pattern_rejects_oversized_ids():
+    assert IMG_MARKER_PATTERN.findall("<<IMG:IMG_" + "A" * 21 + "_001>>") == []
+    assert IMG_MARKER_PATTERN.findall("<<IMG:IMG_PROD_123456789>>") == []
+
+
 # ════════════════════════════════════════════════════════════
 #  _filter_history_for_storage
 # ════════════════════════════════════════════════════════════
@@ -101,6 +118,11 @@ def test_filter_history_keeps_message_type():
     assert _filter_history_for_storage(items) == items
 
 
+def test_filter_history_keeps_summary_note():
+    items = [{"role": "system", "content": "Previously: ลูกค้าสั่ง 2 ซอง"}]
+    assert _filter_history_for_storage(items) == items
+
+
 def test_filter_history_removes_function_call():
     items = [{"type": "function_call", "name": "search", "arguments": "{}"}]
     assert _filter_history_for_storage(items) == []
@@ -135,6 +157,22 @@ def test_filter_history_empty_list():
     assert _filter_history_for_storage([]) == []
 
 
+def test_filter_history_canonical_key_order():
+    items = [{"content": "hello", "type": "message", "role": "user"}]
+    result = _filter_history_for_storage(items)
+    assert list(result[0].items()) == [("role", "user"), ("content", "hello")]
+
+
+def test_filter_history_is_idempotent():
+    items = [
+        {"content": "hello", "role": "user"},
+        {"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": "hi"}]},
+    ]
+    once = _filter_history_for_storage(items)
+    twice = _filter_history_for_storage(once)
+    assert [list(i.items()) for i in twice] == [list(i.items()) for i in once]
+
+
 # ════════════════════════════════════════════════════════════
 #  Pydantic models
 # ════════════════════════════════════════════════════════════
@@ -202,7 +240,8 @@ async def test_chat_endpoint_success(mock_session_store, mock_agent, mock_runner
 
     assert resp.status_code == 200
     data = resp.json()
-    assert "session_id" in data
+    assert len(data["session_id"]) == 8
+    int(data["session_id"], 16)  # auto-generated IDs are 8 hex chars
     assert data["response"] == "สวัสดีครับ"
     assert data["image_ids"] == []
 
@@ -323,3 +362,218 @@ async def test_chat_endpoint_history_save_exception(mock_session_store, mock_age
 
     data = resp.json()
     assert ERROR_PROCESSING in data["response"]
+
+
+@pytest.mark.asyncio
+async def test_chat_endpoint_persists_history(mock_session_store, mock_agent, mock_runner_result):
+    import httpx
+    from httpx import ASGITransport
+
+    with patch("agent.agent_api.agent", mock_agent), \
+         patch("agent.agent_api.session_store", mock_session_store), \
+         patch("agent.agent_api.Runner") as MockRunner, \
+         patch("agent.agent_api.trace"):
+        MockRunner.run = AsyncMock(return_value=mock_runner_result)
+
+        from agent.agent_api import app
+        transport = ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/chat", json={"message": "hello", "session_id": "persist"})
+
+    assert resp.json()["memory_count"] == 2
+    assert mock_session_store.get("persist") == mock_runner_result.to_input_list.return_value
+
+
+# ════════════════════════════════════════════════════════════
+#  Session write-behind
+# ════════════════════════════════════════════════════════════
+
+@pytest.fixture
+def write_behind(mock_session_store):
+    import agent.agent_api as api
+
+    queue = asyncio.Queue()
+    with patch.object(api, "session_store", mock_session_store), \
+         patch.object(api, "_write_queue", queue), \
+         patch.object(api, "_pending_writes", {}):
+        yield api, queue
+
+
+@pytest.mark.asyncio
+async def test_store_history_visible_before_commit(write_behind, mock_session_store):
+    api, queue = write_behind
+    history = [{"role": "user", "content": "hi"}]
+    await api._store_history("wb1", history)
+
+    assert await api._load_history("wb1") == history
+    assert mock_session_store.get("wb1") == []  # not committed yet
+
+
+@pytest.mark.asyncio
+async def test_drain_writes_commits_batch(write_behind, mock_session_store):
+    api, queue = write_behind
+    await api._store_history("wb1", [{"role": "user", "content": "a"}])
+    await api._store_history("wb2", [{"role": "user", "content": "b"}])
+    await api._store_history("wb1", [{"role": "user", "content": "c"}])
+
+    with patch.object(mock_session_store, "write_batch", wraps=mock_session_store.write_batch) as spy:
+        task = asyncio.create_task(api._drain_writes(queue))
+        await queue.join()
+        task.cancel()
+
+    spy.assert_called_once()
+    assert mock_session_store.get("wb1") == [{"role": "user", "content": "c"}]
+    assert mock_session_store.get("wb2") == [{"role": "user", "content": "b"}]
+    assert api._pending_writes == {}
+
+
+@pytest.mark.asyncio
+async def test_drain_writes_applies_delete(write_behind, mock_session_store):
+    api, queue = write_behind
+    mock_session_store.save("wb1", [{"role": "user", "content": "old"}])
+    await api._store_history("wb1", None)
+    assert await api._load_history("wb1") == []
+
+    task = asyncio.create_task(api._drain_writes(queue))
+    await queue.join()
+    task.cancel()
+
+    assert mock_session_store.get("wb1") == []
+    assert mock_session_store.list_all() == []
+
+
+@pytest.mark.asyncio
+async def test_store_history_truncates_shadow(write_behind, mock_session_store):
+    api, queue = write_behind
+    mock_session_store.max_messages = 2
+    history = [{"role": "user", "content": f"m{i}"} for i in range(5)]
+    await api._store_history("wb1", history)
+    assert len(await api._load_history("wb1")) == 2
+
+
+@pytest.mark.asyncio
+async def test_lifespan_stops_writer_before_closing_store(mock_session_store):
+    import agent.agent_api as api
+
+    writer_running_at_close = []
+
+    async def slow_drain(queue):
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await asyncio.sleep(0.05)  # e.g. a batch still being committed
+
+    def close():
+        writer_running_at_close.extend(
+            t for t in asyncio.all_tasks()
+            if t.get_coro().__name__ == "slow_drain" and not t.done()
+        )
+
+    mcp = MagicMock()
+    mcp.__aenter__ = AsyncMock()
+    mcp.__aexit__ = AsyncMock()
+    mcp.list_tools = AsyncMock(return_value=[])
+    with patch.object(api, "session_store", mock_session_store), \
+         patch.object(mock_session_store, "close", side_effect=close), \
+         patch.object(mock_session_store, "vacuum_expired", return_value=0), \
+         patch.object(api, "MCPServerStreamableHttp", return_value=mcp), \
+         patch.object(api, "Agent"), \
+         patch.object(api, "init_history_summary"), \
+         patch.object(api, "setup_queue_logger"), \
+         patch.object(api, "_drain_writes", slow_drain):
+        async with api.lifespan(api.app):
+            await asyncio.sleep(0)  # let the writer task start
+
+    assert writer_running_at_close == []
+    assert api._write_queue is None
+
+
+# ════════════════════════════════════════════════════════════
+#  Corrupted-session recovery
+# ════════════════════════════════════════════════════════════
+
+def _bad_request(message: str):
+    import httpx
+    from openai import BadRequestError
+
+    response = httpx.Response(400, request=httpx.Request("POST", "http://test"))
+    return BadRequestError(message, response=response, body=None)
+
+
+@pytest.mark.asyncio
+async def test_chat_endpoint_recovers_corrupted_session(mock_session_store, mock_agent, mock_runner_result):
+    import httpx
+    from httpx import ASGITransport
+
+    mock_session_store.save("broken", [{"type": "function_call_output", "output": "x"}])
+
+    with patch("agent.agent_api.agent", mock_agent), \
+         patch("agent.agent_api.session_store", mock_session_store), \
+         patch("agent.agent_api.Runner") as MockRunner, \
+         patch("agent.agent_api.trace"):
+        MockRunner.run = AsyncMock(side_effect=[
+            _bad_request("No tool call found for function call output"),
+            mock_runner_result,
+        ])
+
+        from agent.agent_api import app
+        transport = ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/chat", json={"message": "hello", "session_id": "broken"})
+
+    assert resp.json()["response"] == "สวัสดีครับ"
+    retry_input = MockRunner.run.call_args_list[1].kwargs["input"]
+    assert retry_input == [{"role": "user", "content": "hello"}]
+    assert mock_session_store.get("broken") == mock_runner_result.to_input_list.return_value
+
+
+@pytest.mark.asyncio
+async def test_chat_endpoint_retry_failure_reports_cleared_session(mock_session_store, mock_agent):
+    import httpx
+    from httpx import ASGITransport
+    from shared.constants import ERROR_SYSTEM_UNAVAILABLE
+
+    mock_session_store.save("broken", [{"role": "user", "content": "old"}])
+
+    with patch("agent.agent_api.agent", mock_agent), \
+         patch("agent.agent_api.session_store", mock_session_store), \
+         patch("agent.agent_api.Runner") as MockRunner, \
+         patch("agent.agent_api.trace"):
+        MockRunner.run = AsyncMock(side_effect=[
+            _bad_request("No tool call found for function call output"),
+            RuntimeError("still down"),
+        ])
+
+        from agent.agent_api import app
+        transport = ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/chat", json={"message": "hello", "session_id": "broken"})
+
+    data = resp.json()
+    assert data["response"] == ERROR_SYSTEM_UNAVAILABLE
+    assert data["memory_count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_endpoint_other_bad_request_not_retried(mock_session_store, mock_agent):
+    import httpx
+    from httpx import ASGITransport
+    from shared.constants import ERROR_SYSTEM_UNAVAILABLE
+
+    mock_session_store.save("s1", [{"role": "user", "content": "old"}])
+
+    with patch("agent.agent_api.agent", mock_agent), \
+         patch("agent.agent_api.session_store", mock_session_store), \
+         patch("agent.agent_api.Runner") as MockRunner, \
+         patch("agent.agent_api.trace"):
+        MockRunner.run = AsyncMock(side_effect=_bad_request("context length exceeded"))
+
+        from agent.agent_api import app
+        transport = ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/chat", json={"message": "hello", "session_id": "s1"})
+
+    data = resp.json()
+    assert data["response"] == ERROR_SYSTEM_UNAVAILABLE
+    assert data["memory_count"] == 1
+    assert MockRunner.run.call_count == 1
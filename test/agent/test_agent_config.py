@@ -32,6 +32,45 @@ def test_default_agent_model(monkeypatch):
     assert cfg.AGENT_MODEL == "gpt-4o-mini"
 
 
+def test_default_agent_api_port(monkeypatch):
+    monkeypatch.delenv("AGENT_API_PORT", raising=False)
+    import agent.agent_config as cfg
+    importlib.reload(cfg)
+    assert cfg.AGENT_API_PORT == 3000
+
+
+def test_custom_agent_api_port(monkeypatch):
+    monkeypatch.setenv("AGENT_API_PORT", "3100")
+    import agent.agent_config as cfg
+    importlib.reload(cfg)
+    assert cfg.AGENT_API_PORT == 3100
+
+
+def test_default_agent_api_workers(monkeypatch):
+    monkeypatch.delenv("AGENT_API_WORKERS", raising=False)
+    import agent.agent_config as cfg
+    importlib.reload(cfg)
+    assert cfg.AGENT_API_WORKERS == 1
+
+
+def test_default_session_limits(monkeypatch):
+    monkeypatch.delenv("MAX_HISTORY_MESSAGES", raising=False)
+    monkeypatch.delenv("SESSION_TTL_HOURS", raising=False)
+    import agent.agent_config as cfg
+    importlib.reload(cfg)
+    assert cfg.MAX_HISTORY_MESSAGES == 50
+    assert cfg.SESSION_TTL_HOURS == 24.0
+
+
+def test_custom_session_limits(monkeypatch):
+    monkeypatch.setenv("MAX_HISTORY_MESSAGES", "20")
+    monkeypatch.setenv("SESSION_TTL_HOURS", "0.5")
+    import agent.agent_config as cfg
+    importlib.reload(cfg)
+    assert cfg.MAX_HISTORY_MESSAGES == 20
+    assert cfg.SESSION_TTL_HOURS == 0.5
+
+
 def test_agent_instructions_not_empty():
     from agent.agent_config import AGENT_INSTRUCTIONS
     assert isinstance(AGENT_INSTRUCTIONS, str)
@@ -44,3 +83,8 @@ def test_agent_instructions_contains_key_rules():
     assert "<<IMG:" in AGENT_INSTRUCTIONS
     assert "memory_add" in AGENT_INSTRUCTIONS
     assert "memory_search" in AGENT_INSTRUCTIONS
+
+
+def test_agent_instructions_interned():
+    from agent.agent_config import AGENT_INSTRUCTIONS
+    assert sys.intern(AGENT_INSTRUCTIONS) is AGENT_INSTRUCTIONS
@@ -0,0 +1,100 @@
+"""Tests for agent/history_summary.py — LLM-based history compaction."""
+
+import logging
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "agent"))
+
+import agent.history_summary as hs
+
+
+def _history(n: int) -> list:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"msg{i}"}
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def summary_client(monkeypatch, mock_chat_response):
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(return_value=mock_chat_response("ลูกค้าชื่อสมชาย"))
+    monkeypatch.setattr(hs, "_async_client", client)
+    monkeypatch.setattr(hs, "HISTORY_SUMMARY_THRESHOLD", 6)
+    monkeypatch.setattr(hs, "HISTORY_SUMMARY_KEEP", 4)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_compact_history_disabled_returns_input(monkeypatch):
+    monkeypatch.setattr(hs, "_async_client", None)
+    history = _history(40)
+    assert await hs.compact_history(history) is history
+
+
+@pytest.mark.asyncio
+async def test_compact_history_under_threshold(summary_client):
+    history = _history(6)
+    assert await hs.compact_history(history) is history
+    summary_client.chat.completions.create.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_compact_history_summarizes_older_turns(summary_client):
+    history = _history(10)
+    result = await hs.compact_history(history)
+    assert result[0] == {"role": "system", "content": "Previously: ลูกค้าชื่อสมชาย"}
+    assert result[1:] == history[-4:]
+    prompt = summary_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+    assert "user: msg0" in prompt
+    assert "msg6" not in prompt
+
+
+@pytest.mark.asyncio
+async def test_compact_history_keeps_window_on_user_turn(summary_client):
+    history = _history(11)  # last 4 starts with an assistant message
+    result = await hs.compact_history(history)
+    assert result[1]["role"] == "user"
+    assert result[1:] == history[-3:]
+
+
+@pytest.mark.asyncio
+async def test_compact_history_renders_content_blocks(summary_client):
+    history = [
+        {"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": "block"}]},
+    ] + _history(8)
+    await hs.compact_history(history)
+    prompt = summary_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+    assert "assistant: block" in prompt
+
+
+@pytest.mark.asyncio
+async def test_compact_history_fails_open(summary_client):
+    summary_client.chat.completions.create.side_effect = RuntimeError("down")
+    history = _history(10)
+    assert await hs.compact_history(history) is history
+
+
+def test_init_history_summary_disabled(monkeypatch):
+    monkeypatch.setattr(hs, "_async_client", None)
+    monkeypatch.setattr(hs, "HISTORY_SUMMARY_THRESHOLD", 0)
+    hs.init_history_summary()
+    assert hs._async_client is None
+
+
+def test_logs_reach_the_api_logger():
+    api_logger = logging.getLogger("agent_api")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    api_logger.addHandler(handler)
+    try:
+        hs.logger.warning("compaction failed")
+    finally:
+        api_logger.removeHandler(handler)
+    assert [r.getMessage() for r in records] == ["compaction failed"]
@@ -2,7 +2,7 @@
 
 import sys
 from pathlib import Path
-from unittest.mock import MagicMock, patch, call
+from unittest.mock import AsyncMock, MagicMock, patch, call
 
 import pytest
 
@@ -12,7 +12,7 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "agent"))
 
 @pytest.fixture
 def mock_setup():
-    with patch("agent.load_knowledge.setup") as m:
+    with patch("agent.load_knowledge.setup_async") as m:
         m.return_value = MagicMock()
         yield m
 
@@ -26,7 +26,7 @@ def mock_init_db():
 
 @pytest.fixture
 def mock_cmd_load():
-    with patch("agent.load_knowledge.cmd_load") as m:
+    with patch("agent.load_knowledge.cmd_load_batch_async", new_callable=AsyncMock) as m:
         yield m
 
 
@@ -37,7 +37,7 @@ def mock_get_doc_count():
         yield m
 
 
-def test_main_deletes_old_db(tmp_path, mock_setup, mock_init_db, mock_cmd_load, mock_get_doc_count):
+def test_main_keeps_existing_db(tmp_path, mock_setup, mock_init_db, mock_cmd_load, mock_get_doc_count):
     db_file = tmp_path / "vector_store.db"
     db_file.write_text("old data")
 
@@ -47,7 +47,7 @@ def test_main_deletes_old_db(tmp_path, mock_setup, mock_init_db, mock_cmd_load,
         from agent.load_knowledge import main
         main()
 
-    assert not db_file.exists() or mock_init_db.called
+    assert db_file.exists()
 
 
 def test_main_creates_new_db(tmp_path, mock_setup, mock_init_db, mock_cmd_load, mock_get_doc_count):
@@ -71,7 +71,10 @@ def test_main_loads_all_txt_files(tmp_path, mock_setup, mock_init_db, mock_cmd_l
         from agent.load_knowledge import main
         main()
 
-    assert mock_cmd_load.call_count == 2
+    mock_cmd_load.assert_awaited_once()
+    paths = mock_cmd_load.call_args[0][2]
+    assert [Path(p).name for p in paths] == ["file1.txt", "file2.txt"]
+    assert mock_cmd_load.call_args.kwargs["prune"] is True
 
 
 def test_main_no_txt_files(tmp_path, mock_setup, mock_init_db, mock_cmd_load, mock_get_doc_count, capsys):
@@ -59,6 +59,7 @@ def _make_span(data_cls_name, **attrs):
 
 def test_trace_start(processor, mock_trace, capsys):
     processor.on_trace_start(mock_trace)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "TRACE START" in captured.err
     assert "Test Trace" in captured.err
@@ -66,6 +67,7 @@ def test_trace_start(processor, mock_trace, capsys):
 
 def test_trace_end(processor, mock_trace, capsys):
     processor.on_trace_end(mock_trace)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "TRACE END" in captured.err
 
@@ -73,6 +75,7 @@ def test_trace_end(processor, mock_trace, capsys):
 def test_agent_span_start(processor, capsys):
     span = _make_span("AgentSpanData", name="TestAgent", tools=["search", "memory"])
     processor.on_span_start(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "AGENT" in captured.err
     assert "TestAgent" in captured.err
@@ -82,6 +85,7 @@ def test_agent_span_end(processor, capsys):
     span = _make_span("AgentSpanData", name="TestAgent", tools=[])
     processor.on_span_start(span)  # record start time
     processor.on_span_end(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "AGENT DONE" in captured.err
 
@@ -89,6 +93,7 @@ def test_agent_span_end(processor, capsys):
 def test_function_span_start_with_input(processor, capsys):
     span = _make_span("FunctionSpanData", name="knowledge_search", input='{"query": "test"}')
     processor.on_span_start(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "TOOL CALL" in captured.err
     assert "knowledge_search" in captured.err
@@ -98,6 +103,7 @@ def test_function_span_end_with_output(processor, capsys):
     span = _make_span("FunctionSpanData", name="search", input="", output="some result data")
     processor.on_span_start(span)
     processor.on_span_end(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "TOOL DONE" in captured.err
 
@@ -105,6 +111,7 @@ def test_function_span_end_with_output(processor, capsys):
 def test_generation_span_start(processor, capsys):
     span = _make_span("GenerationSpanData", model="gpt-4o-mini")
     processor.on_span_start(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "LLM GENERATION" in captured.err
     assert "gpt-4o-mini" in captured.err
@@ -115,6 +122,7 @@ def test_generation_span_end_with_usage(processor, capsys):
                        usage={"input_tokens": 100, "output_tokens": 50})
     processor.on_span_start(span)
     processor.on_span_end(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "LLM DONE" in captured.err
     assert "100" in captured.err
@@ -124,6 +132,7 @@ def test_generation_span_end_no_usage(processor, capsys):
     span = _make_span("GenerationSpanData", model="gpt-4o-mini", usage=None)
     processor.on_span_start(span)
     processor.on_span_end(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "LLM DONE" in captured.err
 
@@ -131,6 +140,7 @@ def test_generation_span_end_no_usage(processor, capsys):
 def test_mcp_list_tools_span(processor, capsys):
     span = _make_span("MCPListToolsSpanData", server="GoSaaS MCP", result=[MagicMock(), MagicMock()])
     processor.on_span_start(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "MCP LIST TOOLS" in captured.err
 
@@ -138,6 +148,7 @@ def test_mcp_list_tools_span(processor, capsys):
 def test_handoff_span(processor, capsys):
     span = _make_span("HandoffSpanData", from_agent="Agent A", to_agent="Agent B")
     processor.on_span_start(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "HANDOFF" in captured.err
 
@@ -146,6 +157,7 @@ def test_guardrail_span_triggered(processor, capsys):
     span = _make_span("GuardrailSpanData", name="ContentGuard", triggered=True)
     processor.on_span_start(span)
     processor.on_span_end(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "TRIGGERED" in captured.err
 
@@ -154,6 +166,7 @@ def test_guardrail_span_passed(processor, capsys):
     span = _make_span("GuardrailSpanData", name="ContentGuard", triggered=False)
     processor.on_span_start(span)
     processor.on_span_end(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "passed" in captured.err
 
@@ -164,6 +177,7 @@ def test_unknown_span(processor, capsys):
     span.span_data = MagicMock()
     type(span.span_data).__name__ = "CustomSpanData"
     processor.on_span_start(span)
+    processor.force_flush()
     captured = capsys.readouterr()
     assert "CustomSpanData" in captured.err
 
@@ -189,5 +203,208 @@ def test_shutdown_no_error(processor):
     processor.shutdown()  # Should not raise
 
 
+def test_module_import_does_not_load_agents_sdk():
+    import subprocess
+    agent_dir = Path(__file__).resolve().parent.parent.parent / "agent"
+    code = "import sys, run_agents; print('agents' in sys.modules)"
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=agent_dir, capture_output=True, text=True
+    )
+    assert out.stdout.strip() == "False"
+
+
 def test_force_flush_no_error(processor):
     processor.force_flush()  # Should not raise
+
+
+def test_log_is_written_by_background_thread(processor, capsys):
+    import threading
+    writers = []
+    with patch.object(sys.stderr, "write", side_effect=lambda s: writers.append(
+            threading.current_thread())):
+        processor._log("hello")
+        processor.force_flush()
+    assert writers and threading.current_thread() not in writers
+
+
+# ════════════════════════════════════════════════════════════
+#  Interactive CLI
+# ════════════════════════════════════════════════════════════
+
+async def test_ainput_returns_line():
+    from agent.run_agents import _ainput
+    with patch("builtins.input", return_value="hello"):
+        assert await _ainput("You: ") == "hello"
+
+
+async def test_ainput_propagates_eof():
+    from agent.run_agents import _ainput
+    with patch("builtins.input", side_effect=EOFError):
+        with pytest.raises(EOFError):
+            await _ainput("You: ")
+
+
+async def test_ainput_does_not_block_event_loop():
+    import asyncio
+    import threading
+    from agent.run_agents import _ainput
+
+    release = threading.Event()
+
+    def slow_input(prompt):
+        release.wait(5)
+        return "late"
+
+    with patch("builtins.input", side_effect=slow_input):
+        task = asyncio.create_task(_ainput("You: "))
+        await asyncio.sleep(0.01)  # loop keeps running while input() blocks
+        assert not task.done()
+        release.set()
+        assert await task == "late"
+
+
+async def test_chat_loop_quits_on_eof(capsys):
+    import agent.run_agents as ra
+    with patch.object(ra, "_ainput", AsyncMock(side_effect=EOFError)), \
+         patch.object(ra.session_store, "get", return_value=[]):
+        await ra.chat_loop(MagicMock())
+    assert "Goodbye" in capsys.readouterr().out
+
+
+async def test_chat_loop_reraises_cancellation(capsys):
+    import asyncio
+    import agent.run_agents as ra
+    with patch.object(ra, "_ainput", AsyncMock(side_effect=asyncio.CancelledError)), \
+         patch.object(ra.session_store, "get", return_value=[]), \
+         pytest.raises(asyncio.CancelledError):
+        await ra.chat_loop(MagicMock())
+    assert "Goodbye" in capsys.readouterr().out
+
+
+def test_stream_writer_batches_small_deltas():
+    import io
+    from agent.run_agents import _StreamWriter
+    out = io.StringIO()
+    writer = _StreamWriter(out)
+    with patch("agent.run_agents.time.monotonic", return_value=writer._last_flush):
+        writer.write("Hel")
+        writer.write("lo")
+        assert out.getvalue() == ""
+        writer.flush()
+    assert out.getvalue() == "Hello"
+
+
+def test_stream_writer_flushes_when_buffer_full():
+    import io
+    from agent.run_agents import _StreamWriter, STREAM_FLUSH_CHARS
+    out = io.StringIO()
+    writer = _StreamWriter(out)
+    with patch("agent.run_agents.time.monotonic", return_value=writer._last_flush):
+        writer.write("x" * STREAM_FLUSH_CHARS)
+    assert out.getvalue() == "x" * STREAM_FLUSH_CHARS
+
+
+def test_stream_writer_flushes_after_interval():
+    import io
+    from agent.run_agents import _StreamWriter, STREAM_FLUSH_SECONDS
+    out = io.StringIO()
+    writer = _StreamWriter(out)
+    later = writer._last_flush + 2 * STREAM_FLUSH_SECONDS
+    with patch("agent.run_agents.time.monotonic", return_value=later):
+        writer.write("a")
+    assert out.getvalue() == "a"
+
+
+def test_span_subclass_dispatches_to_base_handler(processor, capsys):
+    from agents import AgentSpanData
+
+    class CustomAgentSpanData(AgentSpanData):
+        pass
+
+    span = MagicMock()
+    span.span_id = "sub-1"
+    span.span_data = CustomAgentSpanData(name="Sub Agent", tools=["t1"])
+    processor.on_span_start(span)
+    processor.force_flush()
+    assert "AGENT: Sub Agent" in capsys.readouterr().err
+    assert processor._start_handlers[CustomAgentSpanData] == processor._start_agent
+
+
+async def test_print_tools_banner(capsys):
+    import asyncio
+    from agent.run_agents import _print_tools
+    tool = MagicMock()
+    tool.name = "knowledge_search"
+    tool.description = "Search the knowledge base"
+
+    async def fetch():
+        return [tool]
+
+    task = asyncio.create_task(fetch())
+    await task
+    _print_tools(task)
+    out = capsys.readouterr().out
+    assert "1 tools available" in out
+    assert "knowledge_search" in out
+
+
+async def test_print_tools_reports_failure(capsys):
+    import asyncio
+    from agent.run_agents import _print_tools
+
+    async def fail():
+        raise ConnectionError("down")
+
+    task = asyncio.create_task(fail())
+    await asyncio.wait([task])
+    _print_tools(task)
+    assert "Could not list MCP tools: down" in capsys.readouterr().out
+
+
+async def test_chat_loop_waits_for_warmup_before_first_run():
+    import asyncio
+    import agent.run_agents as ra
+    order = []
+
+    async def warm():
+        await asyncio.sleep(0)
+        order.append("warmup")
+
+    def run_streamed(agent, input):
+        order.append("run")
+        raise RuntimeError("stop")
+
+    warmup = asyncio.create_task(warm())
+    inputs = AsyncMock(side_effect=["hi", EOFError])
+    with patch.object(ra, "_ainput", inputs), \
+         patch.object(ra.session_store, "get", return_value=[]), \
+         patch("agents.Runner.run_streamed", side_effect=run_streamed):
+        await ra.chat_loop(MagicMock(), warmup=warmup)
+    assert order == ["warmup", "run"]
+
+
+async def test_chat_loop_appends_only_new_items():
+    import agent.run_agents as ra
+    old = [{"role": "user", "content": "q0"}, {"role": "assistant", "content": "a0"}]
+    new = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+
+    result = MagicMock()
+    result.to_input_list.return_value = old + new
+
+    async def no_events():
+        return
+        yield
+
+    result.stream_events = no_events
+    inputs = AsyncMock(side_effect=["hi", EOFError])
+    with patch.object(ra, "_ainput", inputs), \
+         patch.object(ra.session_store, "get", return_value=list(old)), \
+         patch.object(ra.session_store, "append") as append, \
+         patch("agents.Runner.run_streamed", return_value=result):
+        await ra.chat_loop(MagicMock())
+    append.assert_called_once_with(ra.CLI_SESSION_ID, new)
+
+
+def test_truncate_strips_before_measuring():
+    assert ConsoleTraceProcessor._truncate("\n  abc  \n", 3) == "abc"
+    assert ConsoleTraceProcessor._truncate(" a\nbcd\n", 3) == "a b…"
@@ -21,6 +21,20 @@ def store(tmp_path):
     return SessionStore(db_path=tmp_path / "test.db", max_messages=10, ttl_hours=1)
 
 
+def _insert_session(db_path, session_id, updated_at, history=()):
+    """Write a session row directly, bypassing SessionStore (e.g. to age it)."""
+    with sqlite3.connect(str(db_path)) as conn:
+        conn.execute(
+            "INSERT INTO sessions (session_id, created_at, updated_at, message_count) "
+            "VALUES (?, ?, ?, ?)",
+            (session_id, updated_at, updated_at, len(history)),
+        )
+        conn.executemany(
+            "INSERT INTO messages (session_id, seq, item) VALUES (?, ?, ?)",
+            [(session_id, seq, item) for seq, item in enumerate(history)],
+        )
+
+
 @pytest.fixture
 def short_ttl_store(tmp_path):
     """SessionStore with very short TTL for expiry testing."""
@@ -41,12 +55,44 @@ def test_init_db_creates_table(tmp_path):
     assert len(tables) == 1
 
 
+def test_init_db_indexes_updated_at(store):
+    plan = store._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT session_id FROM sessions WHERE updated_at < ?",
+        (0,),
+    ).fetchall()
+    assert any("idx_sessions_updated" in row[-1] for row in plan)
+
+
 def test_init_db_idempotent(tmp_path):
     db_path = tmp_path / "idem.db"
     SessionStore(db_path=db_path)
     SessionStore(db_path=db_path)  # Should not raise
 
 
+def test_init_db_enables_wal(store):
+    mode = store._conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_init_db_sets_synchronous_normal(store):
+    # 1 = NORMAL (the default rollback-journal setting is 2 = FULL)
+    assert store._conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def test_store_reuses_single_connection(store):
+    conn = store._conn
+    store.save("s1", [{"role": "user", "content": "hi"}])
+    store.get("s1")
+    store.delete("s1")
+    assert store._conn is conn
+
+
+def test_close_closes_connection(store):
+    store.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        store._conn.execute("SELECT 1")
+
+
 # --- get / save ---
 
 def test_get_empty_session(store):
@@ -77,6 +123,28 @@ def test_save_truncates_to_max_messages(tmp_path):
     assert result[0]["content"] == "msg5"  # kept last 5
 
 
+def test_save_truncation_starts_at_user_turn(tmp_path):
+    store = SessionStore(db_path=tmp_path / "turn.db", max_messages=4)
+    history = [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"type": "function_call", "name": "search", "arguments": "{}"},
+        {"type": "function_call_output", "output": "result"},
+        {"role": "user", "content": "q2"},
+        {"role": "assistant", "content": "a2"},
+    ]
+    store.save("s1", history)
+    result = store.get("s1")
+    assert result == history[-2:]
+
+
+def test_save_truncation_without_user_keeps_window(tmp_path):
+    store = SessionStore(db_path=tmp_path / "nouser.db", max_messages=2)
+    history = [{"role": "assistant", "content": f"a{i}"} for i in range(4)]
+    store.save("s1", history)
+    assert store.get("s1") == history[-2:]
+
+
 def test_save_at_max_boundary(tmp_path):
     store = SessionStore(db_path=tmp_path / "bound.db", max_messages=5)
     history = [{"role": "user", "content": f"msg{i}"} for i in range(5)]
@@ -97,6 +165,146 @@ def test_save_unicode_content(store):
     assert result[0]["content"] == "สวัสดีครับ ทดสอบภาษาไทย"
 
 
+# --- serialization ---
+
+def test_dumps_matches_compact_stdlib_json():
+    from agent.session_store import _dumps
+    item = {"role": "user", "content": "สวัสดี \"quoted\"", "n": [1, 2]}
+    assert _dumps(item) == json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+
+
+# --- append log ---
+
+def _message_rows(store, session_id):
+    return store._conn.execute(
+        "SELECT seq, item FROM messages WHERE session_id = ? ORDER BY seq",
+        (session_id,),
+    ).fetchall()
+
+
+def test_save_appends_only_new_items(store):
+    history = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}]
+    store.save("s1", history)
+    rows_before = _message_rows(store, "s1")
+    history = history + [{"role": "user", "content": "q2"}]
+    store.save("s1", history)
+    rows_after = _message_rows(store, "s1")
+    assert rows_after[:2] == rows_before
+    assert [seq for seq, _ in rows_after] == [0, 1, 2]
+    assert store.get("s1") == history
+
+
+def test_save_evicts_from_front_when_truncated(tmp_path):
+    store = SessionStore(db_path=tmp_path / "evict.db", max_messages=4)
+    history = [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+        {"role": "assistant", "content": "a2"},
+    ]
+    store.save("s1", history)
+    history = store.get("s1") + [
+        {"role": "user", "content": "q3"},
+        {"role": "assistant", "content": "a3"},
+    ]
+    store.save("s1", history)
+    assert [seq for seq, _ in _message_rows(store, "s1")] == [2, 3, 4, 5]
+    assert store.get("s1") == history[-4:]
+
+
+def test_save_with_repeated_messages_keeps_new_window(tmp_path):
+    db_path = tmp_path / "repeat.db"
+    store = SessionStore(db_path=db_path, max_messages=4)
+    c = {"role": "user", "content": "ok"}
+    b = {"role": "assistant", "content": "Sure!"}
+    store.save("s1", [c, {"role": "assistant", "content": "x"}, c, b])
+    history = store.get("s1") + [{"role": "user", "content": "q"}, b]
+    store.save("s1", history)
+    store.close()
+
+    # A fresh store reads the rows, not the write-through cache
+    reopened = SessionStore(db_path=db_path, max_messages=4)
+    assert reopened.get("s1") == [c, b, {"role": "user", "content": "q"}, b]
+
+
+def test_save_replaces_rewritten_history(store):
+    store.save("s1", [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}])
+    compacted = [
+        {"role": "system", "content": "Previously: q1"},
+        {"role": "assistant", "content": "a1"},
+    ]
+    store.save("s1", compacted)
+    assert store.get("s1") == compacted
+
+
+def test_save_shorter_history_replaces(store):
+    store.save("s1", [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}])
+    store.save("s1", [{"role": "user", "content": "q1"}])
+    assert store.get("s1") == [{"role": "user", "content": "q1"}]
+
+
+# --- cache ---
+
+def test_get_served_from_cache_after_save(store):
+    store.save("s1", [{"role": "user", "content": "hi"}])
+    with store._lock:
+        store._conn.execute("DELETE FROM messages")  # same connection: no invalidation
+        store._conn.commit()
+    assert store.get("s1") == [{"role": "user", "content": "hi"}]
+
+
+def test_get_returns_copy_of_cached_history(store):
+    store.save("s1", [{"role": "user", "content": "hi"}])
+    store.get("s1").append({"role": "user", "content": "mutated"})
+    assert store.get("s1") == [{"role": "user", "content": "hi"}]
+
+
+def test_cache_invalidated_by_other_connection(tmp_path):
+    db_path = tmp_path / "shared.db"
+    store = SessionStore(db_path=db_path, max_messages=50, ttl_hours=1)
+    other = SessionStore(db_path=db_path, max_messages=50, ttl_hours=1)
+    store.save("s1", [{"role": "user", "content": "v1"}])
+    assert other.get("s1") == [{"role": "user", "content": "v1"}]
+    store.save("s1", [{"role": "user", "content": "v2"}])
+    assert other.get("s1") == [{"role": "user", "content": "v2"}]
+    store.delete("s1")
+    assert other.get("s1") == []
+
+
+def test_cache_evicts_least_recently_used(store):
+    with patch("agent.session_store._CACHE_SIZE", 2):
+        store.save("s1", [])
+        store.save("s2", [])
+        store.get("s1")
+        store.save("s3", [])
+    assert list(store._cache) == ["s1", "s3"]
+
+
+# --- write_batch ---
+
+def test_write_batch_saves_and_deletes(store):
+    store.save("gone", [{"role": "user", "content": "x"}])
+    store.write_batch([
+        ("s1", [{"role": "user", "content": "a"}]),
+        ("gone", None),
+        ("s2", [{"role": "user", "content": "b"}]),
+    ])
+    assert store.get("s1") == [{"role": "user", "content": "a"}]
+    assert store.get("s2") == [{"role": "user", "content": "b"}]
+    assert store.get("gone") == []
+
+
+def test_write_batch_truncates(tmp_path):
+    store = SessionStore(db_path=tmp_path / "wb.db", max_messages=3)
+    history = [{"role": "user", "content": f"msg{i}"} for i in range(6)]
+    store.write_batch([("s1", history)])
+    assert store.get("s1") == history[-3:]
+
+
+def test_write_batch_empty(store):
+    store.write_batch([])  # Should not raise
+
+
 # --- delete ---
 
 def test_delete_session(store):
@@ -116,12 +324,9 @@ def test_get_expired_session(tmp_path):
     # Save with past timestamp by manipulating DB directly
     now = time.time()
     old_time = now - 7200  # 2 hours ago (TTL is 1 hour)
-    with sqlite3.connect(str(tmp_path / "exp.db")) as conn:
-        conn.execute(
-            "INSERT INTO sessions (session_id, history, created_at, updated_at) VALUES (?, ?, ?, ?)",
-            ("s1", '[{"role":"user","content":"old"}]', old_time, old_time),
-        )
-        conn.commit()
+    _insert_session(
+        tmp_path / "exp.db", "s1", old_time, ['{"role":"user","content":"old"}']
+    )
     assert store.get("s1") == []
 
 
@@ -177,12 +382,7 @@ def test_list_all_returns_metadata(store):
 def test_list_all_excludes_expired(tmp_path):
     store = SessionStore(db_path=tmp_path / "listexp.db", max_messages=50, ttl_hours=1)
     old_time = time.time() - 7200
-    with sqlite3.connect(str(tmp_path / "listexp.db")) as conn:
-        conn.execute(
-            "INSERT INTO sessions (session_id, history, created_at, updated_at) VALUES (?, ?, ?, ?)",
-            ("old_session", "[]", old_time, old_time),
-        )
-        conn.commit()
+    _insert_session(tmp_path / "listexp.db", "old_session", old_time)
     store.save("fresh_session", [{"role": "user", "content": "hi"}])
     result = store.list_all()
     ids = [r["session_id"] for r in result]
@@ -190,15 +390,62 @@ def test_list_all_excludes_expired(tmp_path):
     assert "fresh_session" in ids
 
 
-def test_list_all_handles_corrupt_json(tmp_path):
-    store = SessionStore(db_path=tmp_path / "corrupt.db", max_messages=50, ttl_hours=1)
-    now = time.time()
-    with sqlite3.connect(str(tmp_path / "corrupt.db")) as conn:
+def _create_legacy_db(db_path, rows):
+    """Create a database in the old one-JSON-blob-per-session layout."""
+    with sqlite3.connect(str(db_path)) as conn:
+        conn.execute("""
+            CREATE TABLE sessions (
+                session_id TEXT PRIMARY KEY,
+                history    TEXT NOT NULL DEFAULT '[]',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?)",
+            [(sid, history, now, now) for sid, history in rows],
+        )
+
+
+def test_init_db_migrates_legacy_table(tmp_path):
+    history = [{"role": "user", "content": "สวัสดี"}, {"role": "assistant", "content": "hi"}]
+    _create_legacy_db(tmp_path / "legacy.db", [("s1", json.dumps(history))])
+    store = SessionStore(db_path=tmp_path / "legacy.db", max_messages=50, ttl_hours=1)
+    assert store.get("s1") == history
+    assert store.list_all()[0]["message_count"] == 2
+
+
+def test_init_db_adds_message_count_column(tmp_path):
+    db_path = tmp_path / "nocount.db"
+    with sqlite3.connect(str(db_path)) as conn:
+        conn.execute(
+            "CREATE TABLE sessions (session_id TEXT PRIMARY KEY, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
         conn.execute(
-            "INSERT INTO sessions (session_id, history, created_at, updated_at) VALUES (?, ?, ?, ?)",
-            ("corrupt", "not-valid-json", now, now),
+            "CREATE TABLE messages (session_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "item TEXT NOT NULL, PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
         )
-        conn.commit()
+        now = time.time()
+        conn.execute("INSERT INTO sessions VALUES ('s1', ?, ?)", (now, now))
+        conn.executemany(
+            "INSERT INTO messages VALUES ('s1', ?, '{}')", [(0,), (1,), (2,)]
+        )
+    store = SessionStore(db_path=db_path, max_messages=50, ttl_hours=1)
+    assert store.list_all()[0]["message_count"] == 3
+
+
+def test_list_all_reads_stored_message_count(store):
+    store.save("s1", [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}])
+    with patch("agent.session_store._loads") as loads:
+        assert store.list_all()[0]["message_count"] == 2
+    loads.assert_not_called()
+
+
+def test_init_db_migrates_corrupt_legacy_json(tmp_path):
+    _create_legacy_db(tmp_path / "corrupt.db", [("corrupt", "not-valid-json")])
+    store = SessionStore(db_path=tmp_path / "corrupt.db", max_messages=50, ttl_hours=1)
     result = store.list_all()
     assert len(result) == 1
     assert result[0]["message_count"] == 0
@@ -206,16 +453,88 @@ def test_list_all_handles_corrupt_json(tmp_path):
 
 # --- cleanup ---
 
-def test_cleanup_expired_removes_old_sessions(tmp_path):
+def test_vacuum_expired_removes_old_sessions(tmp_path):
     store = SessionStore(db_path=tmp_path / "clean.db", max_messages=50, ttl_hours=1)
     old_time = time.time() - 7200
-    with sqlite3.connect(str(tmp_path / "clean.db")) as conn:
-        conn.execute(
-            "INSERT INTO sessions (session_id, history, created_at, updated_at) VALUES (?, ?, ?, ?)",
-            ("old", "[]", old_time, old_time),
-        )
-        conn.commit()
-    store._cleanup_expired()
+    _insert_session(tmp_path / "clean.db", "old", old_time)
+    assert store.vacuum_expired() == 1
     with sqlite3.connect(str(tmp_path / "clean.db")) as conn:
         rows = conn.execute("SELECT session_id FROM sessions").fetchall()
     assert len(rows) == 0
+
+
+def test_get_does_not_delete_expired_rows(tmp_path):
+    store = SessionStore(db_path=tmp_path / "nodel.db", max_messages=50, ttl_hours=1)
+    old_time = time.time() - 7200
+    _insert_session(tmp_path / "nodel.db", "old", old_time)
+    assert store.get("old") == []
+    store.list_all()
+    with sqlite3.connect(str(tmp_path / "nodel.db")) as conn:
+        rows = conn.execute("SELECT session_id FROM sessions").fetchall()
+    assert rows == [("old",)]
+
+
+def test_write_batch_purges_expired_periodically(tmp_path):
+    store = SessionStore(db_path=tmp_path / "periodic.db", max_messages=50, ttl_hours=1)
+    old_time = time.time() - 7200
+    _insert_session(tmp_path / "periodic.db", "old", old_time)
+    with patch("agent.session_store._CLEANUP_EVERY", 2):
+        store.save("s1", [])
+        assert store._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 2
+        store.save("s1", [])
+    ids = [r[0] for r in store._conn.execute("SELECT session_id FROM sessions")]
+    assert ids == ["s1"]
+
+
+# --- append ---
+
+def test_append_to_new_session(store):
+    store.append("s1", [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}])
+    assert store.get("s1") == [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+    ]
+    assert store.list_all()[0]["message_count"] == 2
+
+
+def test_append_keeps_existing_rows(store):
+    store.save("s1", [{"role": "user", "content": "q1"}])
+    rows_before = _message_rows(store, "s1")
+    store.append("s1", [{"role": "assistant", "content": "a1"}])
+    rows_after = _message_rows(store, "s1")
+    assert rows_after[:1] == rows_before
+    assert [seq for seq, _ in rows_after] == [0, 1]
+
+
+def test_append_applies_window_at_user_turn(tmp_path):
+    store = SessionStore(db_path=tmp_path / "appwin.db", max_messages=4)
+    turns = [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+        {"type": "function_call", "name": "search", "arguments": "{}"},
+        {"type": "function_call_output", "output": "x"},
+        {"role": "assistant", "content": "a2"},
+    ]
+    store.append("s1", turns[:2])
+    store.append("s1", turns[2:])
+    expected = store.truncate(turns)
+    assert store.get("s1") == expected
+    assert store.count("s1") == len(expected)
+    assert store.list_all()[0]["message_count"] == len(expected)
+
+
+def test_append_invalidates_cache(store):
+    store.save("s1", [{"role": "user", "content": "q1"}])
+    store.get("s1")
+    store.append("s1", [{"role": "assistant", "content": "a1"}])
+    assert len(store.get("s1")) == 2
+
+
+def test_append_to_expired_session_starts_fresh(tmp_path):
+    store = SessionStore(db_path=tmp_path / "appexp.db", max_messages=50, ttl_hours=1)
+    _insert_session(
+        tmp_path / "appexp.db", "s1", time.time() - 7200, ['{"role":"user","content":"old"}']
+    )
+    store.append("s1", [{"role": "user", "content": "new"}])
+    assert store.get("s1") == [{"role": "user", "content": "new"}]
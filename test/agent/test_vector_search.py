@@ -15,14 +15,15 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "agent"))
 
 from agent.vector_search import (
-    init_db, store_document, load_all_embeddings, load_filtered_embeddings,
+    init_db, store_document, insert_documents, load_all_embeddings, load_filtered_embeddings,
     _build_filter_clauses, _parse_image_ids, _row_to_dict, substring_search,
     get_documents_by_ids, get_document_count, get_all_documents, clear_all,
-    row_to_natural_language, get_embedding, get_embeddings_batch,
-    build_faiss_index, hybrid_search, parse_knowledge_file, parse_filters,
+    row_to_natural_language, get_embedding, get_embeddings_batch, get_query_embedding,
+    embed_batches_threaded, count_tokens, token_batches,
+    build_faiss_index, topk_numpy, unit_vector, hybrid_search, parse_knowledge_file, parse_filters,
     cmd_add, cmd_clear, cmd_count, cmd_load, cmd_search, cmd_list,
     _print_doc, show_help, show_banner, get_connection, setup,
-    _load_knowledge, _load_plain_text,
+    _load_knowledge, _load_plain_text, load_embedding_matrix, matrix_paths, load_index, index_path, save_indexes,
     EMBEDDING_MODEL, EMBEDDING_DIM, DB_PATH,
 )
 
@@ -105,6 +106,7 @@ def populated_db(db_conn):
     for text, meta in zip(texts, meta_list):
         emb = _random_embedding()
         store_document(db_conn, text, emb, metadata=meta)
+    db_conn.commit()
     return db_conn
 
 
@@ -116,7 +118,7 @@ def test_init_db_creates_table(tmp_path):
     """init_db should create the documents table with all required columns."""
     conn = init_db(tmp_path / "new.db")
     cols = {row[1] for row in conn.execute("PRAGMA table_info(documents)").fetchall()}
-    expected = {"id", "text", "embedding", "created_at", "doc_id", "category", "title", "image_ids"}
+    expected = {"id", "text", "embedding", "created_at", "doc_id", "category", "title", "image_ids", "doc_hash"}
     assert expected == cols
     conn.close()
 
@@ -154,9 +156,67 @@ def test_init_db_migration(tmp_path):
     assert "category" in cols
     assert "title" in cols
     assert "image_ids" in cols
+    assert "doc_hash" in cols
     conn2.close()
 
 
+def test_init_db_applies_bulk_load_pragmas(db_conn):
+    assert db_conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db_conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+
+def test_store_document_leaves_commit_to_caller(db_conn):
+    store_document(db_conn, "doc", _random_embedding())
+    assert db_conn.in_transaction
+    db_conn.commit()
+    assert get_document_count(db_conn) == 1
+
+
+def test_insert_documents_shares_timestamp_and_normalizes(db_conn):
+    insert_documents(db_conn, [
+        ("a", np.full(EMBEDDING_DIM, 2.0, dtype=np.float32), {"doc_id": "A"}),
+        ("b", _random_embedding(), None),
+    ])
+    db_conn.commit()
+    stamps = {r[0] for r in db_conn.execute("SELECT created_at FROM documents")}
+    assert len(stamps) == 1
+    _, stored = load_all_embeddings(db_conn)
+    assert np.allclose(np.linalg.norm(stored, axis=1), 1.0, atol=1e-5)
+    assert get_all_documents(db_conn)[0]["doc_id"] == "A"
+
+
+def test_store_document_stores_unit_vector(db_conn):
+    emb = np.full(EMBEDDING_DIM, 3.0, dtype=np.float32)
+    store_document(db_conn, "doc", emb)
+    _, stored = load_all_embeddings(db_conn)
+    assert np.linalg.norm(stored[0]) == pytest.approx(1.0, abs=1e-5)
+    # The caller's array is left untouched
+    assert emb[0] == 3.0
+
+
+def test_init_db_normalizes_legacy_embeddings(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    conn = init_db(db_path)
+    raw = np.full(EMBEDDING_DIM, 2.0, dtype=np.float32)
+    conn.execute(
+        "INSERT INTO documents (text, embedding, created_at) VALUES (?, ?, ?)",
+        ("old", raw.tobytes(), "2024-01-01"),
+    )
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+    conn.close()
+
+    conn = init_db(db_path)
+    _, stored = load_all_embeddings(conn)
+    assert np.linalg.norm(stored[0]) == pytest.approx(1.0, abs=1e-5)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    conn.close()
+
+
+def test_unit_vector_handles_zero_vector():
+    assert not np.isnan(unit_vector(np.zeros(4, dtype=np.float32))).any()
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: store_document
 # ════════════════════════════════════════════════════════════
@@ -229,6 +289,18 @@ def test_load_all_embeddings_returns_correct_shape(populated_db):
     assert vectors.dtype == np.float32
 
 
+def test_load_all_embeddings_in_memory_db_matches_blobs():
+    conn = init_db(":memory:")
+    embs = [_random_embedding() for _ in range(4)]
+    for i, e in enumerate(embs):
+        store_document(conn, f"doc {i}", e)
+    ids, vectors = load_all_embeddings(conn)
+    assert vectors.shape == (4, EMBEDDING_DIM)
+    for row, e in zip(vectors, embs):
+        assert np.array_equal(row, unit_vector(e))
+    conn.close()
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: load_filtered_embeddings
 # ════════════════════════════════════════════════════════════
@@ -265,6 +337,56 @@ def test_load_filtered_embeddings_by_title(populated_db):
     assert len(ids) == 1
 
 
+def test_load_filtered_embeddings_rows_match_stored_blobs(populated_db):
+    ids, vectors = load_filtered_embeddings(populated_db, {"category": "recipe"})
+    for doc_id, vec in zip(ids, vectors):
+        blob = populated_db.execute(
+            "SELECT embedding FROM documents WHERE id = ?", (doc_id,)
+        ).fetchone()[0]
+        assert np.array_equal(vec, np.frombuffer(blob, dtype=np.float32))
+
+
+# ════════════════════════════════════════════════════════════
+#  TESTS: load_embedding_matrix (.npy sidecar)
+# ════════════════════════════════════════════════════════════
+
+def test_load_embedding_matrix_writes_memmapped_sidecar(populated_db, tmp_path):
+    ids, matrix = load_embedding_matrix(populated_db)
+    emb_path, ids_path = matrix_paths(str(tmp_path / "test_vector.db"))
+    assert emb_path.exists() and ids_path.exists()
+    assert isinstance(matrix, np.memmap)
+    assert matrix.shape == (3, EMBEDDING_DIM)
+    assert list(ids) == [r[0] for r in populated_db.execute("SELECT id FROM documents ORDER BY id")]
+
+
+def test_load_embedding_matrix_reuses_sidecar(populated_db):
+    load_embedding_matrix(populated_db)
+    with patch.dict("agent.vector_search._MATRICES", clear=True), \
+         patch("agent.vector_search._read_embeddings") as mock_read:
+        ids, matrix = load_embedding_matrix(populated_db)
+        mock_read.assert_not_called()
+    assert matrix.shape == (3, EMBEDDING_DIM)
+
+
+def test_load_embedding_matrix_refreshes_after_insert(populated_db):
+    load_embedding_matrix(populated_db)
+    store_document(populated_db, "Pad Thai", _random_embedding())
+    ids, matrix = load_embedding_matrix(populated_db)
+    assert matrix.shape == (4, EMBEDDING_DIM)
+    assert len(ids) == 4
+
+
+def test_load_embedding_matrix_rejects_truncated_blob(db_conn):
+    store_document(db_conn, "ok", _random_embedding())
+    db_conn.execute(
+        "INSERT INTO documents (text, embedding, created_at) VALUES (?, ?, ?)",
+        ("short", _random_embedding(8).tobytes(), "2026-01-01"),
+    )
+    with patch("agent.vector_search.matrix_paths", return_value=None), \
+         pytest.raises(ValueError, match="Corrupt embeddings"):
+        load_embedding_matrix(db_conn)
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: _build_filter_clauses
 # ════════════════════════════════════════════════════════════
@@ -301,6 +423,15 @@ def test_build_filter_clauses_title():
     assert params == ["%Soup%"]
 
 
+def test_category_filter_uses_index(db_conn):
+    clauses, params = _build_filter_clauses({"category": "recipe"})
+    plan = db_conn.execute(
+        f"EXPLAIN QUERY PLAN SELECT id FROM documents WHERE {clauses[0]} ORDER BY id",
+        params,
+    ).fetchall()
+    assert any("idx_documents_category" in row[-1] for row in plan)
+
+
 def test_build_filter_clauses_unknown_key_ignored():
     """Unknown filter keys should be silently ignored."""
     clauses, params = _build_filter_clauses({"unknown_key": "val"})
@@ -340,6 +471,18 @@ def test_parse_image_ids_non_list_json():
     assert _parse_image_ids('{"key": "val"}') == []
 
 
+def test_parse_image_ids_fast_paths_skip_json():
+    with patch("agent.vector_search.json.loads") as mock_loads:
+        assert _parse_image_ids("[]") == []
+        assert _parse_image_ids('["IMG_PROD_001"]') == ["IMG_PROD_001"]
+        mock_loads.assert_not_called()
+
+
+def test_parse_image_ids_escaped_single_id_uses_json():
+    assert _parse_image_ids('["IMG_\\u0041"]') == ["IMG_A"]
+    assert _parse_image_ids('["a","b"]') == ["a", "b"]
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: _row_to_dict
 # ════════════════════════════════════════════════════════════
@@ -426,6 +569,40 @@ def test_get_documents_by_ids_missing_id(populated_db):
     assert results == []
 
 
+def test_get_documents_by_ids_served_from_memory(populated_db):
+    ids = [r[0] for r in populated_db.execute("SELECT id FROM documents ORDER BY id")]
+    get_documents_by_ids(populated_db, ids[:1])
+    with patch("agent.vector_search.get_all_documents") as mock_all:
+        docs = get_documents_by_ids(populated_db, [ids[2], ids[0]])
+        mock_all.assert_not_called()
+    assert [d["doc_id"] for d in docs] == ["DOC_003", "DOC_001"]
+
+
+def test_get_documents_by_ids_returns_independent_copies(populated_db):
+    doc_id = populated_db.execute("SELECT id FROM documents").fetchone()[0]
+    first = get_documents_by_ids(populated_db, [doc_id])[0]
+    first["score"] = 0.5
+    first["image_ids"].append("IMG_X_1")
+    second = get_documents_by_ids(populated_db, [doc_id])[0]
+    assert "score" not in second
+    assert "IMG_X_1" not in second["image_ids"]
+
+
+def test_get_documents_by_ids_sees_new_and_deleted_documents(populated_db, tmp_path):
+    get_documents_by_ids(populated_db, [1])
+    new_id = store_document(populated_db, "Pad Thai", _random_embedding(), {"doc_id": "DOC_004"})
+    populated_db.commit()
+    with patch("agent.vector_search.get_all_documents") as mock_all:
+        assert get_documents_by_ids(populated_db, [new_id])[0]["doc_id"] == "DOC_004"
+        mock_all.assert_not_called()
+
+    other = init_db(tmp_path / "test_vector.db")
+    other.execute("DELETE FROM documents WHERE id = ?", (new_id,))
+    other.commit()
+    other.close()
+    assert get_documents_by_ids(populated_db, [new_id]) == []
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: get_document_count / get_all_documents / clear_all
 # ════════════════════════════════════════════════════════════
@@ -531,6 +708,86 @@ def test_get_embeddings_batch_sorted_by_index(mock_client):
     assert results[2][0] == pytest.approx(2.0)
 
 
+def test_get_query_embedding_caches_repeated_queries(mock_client):
+    first = get_query_embedding(mock_client, "iPhone สีดำ")
+    second = get_query_embedding(mock_client, "iPhone สีดำ")
+    assert mock_client.embeddings.create.call_count == 1
+    assert first.shape == (1, EMBEDDING_DIM)
+    assert np.linalg.norm(first) == pytest.approx(1.0, abs=1e-5)
+    assert np.array_equal(first, second)
+    # A read-only view of the cached bytes: callers cannot corrupt the cache
+    assert not first.flags.writeable
+    with pytest.raises(ValueError):
+        first[0, 0] = 99.0
+
+
+def test_get_query_embedding_errors_are_not_cached(mock_client):
+    working = mock_client.embeddings.create.side_effect
+    mock_client.embeddings.create.side_effect = RuntimeError("down")
+    with pytest.raises(RuntimeError):
+        get_query_embedding(mock_client, "retry me")
+    mock_client.embeddings.create.side_effect = working
+    assert get_query_embedding(mock_client, "retry me").shape == (1, EMBEDDING_DIM)
+
+
+def test_embed_batches_threaded_runs_concurrently_in_order(mock_client):
+    import threading
+    import time
+
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+    create = mock_client.embeddings.create.side_effect
+
+    def _slow_create(*args, **kwargs):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return create(*args, **kwargs)
+
+    mock_client.embeddings.create.side_effect = _slow_create
+    batches = [[f"text {i}"] * (i + 1) for i in range(6)]
+    results = list(embed_batches_threaded(mock_client, batches))
+    assert [len(r) for r in results] == [1, 2, 3, 4, 5, 6]
+    assert peak > 1
+
+
+def test_embed_batches_threaded_yields_errors(mock_client):
+    mock_client.embeddings.create.side_effect = RuntimeError("rate limited")
+    results = list(embed_batches_threaded(mock_client, [["a"], ["b"]]))
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_count_tokens_fallback_is_utf8_length():
+    with patch("agent.vector_search._token_encoding", return_value=None):
+        assert count_tokens(["abc", "ผง"]) == [3, 6]
+
+
+def test_token_batches_respects_token_budget():
+    with patch("agent.vector_search.count_tokens", return_value=[40, 40, 40, 90, 10]), \
+         patch("agent.vector_search.EMBED_BATCH_TOKENS", 100):
+        assert token_batches(["t"] * 5) == [(0, 2), (2, 3), (3, 5)]
+
+
+def test_token_batches_respects_input_cap():
+    with patch("agent.vector_search.EMBED_BATCH_SIZE", 2):
+        assert token_batches(["a"] * 5) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_token_batches_oversized_text_gets_own_batch():
+    with patch("agent.vector_search.count_tokens", return_value=[10, 500, 10]), \
+         patch("agent.vector_search.EMBED_BATCH_TOKENS", 100):
+        assert token_batches(["t"] * 3) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_token_batches_empty():
+    assert token_batches([]) == []
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: build_faiss_index
 # ════════════════════════════════════════════════════════════
@@ -559,6 +816,246 @@ def test_build_faiss_index_search_returns_results():
     assert indices[0][0] in (0, 1)
 
 
+def test_topk_numpy_matches_faiss():
+    embs = np.random.randn(50, EMBEDDING_DIM).astype(np.float32)
+    faiss.normalize_L2(embs)
+    query = embs[7] + 0.01
+    scores, idx = topk_numpy(embs, query, 5)
+    f_scores, f_idx = build_faiss_index(embs.copy()).search(query.reshape(1, -1), 5)
+    assert list(idx) == list(f_idx[0])
+    assert np.allclose(scores, f_scores[0], atol=1e-4)
+    assert idx[0] == 7
+
+
+def test_topk_numpy_k_larger_than_rows():
+    embs = np.eye(3, EMBEDDING_DIM, dtype=np.float32)
+    scores, idx = topk_numpy(embs, embs[2], 10)
+    assert len(idx) == 3
+    assert idx[0] == 2
+
+
+def test_filtered_search_reuses_store_index(populated_db, mock_client):
+    hybrid_search(mock_client, populated_db, "warm up")
+    with patch("agent.vector_search.build_faiss_index") as mock_build, \
+         patch("agent.vector_search.load_all_embeddings") as mock_load:
+        results = hybrid_search(
+            mock_client, populated_db, "curry", filters={"category": "recipe"}
+        )
+    mock_build.assert_not_called()
+    mock_load.assert_not_called()
+    vector_hits = [r for r in results if r["score"] is not None]
+    assert {r["doc_id"] for r in vector_hits} == {"DOC_001", "DOC_003"}
+
+
+def test_filtered_search_on_sq8_index_scores_small_sets_exactly(db_conn, mock_client):
+    embs = [_random_embedding() for _ in range(60)]
+    insert_documents(db_conn, [
+        (f"doc {i}", e, {"category": "rare" if i < 3 else "common"})
+        for i, e in enumerate(embs)
+    ])
+    db_conn.commit()
+    with patch("agent.vector_search.SQ8_MIN_ROWS", 20):
+        load_index(db_conn)
+    with patch("agent.vector_search.get_query_embedding",
+               return_value=unit_vector(embs[1]).reshape(1, -1)), \
+         patch("agent.vector_search.topk_numpy", wraps=topk_numpy) as mock_topk:
+        results = hybrid_search(
+            mock_client, db_conn, "zzz", top_k=5, filters={"category": "rare"}
+        )
+    mock_topk.assert_called_once()
+    vector_hits = [r for r in results if r["score"] is not None]
+    assert len(vector_hits) == 3
+    assert vector_hits[0]["text"] == "doc 1"
+    assert vector_hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_filtered_search_on_ivf_index_scores_small_sets_exactly(db_conn, mock_client):
+    embs = [_random_embedding() for _ in range(700)]
+    insert_documents(db_conn, [
+        (f"doc {i}", e, {"category": "rare" if i < 5 else "common"})
+        for i, e in enumerate(embs)
+    ])
+    db_conn.commit()
+    with patch("agent.vector_search.SQ8_MIN_ROWS", 100), \
+         patch("agent.vector_search.IVFPQ_MIN_ROWS", 500), \
+         patch("agent.vector_search.IVFPQ_FACTORY", "IVF4,PQ8x4"), \
+         patch("agent.vector_search.IVF_NPROBE", 1):
+        load_index(db_conn)
+    with patch("agent.vector_search.get_query_embedding",
+               return_value=unit_vector(embs[3]).reshape(1, -1)):
+        results = hybrid_search(
+            mock_client, db_conn, "zzz", top_k=5, filters={"category": "rare"}
+        )
+    vector_hits = [r for r in results if r["score"] is not None]
+    # All five candidates are found despite nprobe=1, the exact match first
+    assert len(vector_hits) == 5
+    assert vector_hits[0]["text"] == "doc 3"
+    assert vector_hits[0]["score"] == pytest.approx(1.0, abs=1e-4)
+
+
+# ════════════════════════════════════════════════════════════
+#  TESTS: load_index (persistent search index)
+# ════════════════════════════════════════════════════════════
+
+def test_load_index_empty_store_returns_none(db_conn):
+    assert load_index(db_conn) is None
+
+
+def test_load_index_reused_until_store_changes(populated_db):
+    index = load_index(populated_db)
+    assert index.ntotal == 3
+    with patch("agent.vector_search.load_all_embeddings") as mock_load:
+        assert load_index(populated_db) is index
+        mock_load.assert_not_called()
+
+
+def test_load_index_labels_are_document_ids(populated_db):
+    ids = [r[0] for r in populated_db.execute("SELECT id FROM documents")]
+    emb = populated_db.execute(
+        "SELECT embedding FROM documents WHERE id = ?", (ids[1],)
+    ).fetchone()[0]
+    query = np.frombuffer(emb, dtype=np.float32).reshape(1, -1).copy()
+    faiss.normalize_L2(query)
+    _, labels = load_index(populated_db).search(query, 1)
+    assert labels[0][0] == ids[1]
+
+
+def test_load_index_is_persisted_and_reloaded(populated_db, tmp_path):
+    load_index(populated_db)
+    path = index_path(str(tmp_path / "test_vector.db"))
+    assert path.exists()
+
+    # A fresh process (empty cache) reads the file instead of rebuilding
+    with patch.dict("agent.vector_search._INDEXES", clear=True), \
+         patch("agent.vector_search.load_all_embeddings") as mock_load:
+        assert load_index(populated_db).ntotal == 3
+        mock_load.assert_not_called()
+
+
+def test_store_document_extends_loaded_index(populated_db):
+    index = load_index(populated_db)
+    store_document(populated_db, "Pad Thai", _random_embedding())
+    with patch("agent.vector_search.load_all_embeddings") as mock_load:
+        assert load_index(populated_db) is index
+        mock_load.assert_not_called()
+    assert index.ntotal == 4
+
+
+def test_save_indexes_writes_incremental_additions(populated_db, tmp_path):
+    load_index(populated_db)
+    store_document(populated_db, "Pad Thai", _random_embedding())
+    save_indexes()
+    path = index_path(str(tmp_path / "test_vector.db"))
+    assert faiss.read_index(str(path)).ntotal == 4
+
+
+def test_save_indexes_logs_failed_write(populated_db, caplog):
+    load_index(populated_db)
+    store_document(populated_db, "Pad Thai", _random_embedding())
+    with patch("agent.vector_search.faiss.write_index",
+               side_effect=RuntimeError("read-only directory")), \
+         caplog.at_level("WARNING", logger="vector_search"):
+        save_indexes()
+    assert "read-only directory" in caplog.text
+
+
+def test_load_index_rebuilds_when_store_changed_elsewhere(populated_db, tmp_path):
+    load_index(populated_db)
+    # Another connection (e.g. the loader process) changes the store
+    other = init_db(tmp_path / "test_vector.db")
+    other.execute("DELETE FROM documents WHERE doc_id = 'DOC_002'")
+    other.commit()
+    other.close()
+    assert load_index(populated_db).ntotal == 2
+
+
+def test_load_index_survives_failed_index_write(populated_db, tmp_path, caplog):
+    with patch("agent.vector_search.faiss.write_index",
+               side_effect=RuntimeError("read-only directory")), \
+         caplog.at_level("WARNING", logger="vector_search"):
+        index = load_index(populated_db)
+    assert "Could not save search index" in caplog.text
+    assert index.ntotal == 3
+    assert not index_path(str(tmp_path / "test_vector.db")).exists()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_load_index_ignores_stale_file(populated_db, tmp_path):
+    load_index(populated_db)
+    populated_db.execute("DELETE FROM documents WHERE doc_id = 'DOC_003'")
+    populated_db.commit()
+    with patch.dict("agent.vector_search._INDEXES", clear=True):
+        assert load_index(populated_db).ntotal == 2
+
+
+def test_load_index_uses_ivfpq_for_large_stores(db_conn, tmp_path):
+    insert_documents(db_conn, [
+        (f"doc {i}", _random_embedding(), None) for i in range(700)
+    ])
+    db_conn.commit()
+    with patch("agent.vector_search.SQ8_MIN_ROWS", 100), \
+         patch("agent.vector_search.IVFPQ_MIN_ROWS", 500), \
+         patch("agent.vector_search.IVFPQ_FACTORY", "IVF4,PQ8x4"), \
+         patch("agent.vector_search.IVF_NPROBE", 3):
+        index = load_index(db_conn)
+    ivf = faiss.extract_index_ivf(index)
+    assert ivf.nprobe == 3
+    assert index.ntotal == 700
+
+    # nprobe survives the round trip through the .faiss file
+    with patch.dict("agent.vector_search._INDEXES", clear=True):
+        assert faiss.extract_index_ivf(load_index(db_conn)).nprobe == 3
+
+
+def test_load_index_is_flat_for_small_stores(populated_db):
+    index = load_index(populated_db)
+    assert faiss.try_extract_index_ivf(index) is None
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexFlatIP)
+
+
+def test_load_index_uses_sq8_for_mid_sized_stores(db_conn):
+    embs = [_random_embedding() for _ in range(50)]
+    insert_documents(db_conn, [(f"doc {i}", e, None) for i, e in enumerate(embs)])
+    db_conn.commit()
+    with patch("agent.vector_search.SQ8_MIN_ROWS", 20):
+        index = load_index(db_conn)
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexScalarQuantizer)
+
+    ids = [r[0] for r in db_conn.execute("SELECT id FROM documents ORDER BY id")]
+    query = unit_vector(embs[10]).reshape(1, -1)
+    scores, labels = index.search(query, 1)
+    assert labels[0][0] == ids[10]
+    assert scores[0][0] == pytest.approx(1.0, abs=0.02)
+
+
+def test_load_index_uses_hnsw_when_configured(db_conn, tmp_path):
+    embs = [_random_embedding() for _ in range(50)]
+    insert_documents(db_conn, [(f"doc {i}", e, None) for i, e in enumerate(embs)])
+    db_conn.commit()
+    with patch("agent.vector_search.SQ8_MIN_ROWS", 20), \
+         patch("agent.vector_search.INDEX_TYPE", "hnsw"), \
+         patch("agent.vector_search.HNSW_EF_SEARCH", 40):
+        index = load_index(db_conn)
+        assert index_path(str(tmp_path / "test_vector.db")).name == "test_vector.hnsw.faiss"
+    hnsw = faiss.downcast_index(index.index)
+    assert isinstance(hnsw, faiss.IndexHNSWFlat)
+    assert hnsw.hnsw.efSearch == 40
+
+    ids = [r[0] for r in db_conn.execute("SELECT id FROM documents ORDER BY id")]
+    scores, labels = index.search(unit_vector(embs[7]).reshape(1, -1), 1)
+    assert labels[0][0] == ids[7]
+    assert scores[0][0] == pytest.approx(1.0, abs=1e-5)
+
+    # A saved HNSW index picks up the current efSearch knob on reload
+    with patch.dict("agent.vector_search._INDEXES", clear=True), \
+         patch("agent.vector_search.INDEX_TYPE", "hnsw"), \
+         patch("agent.vector_search.HNSW_EF_SEARCH", 90), \
+         patch("agent.vector_search.load_all_embeddings") as mock_load:
+        reloaded = load_index(db_conn)
+        mock_load.assert_not_called()
+    assert faiss.downcast_index(reloaded.index).hnsw.efSearch == 90
+
+
 # ════════════════════════════════════════════════════════════
 #  TESTS: hybrid_search
 # ════════════════════════════════════════════════════════════
@@ -662,6 +1159,18 @@ def test_parse_knowledge_file_plain_text(tmp_path):
     assert records is None
 
 
+def test_parse_knowledge_file_skips_malformed_lines(tmp_path):
+    fpath = tmp_path / "mixed.jsonl"
+    fpath.write_text(
+        '{"id": "R1", "content": "ผงเครื่องเทศ"}\n{broken\n[1, 2]\n'
+        '{"id": "R2", "content": "สูตรน้ำซุป"}\n',
+        encoding="utf-8",
+    )
+    records = parse_knowledge_file(fpath)
+    assert [r["id"] for r in records] == ["R1", "R2"]
+    assert records[0]["content"] == "ผงเครื่องเทศ"
+
+
 def test_parse_knowledge_file_empty(tmp_path):
     """Empty file should return None."""
     fpath = tmp_path / "empty.txt"
@@ -732,6 +1241,12 @@ def test_parse_filters_category_in_middle():
     assert filters == {"category": "recipe"}
 
 
+def test_parse_filters_repeated_flag_last_wins():
+    query, filters = parse_filters("soup --category recipe --category ingredient")
+    assert query == "soup"
+    assert filters == {"category": "ingredient"}
+
+
 def test_parse_filters_empty_string():
     query, filters = parse_filters("")
     assert query == ""
@@ -750,6 +1265,11 @@ def test_cmd_add_stores_document(db_conn, mock_client, capsys):
     assert get_document_count(db_conn) == 1
 
 
+def test_cmd_add_commits(db_conn, mock_client, capsys):
+    cmd_add(mock_client, db_conn, "test document")
+    assert not db_conn.in_transaction
+
+
 def test_cmd_add_empty_text(db_conn, mock_client, capsys):
     """cmd_add with empty text should print usage."""
     cmd_add(mock_client, db_conn, "")
@@ -1172,6 +1692,14 @@ def test_load_plain_text_basic(db_conn, mock_client, capsys):
     assert get_document_count(db_conn) == 3
 
 
+def test_load_plain_text_commits_batches(db_conn, mock_client, tmp_path, capsys):
+    _load_plain_text(mock_client, db_conn, "a\nb\nc\n", "test.txt")
+    assert not db_conn.in_transaction
+    other = init_db(tmp_path / "test_vector.db")
+    assert get_document_count(other) == 3
+    other.close()
+
+
 def test_load_plain_text_no_content(db_conn, mock_client, capsys):
     """_load_plain_text with only blanks/separators should report no content."""
     content = "\n\n===\n---\n"
@@ -1506,3 +2034,197 @@ def test_main():
         mock_setup.assert_called_once()
         mock_init_db.assert_called_once()
         mock_repl.assert_called_once()
+
+
+# ════════════════════════════════════════════════════════════
+#  TESTS: cmd_load_batch / store_documents
+# ════════════════════════════════════════════════════════════
+
+def test_store_documents_inserts_all(db_conn):
+    from agent.vector_search import store_documents
+    store_documents(db_conn, [
+        ("one", _random_embedding(), None),
+        ("two", _random_embedding(), {"doc_id": "D2", "image_ids": ["IMG_A_1"]}),
+    ])
+    docs = get_all_documents(db_conn)
+    assert [d["text"] for d in docs] == ["one", "two"]
+    assert docs[1]["image_ids"] == ["IMG_A_1"]
+
+
+def test_cmd_load_batch_single_request_for_all_files(db_conn, mock_client, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch
+    kb = tmp_path / "kb.txt"
+    kb.write_text(
+        '{"id": "R001", "content": "Recipe one", "category": "recipe", "title": "Soup"}\n',
+        encoding="utf-8",
+    )
+    plain = tmp_path / "plain.txt"
+    plain.write_text("Line one\n-----\nLine two\n", encoding="utf-8")
+
+    cmd_load_batch(mock_client, db_conn, [str(kb), str(plain)])
+
+    assert mock_client.embeddings.create.call_count == 1
+    assert get_document_count(db_conn) == 3
+    docs = get_all_documents(db_conn)
+    assert docs[0]["doc_id"] == "R001"
+    assert "3 documents imported from 2 file(s)" in capsys.readouterr().out
+
+
+def test_cmd_load_batch_splits_large_input(db_conn, mock_client, tmp_path):
+    from agent.vector_search import cmd_load_batch
+    plain = tmp_path / "plain.txt"
+    plain.write_text("\n".join(f"line {i}" for i in range(5)), encoding="utf-8")
+    with patch("agent.vector_search.EMBED_BATCH_SIZE", 2):
+        cmd_load_batch(mock_client, db_conn, [str(plain)])
+    assert mock_client.embeddings.create.call_count == 3
+    assert get_document_count(db_conn) == 5
+
+
+def test_cmd_load_batch_skips_unreadable_file(db_conn, mock_client, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch
+    cmd_load_batch(mock_client, db_conn, [str(tmp_path / "missing.txt")])
+    out = capsys.readouterr().out
+    assert "Cannot read file" in out
+    assert "No content found" in out
+    mock_client.embeddings.create.assert_not_called()
+
+
+def test_cmd_load_batch_embedding_error(db_conn, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch
+    client = MagicMock()
+    client.embeddings.create.side_effect = RuntimeError("API error")
+    plain = tmp_path / "plain.txt"
+    plain.write_text("Line one\n", encoding="utf-8")
+    cmd_load_batch(client, db_conn, [str(plain)])
+    assert "Error at batch 1" in capsys.readouterr().out
+    assert get_document_count(db_conn) == 0
+
+
+def test_document_hash_changes_with_metadata():
+    from agent.vector_search import document_hash
+    assert document_hash("t") == document_hash("t", None)
+    assert document_hash("t", {"image_ids": ["A"]}) != document_hash("t", {"image_ids": ["B"]})
+
+
+def test_cmd_load_batch_skips_unchanged_documents(db_conn, mock_client, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch
+    plain = tmp_path / "plain.txt"
+    plain.write_text("Line one\nLine two\n", encoding="utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(plain)])
+    mock_client.embeddings.create.reset_mock()
+
+    plain.write_text("Line one\nLine two\nLine three\n", encoding="utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(plain)])
+
+    (call,) = mock_client.embeddings.create.call_args_list
+    assert call.kwargs["input"] == ["Line three"]
+    assert get_document_count(db_conn) == 3
+    assert "Skipped 2 unchanged" in capsys.readouterr().out
+
+
+def test_cmd_load_batch_no_api_call_when_unchanged(db_conn, mock_client, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch
+    plain = tmp_path / "plain.txt"
+    plain.write_text("Line one\nLine one\n", encoding="utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(plain)])
+    assert get_document_count(db_conn) == 1  # repeated line stored once
+    mock_client.embeddings.create.reset_mock()
+
+    cmd_load_batch(mock_client, db_conn, [str(plain)])
+    mock_client.embeddings.create.assert_not_called()
+    assert "No new content" in capsys.readouterr().out
+
+
+def test_cmd_load_batch_prune_removes_stale(db_conn, mock_client, tmp_path):
+    from agent.vector_search import cmd_load_batch
+    store_document(db_conn, "ad-hoc", _random_embedding())
+    plain = tmp_path / "plain.txt"
+    plain.write_text("keep\ndrop\n", encoding="utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(plain)])
+
+    plain.write_text("keep\n", encoding="utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(plain)], prune=True)
+    assert [d["text"] for d in get_all_documents(db_conn)] == ["keep"]
+
+
+def test_cmd_load_batch_prune_skipped_when_a_file_fails(db_conn, mock_client, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch
+    a = tmp_path / "a.txt"
+    b = tmp_path / "b.txt"
+    a.write_text("alpha line\n", encoding="utf-8")
+    b.write_text("beta line\n", encoding="utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(a), str(b)])
+
+    b.write_bytes(b"\xff\xfe not utf-8")
+    cmd_load_batch(mock_client, db_conn, [str(a), str(b)], prune=True)
+    texts = {r[0] for r in db_conn.execute("SELECT text FROM documents")}
+    assert texts == {"alpha line", "beta line"}
+    out = capsys.readouterr().out
+    assert "Not pruning: 1 file(s)" in out
+    assert "Removed" not in out
+
+
+
+# ════════════════════════════════════════════════════════════
+#  TESTS: cmd_load_batch_async
+# ════════════════════════════════════════════════════════════
+
+def _make_async_mock_client(fail_inputs: set[str] = frozenset()):
+    """AsyncOpenAI-like mock; raises for any batch containing a fail_inputs text."""
+    sync_client = _make_mock_client()
+    client = MagicMock()
+
+    async def create(**kwargs):
+        if fail_inputs & set(kwargs["input"]):
+            raise RuntimeError("API error")
+        return sync_client.embeddings.create(**kwargs)
+
+    client.embeddings.create = MagicMock(side_effect=create)
+    return client
+
+
+async def test_cmd_load_batch_async_stores_in_source_order(db_conn, tmp_path):
+    from agent.vector_search import cmd_load_batch_async
+    client = _make_async_mock_client()
+    plain = tmp_path / "plain.txt"
+    plain.write_text("\n".join(f"line {i}" for i in range(5)), encoding="utf-8")
+    with patch("agent.vector_search.EMBED_BATCH_SIZE", 2):
+        await cmd_load_batch_async(client, db_conn, [str(plain)])
+    assert client.embeddings.create.call_count == 3
+    assert [d["text"] for d in get_all_documents(db_conn)] == [f"line {i}" for i in range(5)]
+
+
+async def test_cmd_load_batch_async_limits_concurrency(db_conn, tmp_path):
+    import asyncio
+    from agent.vector_search import cmd_load_batch_async
+    sync_client = _make_mock_client()
+    in_flight = peak = 0
+
+    async def create(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return sync_client.embeddings.create(**kwargs)
+
+    client = MagicMock()
+    client.embeddings.create = MagicMock(side_effect=create)
+    plain = tmp_path / "plain.txt"
+    plain.write_text("\n".join(f"line {i}" for i in range(6)), encoding="utf-8")
+    with patch("agent.vector_search.EMBED_BATCH_SIZE", 1), \
+         patch("agent.vector_search.EMBED_CONCURRENCY", 2):
+        await cmd_load_batch_async(client, db_conn, [str(plain)])
+    assert peak == 2
+    assert get_document_count(db_conn) == 6
+
+
+async def test_cmd_load_batch_async_keeps_successful_batches(db_conn, tmp_path, capsys):
+    from agent.vector_search import cmd_load_batch_async
+    client = _make_async_mock_client(fail_inputs={"line 2"})
+    plain = tmp_path / "plain.txt"
+    plain.write_text("\n".join(f"line {i}" for i in range(4)), encoding="utf-8")
+    with patch("agent.vector_search.EMBED_BATCH_SIZE", 2):
+        await cmd_load_batch_async(client, db_conn, [str(plain)])
+    assert "Error at batch 2" in capsys.readouterr().out
+    assert [d["text"] for d in get_all_documents(db_conn)] == ["line 0", "line 1"]
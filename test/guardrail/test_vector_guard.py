@@ -88,6 +88,16 @@ class TestInitVectorGuard:
 
         assert vector_guard._topic_index.ntotal == expected_count
 
+    def test_topic_vectors_are_normalized(self, mock_sync_openai_client):
+        """Topic embeddings are unit-length so scores are cosine similarity."""
+        with patch("openai.OpenAI", return_value=mock_sync_openai_client), \
+             patch("vector_guard.AsyncOpenAI") as MockAsync:
+            MockAsync.return_value = AsyncMock()
+            init_vector_guard()
+
+        vecs = vector_guard._topic_index.reconstruct_n(0, vector_guard._topic_index.ntotal)
+        assert np.allclose(np.linalg.norm(vecs, axis=1), 1.0, atol=1e-5)
+
     def test_uses_openai_api_key(self, mock_sync_openai_client):
         """Verify the OpenAI clients are created during init."""
         with patch("openai.OpenAI") as MockSync, \
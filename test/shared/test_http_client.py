@@ -9,7 +9,7 @@ import pytest
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 
-from shared.http_client import forward_to_agent
+from shared.http_client import forward_to_agent, mcp_http_client_factory, MCP_HTTP_LIMITS
 
 
 @pytest.mark.asyncio
@@ -200,3 +200,36 @@ async def test_forward_to_agent_timeout_raises():
 
         with pytest.raises(httpx.ReadTimeout):
             await forward_to_agent("http://test/chat", "s1", "hi")
+
+
+# ════════════════════════════════════════════════════════════
+#  mcp_http_client_factory
+# ════════════════════════════════════════════════════════════
+
+@pytest.mark.asyncio
+async def test_mcp_http_client_factory_uses_keepalive_pool():
+    with patch("shared.http_client.httpx.AsyncClient") as MockClient:
+        mcp_http_client_factory(headers={"X-Test": "1"})
+    kwargs = MockClient.call_args.kwargs
+    assert kwargs["limits"] is MCP_HTTP_LIMITS
+    assert kwargs["headers"] == {"X-Test": "1"}
+
+
+@pytest.mark.asyncio
+async def test_mcp_http_client_factory_default_timeout():
+    client = mcp_http_client_factory()
+    try:
+        assert client.timeout.connect == 30
+        assert client.timeout.read == 300
+    finally:
+        await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_mcp_http_client_factory_passes_timeout():
+    timeout = httpx.Timeout(5, read=60)
+    client = mcp_http_client_factory(timeout=timeout)
+    try:
+        assert client.timeout == timeout
+    finally:
+        await client.aclose()
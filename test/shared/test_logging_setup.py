@@ -2,12 +2,12 @@
 
 import logging
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, RotatingFileHandler
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 
-from shared.logging_setup import setup_logger
+from shared.logging_setup import setup_logger, setup_queue_logger
 
 
 def test_setup_logger_returns_logger(tmp_path):
@@ -90,3 +90,33 @@ def test_setup_logger_default_rotation_params(tmp_path):
     file_handlers = [h for h in logger.handlers if isinstance(h, RotatingFileHandler)]
     assert file_handlers[0].maxBytes == 5_000_000
     assert file_handlers[0].backupCount == 3
+
+
+def test_setup_queue_logger_routes_through_queue():
+    listener = setup_queue_logger("queue_test1")
+    try:
+        logger = logging.getLogger("queue_test1")
+        assert len(logger.handlers) == 1
+        assert isinstance(logger.handlers[0], QueueHandler)
+        assert logger.propagate is False
+    finally:
+        listener.stop()
+
+
+def test_setup_queue_logger_no_duplicate_handlers():
+    setup_queue_logger("queue_test2").stop()
+    setup_queue_logger("queue_test2").stop()
+    assert len(logging.getLogger("queue_test2").handlers) == 1
+
+
+def test_setup_queue_logger_writes_traceback_on_listener(capsys):
+    listener = setup_queue_logger("queue_test3")
+    logger = logging.getLogger("queue_test3")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("request failed")
+    listener.stop()  # flushes the queue
+    err = capsys.readouterr().err
+    assert "request failed" in err
+    assert "ValueError: boom" in err
@@ -34,6 +34,12 @@ def test_memory_changed_message():
     assert isinstance(msg, MemoryChanged)
 
 
+def test_trace_messages_and_processor_are_slotted():
+    assert not hasattr(TraceEvent("x"), "__dict__")
+    assert not hasattr(MemoryChanged(), "__dict__")
+    assert not hasattr(TuiTraceProcessor(MagicMock()), "__dict__")
+
+
 # ════════════════════════════════════════════════════════════
 #  Helpers
 # ════════════════════════════════════════════════════════════
@@ -300,3 +306,48 @@ def test_shutdown_noop(processor):
 
 def test_force_flush_noop(processor):
     processor.force_flush()
+
+
+def test_truncate_clean_short_text_is_not_copied():
+    text = "clean args"
+    assert TuiTraceProcessor._truncate(text, 80) is text
+
+
+def test_truncate_strips_and_flattens_kept_part():
+    assert TuiTraceProcessor._truncate("  a\nb  ", 80) == "a b"
+    assert TuiTraceProcessor._truncate("\nab\ncd" + "x" * 100, 4) == "ab c…"
+
+
+def test_open_span_times_are_bounded(processor):
+    limit = TuiTraceProcessor.MAX_OPEN_SPANS
+    for i in range(limit + 10):
+        span = _make_span("AgentSpanData", name="a")
+        span.span_id = f"span-{i}"
+        processor.on_span_start(span)
+    assert len(processor._times) <= limit
+    # Oldest entries are the ones evicted
+    assert "span-0" not in processor._times
+    assert f"span-{limit + 9}" in processor._times
+
+
+def test_span_data_subclass_dispatches_to_base_handler(processor, mock_app):
+    from agents import AgentSpanData
+
+    class CustomAgentSpanData(AgentSpanData):
+        pass
+
+    span = MagicMock()
+    span.span_id = "span-sub"
+    span.span_data = CustomAgentSpanData(name="Sub")
+    processor.on_span_start(span)
+    text = mock_app.post_message.call_args[0][0].text
+    assert "Agent started: Sub" in str(text)
+    # Resolved once through the MRO, then memoized
+    assert processor._start_handlers[CustomAgentSpanData] == processor._start_agent
+
+
+def test_trace_lines_share_cached_styles(processor, mock_app):
+    processor.on_span_start(_make_span("AgentSpanData", name="A"))
+    processor.on_span_start(_make_span("AgentSpanData", name="B"))
+    first, second = (c.args[0].text for c in mock_app.post_message.call_args_list)
+    assert first.style is second.style is TuiTraceProcessor._AGENT_STYLE
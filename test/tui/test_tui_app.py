@@ -124,6 +124,16 @@ def test_connection_failed_empty_error():
     assert msg.error == ""
 
 
+def test_messages_have_no_instance_dict():
+    for msg in (
+        StreamDelta("x"),
+        StreamComplete("x"),
+        ConnectionReady(tool_count=0, tool_names=[]),
+        ConnectionFailed("x"),
+    ):
+        assert not hasattr(msg, "__dict__")
+
+
 # ════════════════════════════════════════════════════════════
 #  AgentTuiApp — unit tests (no full TUI run)
 # ════════════════════════════════════════════════════════════
@@ -138,6 +148,7 @@ def mock_session_store():
     store.list_all.return_value = []
     store.save = MagicMock()
     store.delete = MagicMock()
+    store.truncate.side_effect = lambda history: history
     return store
 
 
@@ -503,3 +514,528 @@ async def test_session_info_shows_current(patched_tui_app):
         info = app.query_one("#session-info", Static)
         # Verify the widget exists and was initialized with session info
         assert info is not None
+
+
+def _text_delta_events(deltas):
+    from openai.types.responses import ResponseTextDeltaEvent
+    for d in deltas:
+        yield MagicMock(
+            type="raw_response_event",
+            data=ResponseTextDeltaEvent.model_construct(delta=d),
+        )
+
+
+@pytest.mark.asyncio
+async def test_send_message_coalesces_deltas(patched_tui_app):
+    from agent.tui import app as app_module
+
+    async def stream_events():
+        for event in _text_delta_events(["a"] * 200):
+            yield event
+
+    result = MagicMock()
+    result.stream_events = stream_events
+    result.to_input_list.return_value = [{"role": "user", "content": "hi"}]
+    app_module.Runner.run_streamed.return_value = result
+
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        posted = []
+        original_post = app.post_message
+
+        def record(message):
+            if isinstance(message, StreamDelta):
+                posted.append(message.delta)
+            return original_post(message)
+
+        with patch.object(app, "post_message", side_effect=record), \
+             patch.object(app_module.time, "monotonic", return_value=0.0):
+            app.send_message("hi")
+            await app.workers.wait_for_complete()
+        await pilot.pause()
+
+        assert "".join(posted) == "a" * 200
+        assert len(posted) == 4  # 64 + 64 + 64 + final 8
+
+
+@pytest.mark.asyncio
+async def test_widgets_cached_on_mount(patched_tui_app):
+    from textual.widgets import Input, RichLog
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        assert app._chat_log is app.query_one("#chat-log", RichLog)
+        assert app._reply_log is app.query_one("#reply-log", RichLog)
+        assert app._trace_log is app.query_one("#trace-log", RichLog)
+        assert app._user_input is app.query_one("#user-input", Input)
+
+
+@pytest.mark.asyncio
+async def test_refresh_stm_appends_only_new_messages(patched_tui_app):
+    history = [
+        {"role": "user", "content": "hello"},
+        {"role": "assistant", "content": "world"},
+    ]
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._history = history
+        app._refresh_stm()
+        assert app._stm_rendered_count == 2
+
+        app._history = history + [
+            {"role": "user", "content": "again"},
+        ]
+        with patch.object(app._stm_log, "clear") as clear, \
+             patch.object(app._stm_log, "write") as write:
+            app._refresh_stm()
+        clear.assert_not_called()
+        write.assert_called_once()
+        assert str(write.call_args[0][0]) == "[user] again"
+        assert app._stm_rendered_count == 3
+
+
+@pytest.mark.asyncio
+async def test_refresh_stm_rebuilds_when_window_slides(patched_tui_app):
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._history = [
+            {"role": "user", "content": "a"},
+            {"role": "assistant", "content": "b"},
+        ]
+        app._refresh_stm()
+
+        # Same length, but the oldest turn was trimmed away
+        app._history = [
+            {"role": "assistant", "content": "b"},
+            {"role": "user", "content": "c"},
+        ]
+        with patch.object(app._stm_log, "clear") as clear:
+            app._refresh_stm()
+        clear.assert_called_once()
+        assert app._stm_rendered_count == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_stm_reads_in_memory_history(patched_tui_app, mock_session_store):
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._history = [{"role": "user", "content": "hi"}]
+        mock_session_store.get.reset_mock()
+        app._refresh_stm()
+        mock_session_store.get.assert_not_called()
+        assert app._stm_rendered_count == 1
+
+
+@pytest.mark.asyncio
+async def test_hidden_stm_tab_refreshes_on_activation(patched_tui_app):
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        await pilot.pause()
+        app._history = [{"role": "user", "content": "hi"}]
+        app._stm_rendered_count = 0
+        app.post_message(StreamComplete("reply"))
+        await pilot.pause()
+        # Replies tab is showing, so STM is only marked stale
+        assert "tab-stm" in app._dirty_tabs
+        assert app._stm_rendered_count == 0
+
+        app._tabs.active = "tab-stm"
+        await pilot.pause()
+        assert "tab-stm" not in app._dirty_tabs
+        assert app._stm_rendered_count == 1
+
+
+@pytest.mark.asyncio
+async def test_visible_stm_tab_refreshes_immediately(patched_tui_app):
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._tabs.active = "tab-stm"
+        await pilot.pause()
+        app._history = [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": "hello"},
+        ]
+        app.post_message(StreamComplete("hello"))
+        await pilot.pause()
+        assert app._stm_rendered_count == 2
+        assert "tab-stm" not in app._dirty_tabs
+
+
+@pytest.mark.asyncio
+async def test_session_tab_lists_sessions_on_activation(patched_tui_app, mock_session_store):
+    mock_session_store.list_all.return_value = [
+        {"session_id": "abc", "message_count": 2, "created_at": 0, "updated_at": 0},
+    ]
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._tabs.active = "tab-session"
+        await pilot.pause()
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert len(app._session_list.children) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_stm_renders_last_window_only(patched_tui_app):
+    from agent.tui.app import STM_WINDOW
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._history = [
+            {"role": "user", "content": f"msg {i}"} for i in range(STM_WINDOW + 30)
+        ]
+        with patch.object(app._stm_log, "write") as write:
+            app._refresh_stm()
+        lines = [str(call.args[0]) for call in write.call_args_list]
+        # Header + "showing last" note + one row per windowed message
+        assert len(lines) == STM_WINDOW + 2
+        assert lines[1] == f"... (showing last {STM_WINDOW} of {STM_WINDOW + 30})"
+        assert lines[2] == "[user] msg 30"
+        assert app._stm_rendered_count == STM_WINDOW + 30
+
+
+@pytest.mark.asyncio
+async def test_refresh_stm_reuses_rendered_rows_on_rebuild(patched_tui_app):
+    from agent.tui.app import AgentTuiApp as App_
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        a = {"role": "user", "content": "a"}
+        b = {"role": "assistant", "content": [{"type": "output_text", "text": "b"}]}
+        c = {"role": "user", "content": "c"}
+        app._history = [a, b]
+        app._refresh_stm()
+
+        # Window slid: rebuild, but only the new message is rendered anew
+        app._history = [b, c]
+        with patch.object(App_, "_render_stm_row", wraps=App_._render_stm_row) as render:
+            app._refresh_stm()
+        render.assert_called_once_with(c)
+        assert set(app._stm_rows) == {id(b), id(c)}
+
+
+@pytest.mark.asyncio
+async def test_connect_mcp_uses_shared_http_client_factory(patched_tui_app):
+    from agent.tui import app as app_module
+    from shared.http_client import mcp_http_client_factory
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        await pilot.app.workers.wait_for_complete()
+        params = app_module.MCPServerStreamableHttp.call_args.kwargs["params"]
+        assert params["httpx_client_factory"] is mcp_http_client_factory
+
+
+@pytest.mark.asyncio
+async def test_refresh_ltm_parses_memories(patched_tui_app):
+    payload = {"memories": {"results": [{"id": "m1", "memory": "likes tea"}]}}
+    mcp = MagicMock()
+    mcp.call_tool = AsyncMock(return_value=MagicMock(content=[
+        MagicMock(text="not json"),
+        MagicMock(text=json.dumps(payload)),
+    ]))
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        await app.workers.wait_for_complete()
+        app._mcp_server = mcp
+        with patch.object(app._ltm_log, "write") as write:
+            app._refresh_ltm()
+            await app.workers.wait_for_complete()
+        lines = [str(call.args[0]) for call in write.call_args_list]
+        assert "Memories for user: cli (1 total)" in lines
+        assert "  1. likes tea" in lines
+        mcp.call_tool.assert_awaited_once_with("memory_get_all", {"user_id": "cli"})
+
+
+@pytest.mark.asyncio
+async def test_refresh_ltm_reuses_recent_result(patched_tui_app):
+    from agent.tui.trace_processor import MemoryChanged
+    mcp = MagicMock()
+    mcp.call_tool = AsyncMock(return_value=MagicMock(content=[
+        MagicMock(text=json.dumps({"memories": [{"id": "m1", "memory": "x"}]})),
+    ]))
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        await app.workers.wait_for_complete()
+        app._mcp_server = mcp
+        for _ in range(3):
+            app._refresh_ltm()
+            await app.workers.wait_for_complete()
+        assert mcp.call_tool.await_count == 1
+
+        # A memory tool call drops the cached result
+        app.post_message(MemoryChanged())
+        await pilot.pause()
+        assert app._ltm_cache == {}
+        app._refresh_ltm()
+        await app.workers.wait_for_complete()
+        assert mcp.call_tool.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_memory_changed_burst_refreshes_ltm_once(patched_tui_app):
+    from agent.tui.trace_processor import MemoryChanged
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._tabs.active = "tab-ltm"
+        await pilot.pause()
+        await app.workers.wait_for_complete()
+        refresh = MagicMock()
+        with patch.dict(app._tab_refreshers, {"tab-ltm": refresh}):
+            for _ in range(3):
+                app.post_message(MemoryChanged())
+            await pilot.pause()
+            refresh.assert_not_called()
+            await pilot.pause(0.3)
+        refresh.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_stream_delta_writes_reply_log_in_chunks(patched_tui_app):
+    from agent.tui.app import STREAM_FLUSH_CHARS
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        with patch.object(app._reply_log, "write") as write:
+            for _ in range(STREAM_FLUSH_CHARS // 8):
+                app.post_message(StreamDelta("x" * 7))
+            await pilot.pause()
+            write.assert_not_called()
+
+            app.post_message(StreamDelta("x" * 16))
+            await pilot.pause()
+        write.assert_called_once()
+        assert str(write.call_args[0][0]) == app._current_reply
+        assert app._reply_written == len(app._current_reply)
+
+
+@pytest.mark.asyncio
+async def test_switch_session_back_rereads_store(patched_tui_app, mock_session_store):
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._switch_session("other")
+        # The chat API or the CLI wrote to this session meanwhile
+        updated = [{"role": "user", "content": "from the API"}]
+        mock_session_store.get.return_value = updated
+
+        app._switch_session("test-session")
+        await pilot.pause()
+        mock_session_store.get.assert_called_with("test-session")
+        assert app._history == updated
+
+
+@pytest.mark.asyncio
+async def test_reload_chat_renders_last_window_only(patched_tui_app):
+    from agent.tui.app import CHAT_WINDOW
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._history = [
+            {"role": "user", "content": f"msg {i}"} for i in range(CHAT_WINDOW + 5)
+        ]
+        with patch.object(app._chat_log, "write") as write:
+            app._reload_chat_from_history()
+        lines = [str(call.args[0]) for call in write.call_args_list]
+        assert lines[0] == "... (5 earlier messages)"
+        assert lines[1] == "You: msg 5"
+        assert len(lines) == CHAT_WINDOW + 2  # note + rows + trailing blank
+
+
+@pytest.mark.asyncio
+async def test_trace_events_buffered_while_traces_tab_hidden(patched_tui_app):
+    from agent.tui.trace_processor import TraceEvent
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        with patch.object(app._trace_log, "write") as write:
+            app.post_message(TraceEvent("one"))
+            app.post_message(TraceEvent("two"))
+            await pilot.pause()
+            write.assert_not_called()
+            assert list(app._trace_buffer) == ["one", "two"]
+
+            app._tabs.active = "tab-traces"
+            await pilot.pause()
+            assert [c.args[0] for c in write.call_args_list] == ["one", "two"]
+            assert not app._trace_buffer
+
+            app.post_message(TraceEvent("three"))
+            await pilot.pause()
+            write.assert_called_with("three")
+
+
+@pytest.mark.asyncio
+async def test_trace_buffer_drops_oldest_lines(patched_tui_app):
+    from agent.tui.app import TRACE_BUFFER_LINES
+    from agent.tui.trace_processor import TraceEvent
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        for i in range(TRACE_BUFFER_LINES + 5):
+            app.on_trace_event(TraceEvent(str(i)))
+        assert len(app._trace_buffer) == TRACE_BUFFER_LINES
+        assert app._trace_buffer[0] == "5"
+
+
+@pytest.mark.asyncio
+async def test_refresh_sessions_diffs_rows(patched_tui_app, mock_session_store):
+    def row(sid, count, updated):
+        return {"session_id": sid, "message_count": count,
+                "created_at": 0, "updated_at": updated}
+
+    mock_session_store.list_all.return_value = [row("a", 2, 200), row("b", 4, 100)]
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+
+        async def refresh():
+            app._refresh_sessions()
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            return [item.id for item in app._session_list.children]
+
+        assert await refresh() == ["sess-a", "sess-b"]
+        item_a = app._session_items["a"][1]
+        item_b = app._session_items["b"][1]
+
+        # b gets a new turn and moves to the top; c is new; a is unchanged
+        mock_session_store.list_all.return_value = [
+            row("b", 6, 300), row("c", 1, 250), row("a", 2, 200),
+        ]
+        with patch("agent.tui.app.datetime") as dt:
+            dt.fromtimestamp.return_value.strftime.return_value = "T"
+            assert await refresh() == ["sess-b", "sess-c", "sess-a"]
+        # Only the changed and the new row were formatted
+        assert dt.fromtimestamp.call_count == 2
+        assert app._session_items["a"][1] is item_a
+        assert app._session_items["b"][1] is item_b
+
+        # a expired
+        mock_session_store.list_all.return_value = [row("b", 6, 300), row("c", 1, 250)]
+        assert await refresh() == ["sess-b", "sess-c"]
+        assert "a" not in app._session_items
+
+
+@pytest.mark.asyncio
+async def test_stream_delta_skips_hidden_reply_log_then_catches_up(patched_tui_app):
+    from agent.tui.app import STREAM_FLUSH_CHARS
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._tabs.active = "tab-stm"
+        await pilot.pause()
+        with patch.object(app._reply_log, "write") as write:
+            app.post_message(StreamDelta("x" * STREAM_FLUSH_CHARS * 2))
+            await pilot.pause()
+            write.assert_not_called()
+            assert app._current_reply == "x" * STREAM_FLUSH_CHARS * 2
+
+            app._tabs.active = "tab-replies"
+            await pilot.pause()
+        write.assert_called_once()
+        assert str(write.call_args[0][0]) == app._current_reply
+
+
+def _blocking_stream(app_module, release):
+    """Make Runner.run_streamed yield one delta, then wait for release."""
+    async def stream_events():
+        for event in _text_delta_events(["partial"]):
+            yield event
+        await release.wait()
+
+    result = MagicMock()
+    result.stream_events = stream_events
+    result.to_input_list.return_value = [{"role": "user", "content": "hi"}]
+    app_module.Runner.run_streamed.return_value = result
+
+
+@pytest.mark.asyncio
+async def test_session_refresh_does_not_cancel_stream(patched_tui_app):
+    import asyncio
+    from agent.tui import app as app_module
+    release = asyncio.Event()
+    _blocking_stream(app_module, release)
+
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        await app.workers.wait_for_complete()
+        app._is_streaming = True
+        sender = app.send_message("hi")
+        await pilot.pause()
+
+        app._refresh_sessions()
+        await pilot.pause()
+        assert not sender.is_cancelled
+
+        release.set()
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert app._is_streaming is False
+        assert app._history == [{"role": "user", "content": "hi"}]
+
+
+@pytest.mark.asyncio
+async def test_memory_changed_during_stream_does_not_cancel_it(patched_tui_app):
+    import asyncio
+    from agent.tui import app as app_module
+    from agent.tui.trace_processor import MemoryChanged
+    release = asyncio.Event()
+    _blocking_stream(app_module, release)
+
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._tabs.active = "tab-ltm"
+        await pilot.pause()
+        await app.workers.wait_for_complete()
+        app._is_streaming = True
+        sender = app.send_message("hi")
+        await pilot.pause()
+
+        # A memory tool call mid-run refreshes the visible LTM tab
+        app.post_message(MemoryChanged())
+        await pilot.pause(0.3)
+        assert not sender.is_cancelled
+
+        release.set()
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert app._is_streaming is False
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_unlocks_input(patched_tui_app):
+    import asyncio
+    from textual.worker import WorkerCancelled
+    from agent.tui import app as app_module
+    _blocking_stream(app_module, asyncio.Event())
+
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        await app.workers.wait_for_complete()
+        app._is_streaming = True
+        app._user_input.disabled = True
+        sender = app.send_message("hi")
+        await pilot.pause()
+
+        sender.cancel()
+        with pytest.raises(WorkerCancelled):
+            await sender.wait()
+        await pilot.pause()
+        assert app._is_streaming is False
+        assert app._user_input.disabled is False
+        assert "partial" in str(app._reply_log.lines[-1].text)
+        app_module.Runner.run_streamed.return_value.to_input_list.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_refresh_sessions_recovers_from_cancelled_refresh(patched_tui_app, mock_session_store):
+    from textual.widgets import ListItem
+    mock_session_store.list_all.return_value = [
+        {"session_id": sid, "message_count": 1, "created_at": 0, "updated_at": t}
+        for sid, t in (("a", 200), ("b", 100))
+    ]
+    async with patched_tui_app.run_test(size=(120, 40)) as pilot:
+        app = pilot.app
+        app._refresh_sessions()
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+
+        # As left by a refresh cancelled around its insert: one tracked row
+        # that never mounted, one mounted row that is not tracked
+        app._session_items["b"] = (app._session_items["b"][0], ListItem())
+        del app._session_items["a"]
+
+        app._refresh_sessions()
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert [item.id for item in app._session_list.children] == ["sess-a", "sess-b"]
+        assert all(item.is_mounted for _, item in app._session_items.values())